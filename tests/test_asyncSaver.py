@@ -0,0 +1,98 @@
+
+# Third-Party
+import numpy as np
+import pytest
+
+# Custom
+from thePerfectlyJustSociety.coinFlip.asyncSaver import AsyncSaver
+from thePerfectlyJustSociety.coinFlip.coinFlip import CoinFlipper
+from thePerfectlyJustSociety.coinFlip.history import History, StreamingHistory, DeltaHistory
+from thePerfectlyJustSociety.coinFlip.population import Population, COLUMNS
+
+
+def makeFlipper(history=None, **kwargs):
+    flipper = CoinFlipper(Population.full(40, 10), seed=0, history=history, **kwargs)
+    flipper.flip(100)
+    return flipper
+
+
+def state(flipper):
+    return {'columns': {name: flipper.population.getColumn(name) for name in COLUMNS},
+            'winners': flipper.flips.getColumn('winner'), 'numFlips': len(flipper.flips),
+            'historyLen': len(flipper.history), 'rng': flipper.rng.bit_generator.state}
+
+
+def assertState(flipper, expected):
+    actual = state(flipper)
+    for name in COLUMNS:
+        np.testing.assert_array_equal(actual['columns'][name], expected['columns'][name])
+    np.testing.assert_array_equal(actual['winners'], expected['winners'])
+    assert (actual['numFlips'], actual['historyLen'], actual['rng']) == \
+           (expected['numFlips'], expected['historyLen'], expected['rng'])
+
+
+@pytest.mark.parametrize('makeHistory', [History, StreamingHistory, lambda: DeltaHistory(keyframeEvery=50)])
+@pytest.mark.parametrize('flipRetention', ['all', 'last'])
+def test_snapshot(tmp_path, makeHistory, flipRetention):
+    """Each save has the flipper as it was when save() was called, however much it changed while being written"""
+    flipper = makeFlipper(history=makeHistory(), flipRetention=flipRetention, keepLastFlips=30)
+    expected = []
+    with AsyncSaver(maxPending=2) as saver:
+        for i in range(3):
+            expected.append(state(flipper))
+            saver.save(flipper, tmp_path.joinpath(f'saved_{i}.flipper'))
+            flipper.flip(200, engine='numpy', blockSize=16)
+            flipper.population.add(1, 5)
+    for i, expected_state in enumerate(expected):
+        assertState(CoinFlipper.load(tmp_path.joinpath(f'saved_{i}.flipper')), expected_state)
+
+
+def test_bufferReuse():
+    """The population's columns are copied into the buffers of a written save, unless People were added"""
+    flipper = makeFlipper()
+    saver = AsyncSaver()
+    frozen = saver.freeze(flipper)
+    money = frozen.population.getColumn('money')
+    flipper.flip(50)
+    # The copy does not change with the flipper
+    np.testing.assert_array_equal(frozen.population.getColumn('money'), money)
+    assert not np.shares_memory(frozen.population._columns['money'], flipper.population._columns['money'])
+
+    saver._returnBuffers(frozen.population)
+    again = saver.freeze(flipper)
+    assert again.population._columns['money'] is frozen.population._columns['money']
+    np.testing.assert_array_equal(again.population.getColumn('money'), flipper.population.getColumn('money'))
+
+    saver._returnBuffers(again.population)
+    flipper.population.add(1, 5)
+    grown = saver.freeze(flipper)
+    assert grown.population._columns['money'] is not frozen.population._columns['money']
+    assert len(grown.population) == 41
+    saver.close()
+
+
+def test_statsKept(tmp_path):
+    """The stats computed for a save are kept by the History, so the next save only computes the new rows"""
+    flipper = makeFlipper(history=History())
+    with AsyncSaver() as saver:
+        saver.save(flipper, tmp_path.joinpath('saved.flipper'))
+        assert len(flipper.history.stats) == len(flipper.history) == 101
+        stats = flipper.history.stats
+        flipper.flip(20)
+        saver.save(flipper, tmp_path.joinpath('saved.flipper'))
+        assert len(flipper.history.stats) == 121
+        # The earlier rows are kept as they were
+        assert flipper.history.stats.iloc[:101]['max'].tolist() == stats['max'].tolist()
+    loaded = CoinFlipper.load(tmp_path.joinpath('saved.flipper'))
+    assert len(loaded.history.stats) == 121
+
+
+def test_error(tmp_path):
+    flipper = makeFlipper()
+    blocker = tmp_path.joinpath('file')
+    blocker.write_text('Not a directory')
+    saver = AsyncSaver()
+    saver.save(flipper, blocker.joinpath('saved.flipper'))
+    with pytest.raises(Exception, match='background save failed'):
+        saver.flush()
+    saver.close()
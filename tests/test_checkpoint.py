@@ -0,0 +1,166 @@
+
+# Third-Party
+import numpy as np
+import pytest
+
+# Custom
+from thePerfectlyJustSociety.coinFlip.checkpoint import Checkpointer
+from thePerfectlyJustSociety.coinFlip.coinFlip import CoinFlipper
+from thePerfectlyJustSociety.coinFlip.history import History, StreamingHistory, MemmapHistory
+from thePerfectlyJustSociety.coinFlip.population import Population
+
+
+def makeFlipper(history=None, **kwargs):
+    return CoinFlipper(Population.full(40, 10), seed=0,
+                       history=StreamingHistory(orderStats=True) if history is None else history, **kwargs)
+
+
+def snapshot(flipper):
+    return {'money': flipper.population.getColumn('money'), 'numFlips': len(flipper.flips),
+            'numSettled': flipper.flips.numSettled, 'historyLen': len(flipper.history),
+            'rng': flipper.rng.bit_generator.state}
+
+
+def assertSnapshot(flipper, expected):
+    actual = snapshot(flipper)
+    np.testing.assert_array_equal(actual.pop('money'), expected['money'])
+    assert actual == {name: value for name, value in expected.items() if name != 'money'}
+
+
+def test_recover(tmp_path):
+    flipper = makeFlipper()
+    checkpointer = Checkpointer(tmp_path, compactEvery=100)
+    checkpointer.checkpoint(flipper)
+    for _ in range(5):
+        flipper.flip(40, engine='numpy', blockSize=8)
+        checkpointer.checkpoint(flipper)
+    checkpointer.close()
+    assert checkpointer.numRecords == 5
+
+    recovered, _ = Checkpointer.recover(tmp_path)
+    assertSnapshot(recovered, snapshot(flipper))
+    np.testing.assert_array_equal(recovered.history.getStatsOverTime()['max'],
+                                  flipper.history.getStatsOverTime()['max'])
+
+
+def lastRecordsSize(segment, numRecords):
+    """The size of the last numRecords records of a segment"""
+    ends = [end for end, _ in Checkpointer._readRecords(segment)]
+    return ends[-1] - (ends[-1 - numRecords] if len(ends) > numRecords else 0)
+
+
+@pytest.mark.parametrize('cut', [1, 12, 'header'])
+def test_tornRecord(tmp_path, cut):
+    """A record cut short (by a crash partway through writing it) is ignored, and checkpointing carries on after the
+    last complete one"""
+    flipper = makeFlipper()
+    checkpointer = Checkpointer(tmp_path)
+    checkpointer.checkpoint(flipper)
+    flipper.flip(50)
+    checkpointer.checkpoint(flipper)
+    expected = snapshot(flipper)
+    flipper.flip(50)
+    checkpointer.checkpoint(flipper)
+    checkpointer.close()
+
+    segment = checkpointer._segmentPath(checkpointer.generation)
+    data = segment.read_bytes()
+    last_record = len(data) - lastRecordsSize(segment, 1)
+    segment.write_bytes(data[:last_record + 5] if cut == 'header' else data[:len(data) - cut])
+
+    recovered, checkpointer = Checkpointer.recover(tmp_path)
+    assertSnapshot(recovered, expected)
+    assert checkpointer.numRecords == 1
+
+    # Carrying on overwrites the torn record
+    recovered.flip(30)
+    checkpointer.checkpoint(recovered)
+    checkpointer.close()
+    expected = snapshot(recovered)
+    recovered, checkpointer = Checkpointer.recover(tmp_path)
+    checkpointer.close()
+    assertSnapshot(recovered, expected)
+
+
+def test_corruptRecord(tmp_path):
+    flipper = makeFlipper()
+    checkpointer = Checkpointer(tmp_path)
+    checkpointer.checkpoint(flipper)
+    flipper.flip(20)
+    checkpointer.checkpoint(flipper)
+    expected = snapshot(flipper)
+    flipper.flip(20)
+    checkpointer.checkpoint(flipper)
+    checkpointer.close()
+
+    segment = checkpointer._segmentPath(checkpointer.generation)
+    data = bytearray(segment.read_bytes())
+    data[-3] ^= 0xFF
+    segment.write_bytes(bytes(data))
+    recovered, checkpointer = Checkpointer.recover(tmp_path)
+    checkpointer.close()
+    assertSnapshot(recovered, expected)
+
+
+def test_compact(tmp_path):
+    """Compacting starts a new generation and deletes the old one"""
+    flipper = makeFlipper()
+    checkpointer = Checkpointer(tmp_path, compactEvery=3)
+    for _ in range(8):
+        flipper.flip(10)
+        checkpointer.checkpoint(flipper)
+    checkpointer.close()
+    assert checkpointer.generation > 0
+    assert Checkpointer._generations(tmp_path) == [checkpointer.generation]
+    recovered, checkpointer = Checkpointer.recover(tmp_path)
+    checkpointer.close()
+    assertSnapshot(recovered, snapshot(flipper))
+
+
+@pytest.mark.parametrize('kwargs', [dict(history=History()), dict(flipRetention='count')])
+def test_notRecordable(tmp_path, kwargs):
+    """Flippers whose changes can not be recorded are compacted on every checkpoint instead"""
+    flipper = makeFlipper(**kwargs)
+    checkpointer = Checkpointer(tmp_path)
+    for _ in range(3):
+        flipper.flip(10)
+        checkpointer.checkpoint(flipper)
+    checkpointer.close()
+    assert checkpointer.numRecords == 0
+    recovered, checkpointer = Checkpointer.recover(tmp_path)
+    checkpointer.close()
+    assertSnapshot(recovered, snapshot(flipper))
+
+
+def test_memmapHistory(tmp_path):
+    """A MemmapHistory's rows are not copied into the records, and rows added after the last checkpoint (before a
+    crash) are left alone when the recovered flipper carries on"""
+    flipper = makeFlipper(history=MemmapHistory(tmp_path.joinpath('history')))
+    checkpointer = Checkpointer(tmp_path.joinpath('checkpoints'))
+    for _ in range(3):
+        flipper.flip(10)
+        checkpointer.checkpoint(flipper)
+    expected = snapshot(flipper)
+    flipper.flip(10)
+    flipper.history.close()
+    checkpointer.close()
+    assert checkpointer.numRecords == 2
+
+    recovered, checkpointer = Checkpointer.recover(tmp_path.joinpath('checkpoints'))
+    assertSnapshot(recovered, expected)
+    recovered.flip(5)
+    assert recovered.history.directory != tmp_path.joinpath('history')
+    # The snapshot does not know about the copy, so the next checkpoint is a new one
+    generation = checkpointer.generation
+    checkpointer.checkpoint(recovered)
+    checkpointer.close()
+    assert checkpointer.generation == generation + 1
+    expected = snapshot(recovered)
+    recovered, checkpointer = Checkpointer.recover(tmp_path.joinpath('checkpoints'))
+    checkpointer.close()
+    assertSnapshot(recovered, expected)
+
+
+def test_nothingToRecover(tmp_path):
+    with pytest.raises(Exception):
+        Checkpointer.recover(tmp_path)
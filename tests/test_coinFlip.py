@@ -0,0 +1,83 @@
+
+# Third-Party
+import numpy as np
+import pytest
+
+# Custom
+from thePerfectlyJustSociety.coinFlip.coinFlip import CoinFlipper
+from thePerfectlyJustSociety.coinFlip.population import Population
+
+
+@pytest.mark.parametrize('numPeople', [10, 11])
+def test_roundPairs(numPeople):
+    """A round pairs up everyone (but one, for an odd number of people) exactly once"""
+    flipper = CoinFlipper(Population.full(numPeople, 5), selectionStyle='rounds', seed=0)
+    flipper.flipRound()
+    assert len(flipper.flips) == numPeople // 2 and flipper.numRounds == 1
+    paired = np.concatenate([flipper.flips.getColumn('winner'), flipper.flips.getColumn('loser')])
+    assert len(set(paired.tolist())) == len(paired) == 2 * (numPeople // 2)
+
+    money = flipper.population.getColumn('money')
+    np.testing.assert_array_equal(money[flipper.flips.getColumn('winner')], 6)
+    np.testing.assert_array_equal(money[flipper.flips.getColumn('loser')], 4)
+    assert flipper.population.getColumn('numWins').sum() == flipper.population.getColumn('numLosses').sum() == 5
+
+
+def test_roundsBrokeIsOut():
+    """People who go broke sit out later rounds, and losers who can not pay are not settled"""
+    flipper = CoinFlipper(Population.full(40, 2), dollarsPerFlip=2, selectionStyle='rounds', seed=0)
+    flipper.flip(2)
+    assert flipper.numRounds == 2 and len(flipper.history) == 3
+    money = flipper.population.getColumn('money')
+    assert money.sum() == 80 and money.min() == 0
+    solvent = np.flatnonzero(money > 0)
+    assert sorted(flipper.solventIndex.members.tolist()) == solvent.tolist()
+    # Only solvent people are paired in the next round
+    num_flips = len(flipper.flips)
+    flipper.flipRound()
+    assert len(flipper.flips) - num_flips == len(solvent) // 2
+    assert set(flipper.flips.recordsSince(num_flips)['loser'].tolist()) <= set(solvent.tolist())
+
+    flipper = CoinFlipper(Population.full(4, 1), dollarsPerFlip=2, brokeIsOut=False, selectionStyle='rounds', seed=0)
+    flipper.flipRound()
+    assert flipper.flips.numSettled == 0
+    np.testing.assert_array_equal(flipper.population.getColumn('money'), 1)
+
+
+def test_roundsNotFlipOnce():
+    flipper = CoinFlipper(Population.full(4, 5), selectionStyle='rounds', seed=0)
+    with pytest.raises(Exception):
+        flipper.flipOnce()
+    flipper = CoinFlipper(Population.full(2, 1), selectionStyle='rounds', seed=0)
+    flipper.flip(1)
+    with pytest.raises(Exception, match='eligible'):
+        flipper.flip(1)
+
+
+def test_fastForward():
+    flipper = CoinFlipper(Population.full(50, 10), allowDebt=True, brokeIsOut=False, seed=0)
+    flipper.flip(10)
+    flipper.fastForward(10 ** 6)
+    assert len(flipper.flips) == 10 ** 6 + 10 and len(flipper.history) == 12
+    money = flipper.population.getColumn('money')
+    wins, losses = flipper.population.getColumn('numWins'), flipper.population.getColumn('numLosses')
+    assert money.sum() == 500 and wins.sum() == losses.sum() == 10 ** 6 + 10
+    np.testing.assert_array_equal(money, 10 + wins - losses)
+
+
+def test_drawLosses():
+    """No one loses a flip they won, and each flip's loser is anyone else with the same chance"""
+    flipper = CoinFlipper(Population.full(5, 10), allowDebt=True, brokeIsOut=False, seed=0)
+    assert flipper._drawLosses(np.array([7, 3])).tolist() == [3, 7]
+    assert flipper._drawLosses(np.array([1000, 0, 0]))[0] == 0
+    losses = flipper._drawLosses(np.array([30_000, 0, 60_000, 0, 0]))
+    assert losses.sum() == 90_000
+    np.testing.assert_allclose(losses, [15_000, 22_500, 7_500, 22_500, 22_500], atol=500)
+
+
+@pytest.mark.parametrize('kwargs', [dict(allowDebt=False, brokeIsOut=False), dict(allowDebt=True, brokeIsOut=True),
+                                    dict(allowDebt=True, brokeIsOut=False, selectionStyle='rounds')])
+def test_fastForwardNotAllowed(kwargs):
+    """Runs where a flip can be stopped (or that pair people up in rounds) can not be fast forwarded"""
+    with pytest.raises(Exception):
+        CoinFlipper(Population.full(10, 10), seed=0, **kwargs).fastForward(100)
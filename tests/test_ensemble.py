@@ -0,0 +1,32 @@
+
+# Third-Party
+import numpy as np
+import pandas as pd
+import pytest
+
+# Custom
+from thePerfectlyJustSociety.coinFlip.ensemble import runEnsemble, runOne
+
+
+def test_runOne():
+    job = dict(numPeople=20, startMoney=10, dollarsPerFlip=1, allowDebt=False, run=0,
+               seed=np.random.SeedSequence(0), numFlips=120, recordEvery=50, engine='numpy')
+    rows = runOne(job)
+    assert [row['numFlips'] for row in rows] == [0, 50, 100, 120]
+    assert rows[0]['top_10_percent_wealth'] == pytest.approx(10)
+
+
+def test_runEnsemble(tmp_path):
+    output_path = tmp_path.joinpath('runs.csv')
+    agg = runEnsemble(numRuns=2, numFlips=100, numPeople=20, startMoney=[5, 10], recordEvery=50, seed=0,
+                      outputPath=output_path, maxWorkers=1, logProgress=False)
+    assert len(pd.read_csv(output_path)) == 2 * 2 * 3
+    assert agg['numFlips'].tolist() == [0, 50, 100] * 2
+
+
+@pytest.mark.parametrize('recordEvery', [0, -5])
+def test_recordEvery(tmp_path, recordEvery):
+    with pytest.raises(Exception, match='recordEvery'):
+        runEnsemble(numRuns=1, numFlips=10, numPeople=10, recordEvery=recordEvery,
+                    outputPath=tmp_path.joinpath('runs.csv'), logProgress=False)
+    assert not tmp_path.joinpath('runs.csv').exists()
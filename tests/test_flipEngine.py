@@ -0,0 +1,78 @@
+
+# Third-Party
+import numpy as np
+import pytest
+
+# Custom
+from thePerfectlyJustSociety.coinFlip.coinFlip import CoinFlipper
+from thePerfectlyJustSociety.coinFlip.flipEngine import NumpyFlipEngine
+from thePerfectlyJustSociety.coinFlip.population import Population
+
+
+def replay(money, winners, losers, settled, bet, allowDebt, brokeIsOut):
+    """Settle the engine's flips one at a time, the way CoinFlipper.flipOnce does, checking each as it goes
+        Returns:
+            The money after every flip and the number of losers that went broke
+    """
+    money = np.array(money, dtype=np.int64)
+    num_broke = 0
+    for winner, loser, was_settled in zip(winners, losers, settled):
+        assert winner != loser
+        if brokeIsOut:
+            # Only people who are still solvent can be picked
+            assert money[winner] > 0 and money[loser] > 0
+        assert was_settled == (allowDebt or money[loser] >= bet)
+        if was_settled:
+            money[winner] += bet
+            money[loser] -= bet
+            num_broke += money[loser] <= 0
+    return money, num_broke
+
+
+@pytest.mark.parametrize('allowDebt', [False, True])
+@pytest.mark.parametrize('brokeIsOut', [False, True])
+def test_settleLikeFlipOnce(allowDebt, brokeIsOut):
+    rng = np.random.default_rng(0)
+    # Little money and a big bet, so people go broke (and can not pay) partway through the blocks
+    money = rng.integers(1, 10, size=40)
+    engine = NumpyFlipEngine(money=money.copy(), numWins=np.zeros(40), numLosses=np.zeros(40), dollarsPerFlip=3,
+                             allowDebt=allowDebt, brokeIsOut=brokeIsOut, rng=rng, blockSize=10_000)
+    num_flips = 20 if brokeIsOut else 2000
+    winners, losers, settled = engine.flip(num_flips)
+
+    assert len(winners) == len(losers) == len(settled) == num_flips
+    expected, num_broke = replay(money, winners, losers, settled, 3, allowDebt, brokeIsOut)
+    np.testing.assert_array_equal(engine.money, expected)
+    np.testing.assert_array_equal(engine.numWins, np.bincount(winners[settled], minlength=40))
+    np.testing.assert_array_equal(engine.numLosses, np.bincount(losers[settled], minlength=40))
+    assert num_broke > 0
+    if not allowDebt:
+        assert not settled.all()
+    if brokeIsOut:
+        np.testing.assert_array_equal(np.sort(engine.eligible), np.flatnonzero(expected > 0))
+
+
+def test_brokeMidBlock():
+    # Everyone starts with exactly one bet, so most losers go broke partway through a block and end it
+    rng = np.random.default_rng(1)
+    money = np.full(100, 5)
+    engine = NumpyFlipEngine(money=money.copy(), numWins=np.zeros(100), numLosses=np.zeros(100), dollarsPerFlip=5,
+                             brokeIsOut=True, rng=rng, blockSize=1000)
+    winners, losers, settled = engine.flip(60)
+
+    expected, num_broke = replay(money, winners, losers, settled, 5, False, True)
+    np.testing.assert_array_equal(engine.money, expected)
+    assert num_broke > 10
+    assert len(engine.eligible) == 100 - num_broke
+
+
+def test_flipperNumpyEngine():
+    """The flipper's population ends up where its flip log says it should, and the money is all still there"""
+    flipper = CoinFlipper(Population.full(50, 10), dollarsPerFlip=2, seed=3)
+    flipper.flip(3000, engine='numpy', blockSize=500)
+    records = flipper.flips.recordsSince(0)
+
+    expected, _ = replay(np.full(50, 10), records['winner'], records['loser'], records['settled'], 2, False, True)
+    np.testing.assert_array_equal(flipper.population.getColumn('money'), expected)
+    assert flipper.population.totalMoney == 50 * 10
+    assert len(flipper.flips) == 3000
@@ -0,0 +1,62 @@
+
+# Third-Party
+import pytest
+
+pytest.importorskip('flask')
+
+# Custom
+from thePerfectlyJustSociety.coinFlip.coinFlip import CoinFlipper
+from thePerfectlyJustSociety.coinFlip.flipManager import FlipperCache
+from thePerfectlyJustSociety.coinFlip.history import StreamingHistory
+from thePerfectlyJustSociety.coinFlip.population import Population
+
+
+def makeFlipper(numPeople=100):
+    return CoinFlipper(Population.full(numPeople, 10), seed=0, history=StreamingHistory())
+
+
+class Loader:
+    """A load function for FlipperCache.get that counts how often it was called"""
+    def __init__(self):
+        self.numLoads = 0
+
+    def __call__(self):
+        self.numLoads += 1
+        return makeFlipper()
+
+
+def test_hitsAndStamps():
+    cache = FlipperCache()
+    load = Loader()
+    flipper = cache.get('a', 1, load)
+    assert cache.get('a', 1, load) is flipper
+    assert (cache.hits, cache.misses, load.numLoads) == (1, 1, 1)
+    # A new stamp (a save by someone else) loads it again
+    assert cache.get('a', 2, load) is not flipper
+    assert load.numLoads == 2 and len(cache) == 1
+
+
+def test_lruMaxEntries():
+    cache = FlipperCache(maxEntries=2)
+    load = Loader()
+    for key in ('a', 'b'):
+        cache.get(key, 0, load)
+    cache.get('a', 0, load)
+    cache.get('c', 0, load)
+    # b was the least recently used
+    assert list(cache._entries) == ['a', 'c']
+    cache.get('b', 0, load)
+    assert list(cache._entries) == ['c', 'b'] and load.numLoads == 4
+
+
+def test_lruMaxBytes():
+    size = FlipperCache.sizeOf(makeFlipper())
+    cache = FlipperCache(maxBytes=int(2.5 * size))
+    for key in 'abcd':
+        cache.put(key, 0, makeFlipper())
+    assert list(cache._entries) == ['c', 'd'] and cache._numBytes == 2 * size
+    # The newest is kept, even if it is too big on its own
+    cache.put('big', 0, makeFlipper(numPeople=10_000))
+    assert list(cache._entries) == ['big']
+    cache.invalidate('big')
+    assert len(cache) == 0 and cache._numBytes == 0
@@ -0,0 +1,95 @@
+
+# Third-Party
+import numpy as np
+import pytest
+
+# Custom
+from thePerfectlyJustSociety.coinFlip.flips import Flips
+from thePerfectlyJustSociety.coinFlip.population import Population
+
+
+def logFlips(flips, num, start=0):
+    """Log num flips, numbered from start (the winner's row is the flip number) and every third one unsettled"""
+    numbers = np.arange(start, start + num)
+    flips.extendArrays(numbers % 10, (numbers + 1) % 10, 1, numbers % 3 != 0)
+
+
+def test_all():
+    flips = Flips(population=Population.full(10, 5))
+    logFlips(flips, 25)
+    assert len(flips) == flips.numRecorded == 25
+    assert flips.numSettled == sum(i % 3 != 0 for i in range(25))
+    assert flips[12].winner.row == 2 and flips[-1].loser.row == 5
+    assert flips[3].settled is False
+    np.testing.assert_array_equal(flips.getColumn('winner'), np.arange(25) % 10)
+
+
+def test_last():
+    flips = Flips(retention='last', keepLast=10, population=Population.full(10, 5))
+    for start in range(0, 50, 7):
+        logFlips(flips, 7, start=start)
+    assert len(flips) == flips.numRecorded == 56
+    assert flips.numSettled == sum(i % 3 != 0 for i in range(56))
+    # Only the newest flips are kept, but the flip numbers still count from the first flip
+    assert flips[55].winner.row == 5 and flips[46].winner.row == 6
+    with pytest.raises(IndexError):
+        flips[10]
+    records = flips.recordsSince(flips.numRecorded - 5)
+    np.testing.assert_array_equal(records['winner'], np.arange(51, 56) % 10)
+    with pytest.raises(IndexError):
+        flips.recordsSince(0)
+    # Iterating goes over the kept flips only
+    kept = list(flips)
+    assert len(kept) == flips.numKept < len(flips)
+    assert [flip.winner.row for flip in kept] == flips.getColumn('winner').tolist()
+    assert kept[-1].winner.row == flips[55].winner.row
+
+
+def test_lastMoreThanKept():
+    flips = Flips(retention='last', keepLast=10)
+    logFlips(flips, 35)
+    assert len(flips) == 35
+    np.testing.assert_array_equal(flips.getColumn('winner'), np.arange(25, 35) % 10)
+
+
+@pytest.mark.parametrize('retention', ['count', 'off'])
+def test_countOnly(retention):
+    flips = Flips(retention=retention)
+    logFlips(flips, 30)
+    flips.advance(5)
+    assert len(flips) == 35
+    assert flips.numRecorded == 0
+    assert flips.numSettled == (20 + 5 if retention == 'count' else 0)
+    with pytest.raises(IndexError):
+        flips[0]
+
+
+def test_advance():
+    """Flips counted without being logged (e.g. by CoinFlipper.fastForward) can not be indexed, but later ones can"""
+    flips = Flips(population=Population.full(10, 5))
+    logFlips(flips, 5)
+    flips.advance(100, numSettled=60)
+    logFlips(flips, 5, start=5)
+    assert len(flips) == 110
+    assert flips.numSettled == 3 + 60 + 3
+    assert flips.numKept == len(list(flips)) == 10
+    assert flips[4].winner.row == 4 and flips[105].winner.row == 5
+    with pytest.raises(IndexError):
+        flips[50]
+
+
+def test_noPopulation():
+    """Flips logged without a Population can be counted and read as columns, but not as Flips"""
+    flips = Flips()
+    logFlips(flips, 5)
+    assert flips.numKept == 5
+    np.testing.assert_array_equal(flips.getColumn('loser'), np.arange(1, 6))
+    with pytest.raises(Exception, match='no Population'):
+        flips[0]
+    with pytest.raises(Exception, match='no Population'):
+        list(flips)
+
+
+def test_unknownRetention():
+    with pytest.raises(Exception):
+        Flips(retention='some')
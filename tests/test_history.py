@@ -0,0 +1,134 @@
+
+# Third-Party
+import numpy as np
+import pandas as pd
+import pytest
+
+# Custom
+from thePerfectlyJustSociety.coinFlip.coinFlip import CoinFlipper
+from thePerfectlyJustSociety.coinFlip.history import History, StreamingHistory, MemmapHistory, DeltaHistory
+from thePerfectlyJustSociety.coinFlip.population import Population
+
+
+def statsOverTime(history, numFlips=300, includeTopX=True):
+    """The stats of the same flips, kept by the given History"""
+    flipper = CoinFlipper(Population.full(40, 5), seed=3, history=history)
+    flipper.flip(numFlips)
+    return flipper.history.getStatsOverTime(includeTopX=includeTopX)
+
+
+@pytest.mark.parametrize('includeTopX', [True, False, [0, 2]])
+def test_streamingMatchesHistory(includeTopX):
+    """A StreamingHistory (growing from a tiny capacity) keeps the same stats as a History, without the money"""
+    stats = statsOverTime(StreamingHistory(includeTopX=includeTopX, capacity=4))
+    expected = statsOverTime(History(), includeTopX=includeTopX)
+    assert len(stats) == len(expected) == 301
+    assert 'money' not in stats.columns
+    pd.testing.assert_frame_equal(stats, expected.drop(columns='money').reset_index(drop=True), check_dtype=False)
+
+
+def test_streamingNoSnapshots():
+    flipper = CoinFlipper(Population.full(40, 5), seed=3, history=StreamingHistory())
+    flipper.flip(20)
+    assert flipper.history.numFlips == list(range(21))
+    with pytest.raises(Exception):
+        flipper.history.at(10)
+
+
+def test_memmapMatchesHistory(tmp_path):
+    stats = statsOverTime(MemmapHistory(tmp_path.joinpath('history')))
+    expected = statsOverTime(History())
+    pd.testing.assert_frame_equal(stats, expected.drop(columns='money').reset_index(drop=True), check_dtype=False)
+    # A MemmapHistory for the same directory carries on from the rows on disk
+    assert len(MemmapHistory(tmp_path.joinpath('history'))) == 301
+
+
+def test_memmapOlderSave(tmp_path):
+    """Carrying on from an older save copies its rows, and leaves the rows of newer saves alone"""
+    flipper = CoinFlipper(Population.full(20, 5), seed=0, history=MemmapHistory(tmp_path.joinpath('history')))
+    flipper.flip(10)
+    flipper.save(tmp_path.joinpath('older.flipper'))
+    flipper.flip(20)
+    flipper.save(tmp_path.joinpath('newer.flipper'))
+    newer_stamps = np.array(flipper.history.moneyStamps)
+
+    older = CoinFlipper.load(tmp_path.joinpath('older.flipper'))
+    assert len(older.history) == 11
+    older.flip(5)
+    assert older.history.directory != flipper.history.directory
+    assert len(older.history) == 16
+    np.testing.assert_array_equal(older.history.moneyStamps[:11], newer_stamps[:11])
+    np.testing.assert_array_equal(older.history.moneyStamps[-1], older.population.getColumn('money'))
+
+    newer = CoinFlipper.load(tmp_path.joinpath('newer.flipper'))
+    assert newer.history.directory == flipper.history.directory
+    np.testing.assert_array_equal(newer.history.moneyStamps, newer_stamps)
+
+
+def test_memmapTornRow(tmp_path):
+    """A row cut short by an interrupted write is dropped, and the next row is added in its place"""
+    history = MemmapHistory(tmp_path)
+    flipper = CoinFlipper(Population.full(20, 5), seed=0, history=history)
+    flipper.flip(3)
+    history.close()
+    with open(tmp_path.joinpath(MemmapHistory.MONEY_FILE), 'ab') as f:
+        f.write(b'\x01' * 7)
+
+    history = MemmapHistory(tmp_path)
+    assert len(history) == 4
+    history.add(flipper.population, 4)
+    assert history.directory == tmp_path
+    assert history.numFlips == [0, 1, 2, 3, 4]
+    np.testing.assert_array_equal(history.getMoneyStamp(4), flipper.population.getColumn('money'))
+
+
+def flipAndRecord(flipper, numFlips, engine='python', blockSize=1):
+    """Flip one block at a time, keeping the money, wins and losses after each (by number of flips)"""
+    recorded = {}
+    while len(flipper.flips) < numFlips:
+        flipper.flip(blockSize, engine=engine, blockSize=blockSize)
+        recorded[len(flipper.flips)] = {name: flipper.population.getColumn(name)
+                                        for name in DeltaHistory.KEYFRAME_COLUMNS}
+    return recorded
+
+
+@pytest.mark.parametrize('engine, blockSize', [('python', 1), ('numpy', 64)])
+def test_at(engine, blockSize):
+    flipper = CoinFlipper(Population.full(30, 5), seed=0, history=DeltaHistory(keyframeEvery=100))
+    recorded = flipAndRecord(flipper, 1000, engine=engine, blockSize=blockSize)
+    history = flipper.history
+    assert history.numKeyframes > 5
+
+    for num_flips in [0, 1, 99, 100, 101, 450, max(recorded)]:
+        if num_flips not in recorded and num_flips:
+            continue
+        population = history.at(num_flips)
+        expected = recorded.get(num_flips, {name: np.full(30, 5 if name == 'money' else 0)
+                                            for name in DeltaHistory.KEYFRAME_COLUMNS})
+        for name, values in expected.items():
+            np.testing.assert_array_equal(population.getColumn(name), values)
+        np.testing.assert_array_equal(population.getColumn('startMoney'), np.full(30, 5))
+
+
+def test_atAfterFastForward():
+    """A population changed some other way than flipping starts again from a keyframe"""
+    flipper = CoinFlipper(Population.full(30, 5), allowDebt=True, brokeIsOut=False, seed=0,
+                          history=DeltaHistory(keyframeEvery=10_000))
+    flipper.flip(50)
+    flipper.fastForward(500)
+    after_fast_forward = flipper.population.getColumn('money')
+    recorded = flipAndRecord(flipper, 600)
+
+    np.testing.assert_array_equal(flipper.history.at(550).getColumn('money'), after_fast_forward)
+    np.testing.assert_array_equal(flipper.history.at(600).getColumn('money'), recorded[600]['money'])
+
+
+def test_statsMatchSnapshots():
+    flipper = CoinFlipper(Population.full(30, 5), seed=0, history=DeltaHistory(keyframeEvery=25))
+    recorded = flipAndRecord(flipper, 200)
+    stats = flipper.history.getStatsOverTime()
+    assert len(stats) == len(flipper.history) == 201
+    for num_flips in (1, 26, 200):
+        row = stats[stats['numFlips'] == num_flips].iloc[0]
+        assert row['max'] == recorded[num_flips]['money'].max()
+        assert row['median'] == np.median(recorded[num_flips]['money'])
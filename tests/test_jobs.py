@@ -0,0 +1,256 @@
+
+# Built-In Python
+import sys
+import time
+import types
+
+# Third-Party
+import numpy as np
+import pytest
+
+# Custom
+from thePerfectlyJustSociety.coinFlip.coinFlip import CoinFlipper
+from thePerfectlyJustSociety.coinFlip.history import StreamingHistory
+from thePerfectlyJustSociety.coinFlip.jobs import JobQueue, JobCancelled, TooManyJobs, flipJob, FLIP_JOB_FILE
+from thePerfectlyJustSociety.coinFlip.population import Population
+from thePerfectlyJustSociety.coinFlip.sessionStore import SqliteSessionStore
+
+# What the jobs run in this process (with runNext) did, in order
+RAN = []
+
+
+def record(job, name):
+    RAN.append(name)
+    return name
+
+
+def publishThree(job):
+    for i in range(3):
+        job.publish({'i': i})
+
+
+def cancelItself(job):
+    job.queue.cancel(job.jobId)
+    job.checkCancelled()
+
+
+def checkCancelled(job):
+    job.checkCancelled()
+    return 'not cancelled'
+
+
+def fail(job):
+    raise ValueError('Something went wrong')
+
+
+@pytest.fixture
+def queue(tmp_path):
+    RAN.clear()
+    return JobQueue(tmp_path.joinpath('jobs.sqlite'), maxWorkers=2, maxJobsPerSession=2)
+
+
+def test_submit(queue):
+    job_id = queue.submit('a', record, 'first')
+    assert queue.status(job_id)['state'] == 'queued'
+    assert queue.runNext()
+    assert not queue.runNext()
+    assert queue.status(job_id) == {'state': 'done', 'progress': 1.0, 'error': None}
+    assert queue.result(job_id) == 'first'
+    assert RAN == ['first']
+
+
+def test_fairness(queue):
+    """A session's second job waits for other sessions' first ones, even if it was submitted before them"""
+    queue.submit('a', record, 'a1')
+    queue.submit('a', record, 'a2')
+    queue.submit('b', record, 'b1')
+    queue.submit('c', record, 'c1')
+    while queue.runNext():
+        pass
+    assert RAN == ['a1', 'b1', 'c1', 'a2']
+
+
+def test_tooManyJobs(queue):
+    queue.submit('a', record, 'a1')
+    queue.submit('a', record, 'a2')
+    with pytest.raises(TooManyJobs):
+        queue.submit('a', record, 'a3')
+    # Other sessions are not held up
+    queue.submit('b', record, 'b1')
+    queue.runNext()
+    queue.submit('a', record, 'a3')
+
+
+def test_cancelQueued(queue):
+    job_id = queue.submit('a', record, 'a1')
+    assert queue.cancel(job_id)
+    assert not queue.runNext()
+    assert RAN == []
+    with pytest.raises(JobCancelled):
+        queue.result(job_id)
+    assert not queue.cancel(job_id)
+
+
+def test_cancelRunning(queue):
+    job_id = queue.submit('a', cancelItself)
+    queue.runNext()
+    assert queue.status(job_id)['state'] == 'cancelled'
+
+
+def test_cancelSession(queue):
+    job_ids = [queue.submit('a', record, 'a1'), queue.submit('a', record, 'a2')]
+    other = queue.submit('b', record, 'b1')
+    assert queue.cancelSession('a')
+    assert [queue.status(job_id)['state'] for job_id in job_ids] == ['cancelled', 'cancelled']
+    assert queue.status(other)['state'] == 'queued'
+
+
+def test_abandoned(queue):
+    job_id = queue.submit('a', checkCancelled, abandonAfter=0.05)
+    time.sleep(0.1)
+    queue.runNext()
+    assert queue.status(job_id)['state'] == 'cancelled'
+
+    job_id = queue.submit('a', checkCancelled, abandonAfter=60)
+    queue.runNext()
+    assert queue.result(job_id) == 'not cancelled'
+
+
+def test_failed(queue):
+    job_id = queue.submit('a', fail)
+    queue.runNext()
+    status = queue.status(job_id)
+    assert status['state'] == 'failed' and 'Something went wrong' in status['error']
+    with pytest.raises(Exception, match='Something went wrong'):
+        queue.result(job_id)
+
+
+def test_updates(queue):
+    job_id = queue.submit('a', publishThree)
+    queue.runNext()
+    updates, since = queue.updates(job_id)
+    assert updates == [{'i': 0}, {'i': 1}, {'i': 2}] and since == 3
+    assert queue.updates(job_id, since=2) == ([{'i': 2}], 3)
+    assert queue.updates(job_id, since=3) == ([], 3)
+
+
+def test_workers(queue, tmp_path):
+    """Only one pool of workers runs for a database, and a job left running by a pool that is gone is run again"""
+    stale = queue.submit('a', record, 'stale')
+    queue._claim()
+    assert queue.status(stale)['state'] == 'running'
+    assert not queue.workersAlive()
+
+    assert queue.start()
+    try:
+        other = JobQueue(queue.path)
+        assert not other.start(lockTimeout=0.1)
+        assert other.workersAlive()
+        assert queue.result(stale, timeout=10) == 'stale'
+        assert other.result(other.submit('b', record, 'b1'), timeout=10) == 'b1'
+    finally:
+        queue.shutdown()
+    assert not other.workersAlive()
+
+
+def test_lockWithoutFcntl(queue, monkeypatch):
+    """Where there is no fcntl (Windows), the pool's lock is taken with msvcrt"""
+    held = set()
+
+    def locking(fd, mode, numBytes):
+        if mode == msvcrt.LK_NBLCK:
+            if queue.lockPath in held:
+                raise PermissionError('Locked')
+            held.add(queue.lockPath)
+
+    msvcrt = types.SimpleNamespace(LK_NBLCK=2, locking=locking)
+    monkeypatch.setitem(sys.modules, 'msvcrt', msvcrt)
+    monkeypatch.setitem(sys.modules, 'fcntl', None)
+    monkeypatch.setattr('thePerfectlyJustSociety.coinFlip.jobs.os.name', 'nt')
+    lock_file = queue._lockPool()
+    assert lock_file is not None
+    assert queue._lockPool(shared=True) is None
+    lock_file.close()
+
+
+class FakeJob:
+    """A Job for calling flipJob in this process, cancelled after it has checked numChecks times"""
+    def __init__(self, numChecks=None):
+        self.numChecks = numChecks
+        self.progress = 0
+        self.updates = []
+
+    def setProgress(self, progress):
+        self.progress = progress
+
+    def checkCancelled(self):
+        if self.numChecks is not None:
+            if not self.numChecks:
+                raise JobCancelled(f"{self} was cancelled")
+            self.numChecks -= 1
+
+    def publish(self, update):
+        self.updates.append(update)
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = SqliteSessionStore(tmp_path.joinpath('sessions.sqlite'), tmpDirectory=tmp_path.joinpath('tmp'))
+    store.save('a', CoinFlipper(Population.full(30, 100), seed=0, history=StreamingHistory(orderStats=True)))
+    yield store
+    store.close()
+
+
+def publishedFlips(job):
+    return np.concatenate([update['historyRows']['numFlips'] for update in job.updates])
+
+
+def test_flipJobHistory(store):
+    """A History row is kept every numFlips // historyPoints flips, and all of them are published"""
+    job = FakeJob()
+    assert flipJob(job, store, 'a', 5000, historyPoints=1000) == 5000
+    flipper = store.load('a')
+    assert len(flipper.history) == 1001
+    np.testing.assert_array_equal(publishedFlips(job), np.arange(5, 5001, 5))
+    assert job.progress == 1
+    assert not store.tmpDir('a').joinpath('flipJob').exists()
+
+
+def test_flipJobResume(store):
+    """A cancelled flipJob leaves the session as it was, and the next one for as many flips carries on from it"""
+    expected = store.load('a')
+    expected.flip(1000, engine='numpy', blockSize=1)
+
+    job = FakeJob(numChecks=3)
+    with pytest.raises(JobCancelled):
+        flipJob(job, store, 'a', 1000)
+    assert len(store.load('a').flips) == 0
+    assert job.progress == 0.3
+    assert store.tmpDir('a').joinpath('flipJob', FLIP_JOB_FILE).exists()
+
+    job = FakeJob()
+    assert flipJob(job, store, 'a', 1000) == 1000
+    flipper = store.load('a')
+    np.testing.assert_array_equal(flipper.population.getColumn('money'), expected.population.getColumn('money'))
+    assert len(flipper.history) == 1001
+    # The rows of the cancelled job are published again
+    np.testing.assert_array_equal(publishedFlips(job), np.arange(1, 1001))
+    assert not store.tmpDir('a').joinpath('flipJob').exists()
+
+
+@pytest.mark.parametrize('change', ['numFlips', 'save'])
+def test_flipJobStartsAgain(store, change):
+    """A checkpoint is not carried on by a flipJob for another number of flips, or after the session was saved"""
+    with pytest.raises(JobCancelled):
+        flipJob(FakeJob(numChecks=3), store, 'a', 1000)
+    if change == 'save':
+        flipper = store.load('a')
+        flipper.flip(10)
+        store.save('a', flipper)
+    num_flips = 500 if change == 'numFlips' else 1000
+
+    job = FakeJob()
+    flipJob(job, store, 'a', num_flips)
+    start = 10 if change == 'save' else 0
+    assert len(store.load('a').flips) == start + num_flips
+    assert publishedFlips(job)[0] == start + 1
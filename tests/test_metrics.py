@@ -0,0 +1,62 @@
+
+# Third-Party
+import numpy as np
+import pytest
+
+# Custom
+from thePerfectlyJustSociety.coinFlip.metrics import METRICS, inequalityStats, gini, theil, palma, percentileRatio, \
+    lorenzCurve
+from thePerfectlyJustSociety.coinFlip.population import Population
+from thePerfectlyJustSociety.coinFlip.wealthIndex import WealthIndex
+
+ONE_TO_TEN_RATIOS = np.arange(1, 11) / 5.5
+# Money with known metrics: {name: (money, {metric: value})}
+KNOWN = {
+    'equal': ([7] * 10, {'gini': 0, 'theil': 0, 'palma': 0.25, 'ratio_90_10': 1}),
+    'oneHasEverything': ([0] * 9 + [100], {'gini': 0.9, 'theil': np.log(10), 'palma': np.inf, 'ratio_90_10': np.inf}),
+    'oneToTen': (list(range(1, 11)), {'gini': 0.3, 'theil': np.mean(ONE_TO_TEN_RATIOS * np.log(ONE_TO_TEN_RATIOS)),
+                                      'palma': 1, 'ratio_90_10': 9.1 / 1.9}),
+}
+
+
+def asKind(money, kind):
+    """The money as an array, a WealthIndex or a Population (with and without an index it keeps up to date)"""
+    if kind == 'array':
+        return np.array(money)
+    if kind == 'index':
+        return WealthIndex(money)
+    pop = Population.full(len(money), 0)
+    pop.setColumn('money', money)
+    if kind == 'indexedPopulation':
+        assert pop.wealthIndex is not None
+    return pop
+
+
+@pytest.mark.parametrize('kind', ['array', 'index', 'population', 'indexedPopulation'])
+@pytest.mark.parametrize('name', list(KNOWN))
+def test_known(name, kind):
+    money, expected = KNOWN[name]
+    functions = {'gini': gini, 'theil': theil, 'palma': palma, 'ratio_90_10': percentileRatio}
+    stats = inequalityStats(asKind(money, kind))
+    assert list(stats) == list(METRICS)
+    for metric in METRICS:
+        assert stats[metric] == pytest.approx(expected[metric], abs=1e-12)
+        assert functions[metric](asKind(money, kind)) == pytest.approx(expected[metric], abs=1e-12)
+
+
+def test_matrix():
+    """A matrix of snapshots gives one value per snapshot"""
+    money = np.array([KNOWN[name][0] for name in KNOWN])
+    stats = inequalityStats(money)
+    for metric in METRICS:
+        np.testing.assert_allclose(stats[metric], [KNOWN[name][1][metric] for name in KNOWN], atol=1e-12)
+
+
+def test_negativeMoney():
+    assert np.isnan(theil([-1, 2, 3]))
+
+
+def test_lorenzCurve():
+    shares, wealth = lorenzCurve(np.arange(1, 5))
+    np.testing.assert_allclose(shares, [0, 0.25, 0.5, 0.75, 1])
+    np.testing.assert_allclose(wealth, [0, 0.1, 0.3, 0.6, 1])
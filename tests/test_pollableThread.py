@@ -0,0 +1,53 @@
+
+# Third-Party
+import numpy as np
+
+# Custom
+from thePerfectlyJustSociety.coinFlip.checkpoint import Checkpointer
+from thePerfectlyJustSociety.coinFlip.coinFlip import CoinFlipper
+from thePerfectlyJustSociety.coinFlip.history import StreamingHistory
+from thePerfectlyJustSociety.coinFlip.pollableThread import PollableCoinFlipper
+from thePerfectlyJustSociety.coinFlip.population import Population
+
+
+def makeFlipper():
+    return CoinFlipper(Population.full(30, 10), seed=0, history=StreamingHistory())
+
+
+def runToEnd(thread):
+    thread.start()
+    thread.join()
+    return thread
+
+
+def test_noFlips(tmp_path):
+    thread = PollableCoinFlipper(flipper=makeFlipper(), numFlips=0, flipperPath=tmp_path.joinpath('saved.flipper'),
+                                 logProgress=False)
+    assert thread.pollProgress() == 1.0
+    runToEnd(thread)
+    assert thread.pollProgress() == 1.0
+    assert len(CoinFlipper.load(tmp_path.joinpath('saved.flipper')).flips) == 0
+
+
+def test_checkpointOnly(tmp_path):
+    """A run with only a checkpointDir checkpoints, and does not try to save anywhere else"""
+    done = []
+    thread = runToEnd(PollableCoinFlipper(flipper=makeFlipper(), numFlips=100, progressEvery=10, saveEvery=20,
+                                          checkpointDir=tmp_path.joinpath('checkpoints'), logProgress=False,
+                                          callback=lambda: done.append(True)))
+    assert thread.pollProgress() == 1.0
+    # It got to the end of the run
+    assert done == [True]
+    assert not tmp_path.joinpath('checkpoints', PollableCoinFlipper.JOB_FILE).exists()
+    recovered, checkpointer = Checkpointer.recover(tmp_path.joinpath('checkpoints'))
+    checkpointer.close()
+    np.testing.assert_array_equal(recovered.population.getColumn('money'), thread.flipper.population.getColumn('money'))
+    assert list(tmp_path.iterdir()) == [tmp_path.joinpath('checkpoints')]
+
+
+def test_checkpointAndPath(tmp_path):
+    """With a checkpointDir, flipperPath is saved at the end"""
+    thread = runToEnd(PollableCoinFlipper(flipper=makeFlipper(), numFlips=100, progressEvery=10, saveEvery=20,
+                                          flipperPath=tmp_path.joinpath('saved.flipper'), asyncSave=False,
+                                          checkpointDir=tmp_path.joinpath('checkpoints'), logProgress=False))
+    assert len(CoinFlipper.load(tmp_path.joinpath('saved.flipper')).flips) == len(thread.flipper.flips) == 100
@@ -0,0 +1,174 @@
+
+# Third-Party
+import numpy as np
+import pytest
+
+# Custom
+from thePerfectlyJustSociety.coinFlip.population import COLUMNS, Person, Population
+
+
+def test_columns():
+    pop = Population.full(5, 100)
+    assert len(pop) == 5
+    for name in COLUMNS:
+        assert pop.getColumn(name).dtype == np.int32
+    np.testing.assert_array_equal(pop.getColumn('idNum'), np.arange(5))
+    np.testing.assert_array_equal(pop.getColumn('money'), [100] * 5)
+    np.testing.assert_array_equal(pop.getColumn('numWins'), [0] * 5)
+
+
+def test_personView():
+    """A Person from a Population reads and writes its row of the columns"""
+    pop = Population.full(5, 100)
+    person = pop[3]
+    assert person.population is pop and person.row == 3
+    person.money += 10
+    person.numWins += 1
+    assert pop.getColumn('money')[3] == 110 and pop.getColumn('numWins')[3] == 1
+    pop.setColumn('money', [1, 2], rows=[2, 3])
+    assert person.money == 2
+    assert pop[3] == person and pop[2] != person
+    assert person.toDict() == {'idNum': 3, 'startMoney': 100, 'money': 2, 'numWins': 1, 'numLosses': 0}
+
+
+def test_personBound():
+    """A Person created directly keeps its own values until it is added to a Population, then becomes a view"""
+    people = [Person(i, 50, money=40 + i, numWins=i) for i in range(3)]
+    assert people[1].money == 41 and people[1].population is None
+    pop = Population(people)
+    assert people[1].population is pop and people[1].row == 1
+    people[1].money = 7
+    np.testing.assert_array_equal(pop.getColumn('money'), [40, 7, 42])
+    np.testing.assert_array_equal(pop.getColumn('numWins'), [0, 1, 2])
+
+
+def test_promotion():
+    """Columns start as int32 and are promoted to int64 when a value does not fit"""
+    pop = Population.full(4, 100)
+    pop[1].money = 2 ** 40
+    assert pop.getColumn('money').dtype == np.int64
+    assert pop[1].money == 2 ** 40 and pop[0].money == 100
+    # The other columns are left alone
+    assert pop.getColumn('startMoney').dtype == np.int32
+
+    pop.add(2, -2 ** 35)
+    assert pop.getColumn('startMoney').dtype == np.int64
+    np.testing.assert_array_equal(pop.getColumn('startMoney'), [100] * 4 + [-2 ** 35] * 2)
+    with pytest.raises(OverflowError):
+        pop.setColumn('numWins', [2 ** 70], rows=[0])
+
+
+def statsOf(money, total):
+    """What statsDict() gives for People with this money, out of a population with total money"""
+    if not money:
+        return [0, np.nan, np.nan, np.nan, np.nan, 0]
+    return [sum(money), np.mean(money), np.median(money), min(money), max(money), sum(money) / total * 100]
+
+
+@pytest.mark.parametrize('numPeople', [7, 250])
+def test_statsByTopX(numPeople):
+    """The stats from a single sort match the ones for each range on its own (including empty ranges)"""
+    money = np.random.default_rng(0).integers(0, 50, numPeople)
+    pop = Population.full(numPeople, 0)
+    pop.setColumn('money', money)
+    ranked = sorted(money.tolist(), reverse=True)
+
+    df = pop.getStatsByTopX()
+    for _, row in df.iterrows():
+        top = ranked[:round(numPeople * row['top_x'] / 100)]
+        expected = statsOf(top, sum(ranked))
+        np.testing.assert_allclose(row[['total', 'mean', 'median', 'min', 'max', 'percent_wealth']], expected)
+        assert row['percent_population'] == pytest.approx(len(top) / numPeople * 100)
+
+    df = pop.getStatsByTopXRanges()
+    assert len(df) == 100 and df['total'].sum() == money.sum()
+    for _, row in df.iterrows():
+        in_range = ranked[round(numPeople * row['top_x_percent_high'] / 100):
+                          round(numPeople * row['top_x_percent_low'] / 100)]
+        np.testing.assert_allclose(row[['total', 'mean', 'median', 'min', 'max']], statsOf(in_range, 1)[:5])
+
+
+def test_sortCache():
+    """The wealth sort is reused until the version changes, and any change to the People changes the version"""
+    pop = Population.full(4, 0)
+    pop.setColumn('money', [5, 9, 1, 7])
+    order, sorted_money = pop._sortedByWealth()
+    assert order.tolist() == [1, 3, 0, 2] and sorted_money.tolist() == [9, 7, 5, 1]
+    assert pop._sortedByWealth()[0] is order
+    assert not order.flags.writeable
+
+    version = pop.version
+    pop[2].money = 20
+    assert pop.version > version
+    assert pop._sortedByWealth()[0].tolist() == [2, 1, 3, 0]
+    assert pop.getWealthiest(1)[0].row == 2
+
+    version = pop.version
+    pop.add(1, 100)
+    assert pop.version > version
+    assert pop.getWealthiest(1)[0].row == 4
+    # A SubPopulation shares its owner's version
+    assert pop.getWealthiest(2).version == pop.version
+
+
+def test_fromArrays():
+    pop = Population.fromArrays(startMoney=[10, 20, 30], money=[5, 25, 2 ** 40], numWins=2)
+    assert len(pop) == 3
+    np.testing.assert_array_equal(pop.getColumn('idNum'), [0, 1, 2])
+    np.testing.assert_array_equal(pop.getColumn('numWins'), [2, 2, 2])
+    np.testing.assert_array_equal(pop.getColumn('numLosses'), [0, 0, 0])
+    assert pop[2].money == 2 ** 40 and pop.getColumn('money').dtype == np.int64
+    assert pop.getColumn('startMoney').dtype == np.int32
+    with pytest.raises(Exception):
+        Population.fromArrays(startMoney=[10, 20, 30], numWins=[1, 2])
+
+
+def test_full():
+    pop = Population.full(4, 7).add(2, [1, 2])
+    np.testing.assert_array_equal(pop.getColumn('idNum'), np.arange(6))
+    np.testing.assert_array_equal(pop.getColumn('startMoney'), [7, 7, 7, 7, 1, 2])
+    np.testing.assert_array_equal(pop.getColumn('money'), pop.getColumn('startMoney'))
+    with pytest.raises(Exception):
+        pop.add(3, [1, 2])
+
+
+def test_fromDf():
+    """A Population round-trips through toDf and fromDf, in one go instead of a Person at a time"""
+    pop = Population.fromArrays(startMoney=[10, 20, 30], money=[5, 25, 30], numWins=[0, 3, 1], numLosses=[1, 0, 1],
+                                idNum=[7, 8, 9])
+    again = Population.fromDf(pop.toDf())
+    for name in COLUMNS:
+        np.testing.assert_array_equal(again.getColumn(name), pop.getColumn(name))
+    # Missing columns get their defaults
+    partial = Population.fromDf(pop.toDf()[['startMoney', 'money']])
+    np.testing.assert_array_equal(partial.getColumn('idNum'), [0, 1, 2])
+    np.testing.assert_array_equal(partial.getColumn('numWins'), [0, 0, 0])
+    # Sorting adds a rank column, which is ignored
+    np.testing.assert_array_equal(Population.fromDf(pop.toDf(sortBy='money')).getColumn('idNum'), [9, 8, 7])
+
+
+def test_readOnlyViews():
+    """getColumn(copy=False) and toDf(copy=False) are read-only views that see later changes"""
+    pop = Population.full(4, 10)
+    view = pop.getColumn('money', copy=False)
+    df = pop.toDf(copy=False)
+    with pytest.raises(ValueError):
+        view[0] = 1
+    with pytest.raises(ValueError):
+        pop.getMoneyStamp(copy=False)[0] = 1
+    assert np.shares_memory(df['money'].to_numpy(), view)
+
+    pop[1].money = 3
+    assert view[1] == 3 and df['money'][1] == 3
+    # Copies are writable and do not see later changes
+    copied = pop.getColumn('money')
+    copied[0] = 99
+    pop[2].money = 4
+    assert pop[0].money == 10 and copied[2] == 10
+    assert pop.toDf()['money'].tolist() == [10, 3, 4, 10]
+
+    # A SubPopulation's rows are gathered, so it always gets a copy
+    sub = pop.getWealthiest(2)
+    sub_money = sub.getColumn('money', copy=False)
+    sub_money[0] = 1
+    assert pop.maxWealth == 10
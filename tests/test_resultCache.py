@@ -0,0 +1,85 @@
+
+# Third-Party
+import numpy as np
+import pytest
+
+# Custom
+from thePerfectlyJustSociety.coinFlip.coinFlip import CoinFlipper, flipCoins
+from thePerfectlyJustSociety.coinFlip.history import StreamingHistory
+from thePerfectlyJustSociety.coinFlip.population import Population
+from thePerfectlyJustSociety.coinFlip.resultCache import ResultCache
+
+KEY = dict(numFlips=300, numPeople=30, startMoney=10, dollarsPerFlip=1, allowDebt=False, seed=7, engine='python')
+
+
+def freshRun(numFlips=300, seed=7):
+    flipper = CoinFlipper(Population.full(30, 10), seed=seed, history=StreamingHistory(orderStats=True))
+    flipper.flip(numFlips)
+    return flipper
+
+
+def assertSameRun(flipper, expected):
+    assert len(flipper.flips) == len(expected.flips)
+    np.testing.assert_array_equal(flipper.population.getColumn('money'), expected.population.getColumn('money'))
+    np.testing.assert_array_equal(flipper.population.getColumn('numWins'), expected.population.getColumn('numWins'))
+    np.testing.assert_array_equal(flipper.flips.getColumn('loser'), expected.flips.getColumn('loser'))
+    assert flipper.rng.bit_generator.state == expected.rng.bit_generator.state
+    np.testing.assert_array_equal(flipper.history.getStatsOverTime()['max'], expected.history.getStatsOverTime()['max'])
+
+
+def test_exact(tmp_path):
+    cache = ResultCache(tmp_path)
+    cache.put(KEY, freshRun())
+    assertSameRun(cache.get(KEY, CoinFlipper), freshRun())
+
+
+def test_onlyExact(tmp_path):
+    """Runs for other numbers of flips are never used, so what get returns does not depend on what else is cached"""
+    cache = ResultCache(tmp_path)
+    cache.put(dict(KEY, numFlips=500), freshRun(500))
+    cache.put(dict(KEY, numFlips=100), freshRun(100))
+    assert cache.get(KEY, CoinFlipper) is None
+    with pytest.raises(Exception):
+        cache.put(KEY, freshRun(200))
+
+
+def test_noSeed(tmp_path):
+    cache = ResultCache(tmp_path)
+    cache.put(dict(KEY, seed=None), freshRun(seed=None))
+    assert cache.entries() == []
+    assert cache.get(dict(KEY, seed=None), CoinFlipper) is None
+
+
+def test_history(tmp_path):
+    """A run that did not keep a History is not used by one that wants it, and is replaced by one that kept it"""
+    cache = ResultCache(tmp_path)
+    cache.put(KEY, freshRun(), history=False)
+    assert cache.get(KEY, CoinFlipper) is None
+    assert len(cache.get(KEY, CoinFlipper, history=False).flips) == 300
+
+    cache.put(KEY, freshRun(), history=True)
+    assert ResultCache.keptHistory(cache.entryPath(**KEY))
+    # A run without a History does not replace it
+    cache.put(KEY, freshRun(), history=False)
+    assert ResultCache.keptHistory(cache.entryPath(**KEY))
+    assertSameRun(cache.get(KEY, CoinFlipper), freshRun())
+
+
+@pytest.mark.parametrize('maxBytes', [0, 10 ** 9])
+def test_evict(tmp_path, maxBytes):
+    cache = ResultCache(tmp_path, maxBytes=maxBytes)
+    for seed in range(3):
+        cache.put(dict(KEY, numFlips=50, seed=seed), freshRun(50, seed=seed))
+    # The entry just put is always kept
+    assert len(cache.entries()) == (1 if maxBytes == 0 else 3)
+    assert cache.get(dict(KEY, numFlips=50, seed=2), CoinFlipper) is not None
+
+
+@pytest.mark.parametrize('seed', [7, None])
+def test_flipCoins(tmp_path, seed):
+    kwargs = dict(numFlips=200, numPeople=30, startMoney=10, showResults=False, useCache=True, seed=seed,
+                  cacheDir=tmp_path)
+    flipCoins(**kwargs)
+    flipCoins(**kwargs)
+    entries = ResultCache(tmp_path).entries()
+    assert len(entries) == (1 if seed is not None else 0)
@@ -0,0 +1,116 @@
+
+# Built-In Python
+import time
+
+# Third-Party
+import numpy as np
+import pytest
+
+# Custom
+from thePerfectlyJustSociety.coinFlip.coinFlip import CoinFlipper
+from thePerfectlyJustSociety.coinFlip.history import History, StreamingHistory
+from thePerfectlyJustSociety.coinFlip.population import Population, COLUMNS
+from thePerfectlyJustSociety.coinFlip.sessionStore import SessionStore, SqliteSessionStore, FileSessionStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = SqliteSessionStore(tmp_path.joinpath('sessions.sqlite'), tmpDirectory=tmp_path.joinpath('tmp'))
+    yield store
+    store.close()
+
+
+def makeFlipper(history=None, numFlips=100):
+    flipper = CoinFlipper(Population.full(30, 10), seed=0,
+                          history=StreamingHistory(orderStats=True) if history is None else history)
+    flipper.flip(numFlips)
+    return flipper
+
+
+def assertSameFlipper(loaded, flipper):
+    for name in COLUMNS:
+        np.testing.assert_array_equal(loaded.population.getColumn(name), flipper.population.getColumn(name))
+    np.testing.assert_array_equal(loaded.flips.getColumn('winner'), flipper.flips.getColumn('winner'))
+    assert len(loaded.flips) == len(flipper.flips)
+    assert len(loaded.history) == len(flipper.history)
+    np.testing.assert_array_equal(loaded.history.getStatsOverTime()['max'].to_numpy(dtype=float),
+                                  flipper.history.getStatsOverTime()['max'].to_numpy(dtype=float))
+    assert loaded.rng.bit_generator.state == flipper.rng.bit_generator.state
+
+
+@pytest.mark.parametrize('makeHistory', [lambda: None, History])
+def test_saveLoad(store, makeHistory):
+    flipper = makeFlipper(makeHistory())
+    assert not store.exists('a')
+    store.save('a', flipper)
+    assert store.exists('a')
+    assertSameFlipper(store.load('a'), flipper)
+
+
+def test_saveMore(store):
+    """Saving again (only the new History rows are written) loads the latest flipper, and changes the version"""
+    flipper = makeFlipper()
+    first = store.save('a', flipper)
+    flipper.flip(50)
+    second = store.save('a', flipper)
+    assert second != first and store.version('a') == second
+    assertSameFlipper(store.load('a'), flipper)
+    # A shorter flipper (e.g. after a reset) replaces the rows
+    flipper = makeFlipper(numFlips=10)
+    store.save('a', flipper)
+    assertSameFlipper(store.load('a'), flipper)
+
+
+def test_delete(store):
+    store.save('a', makeFlipper())
+    store.tmpDir('a').mkdir(parents=True)
+    store.delete('a')
+    assert not store.exists('a')
+    assert not store.tmpDir('a').exists()
+    with pytest.raises(Exception):
+        store.load('a')
+
+
+def test_evictTtl(tmp_path):
+    store = SqliteSessionStore(tmp_path.joinpath('sessions.sqlite'), ttl=0.5, tmpDirectory=tmp_path.joinpath('tmp'))
+    store.save('old', makeFlipper())
+    store.tmpDir('old').mkdir(parents=True)
+    time.sleep(0.6)
+    # Saving evicts the sessions that have expired, other than the one being saved
+    store.save('new', makeFlipper())
+    assert not store.exists('old') and store.exists('new')
+    assert not store.tmpDir('old').exists()
+    store.close()
+
+
+def test_evictMaxBytes(tmp_path):
+    store = SqliteSessionStore(tmp_path.joinpath('sessions.sqlite'), maxBytes=1, tmpDirectory=tmp_path.joinpath('tmp'))
+    store.save('a', makeFlipper())
+    store.save('b', makeFlipper())
+    # Only the session just saved fits (it is always kept)
+    assert not store.exists('a') and store.exists('b')
+    assert store.evict(keep='b') == []
+    assert store.evict() == ['b']
+    store.close()
+
+
+def test_fileStore(tmp_path):
+    store = FileSessionStore(tmp_path)
+    flipper = makeFlipper()
+    store.save('a', flipper)
+    version = store.version('a')
+    assertSameFlipper(store.load('a'), flipper)
+    flipper.flip(10)
+    store.save('a', flipper)
+    assert store.version('a') != version
+    store.delete('a')
+    assert not store.exists('a')
+
+
+def test_abstract():
+    class PartialStore(SessionStore):
+        def exists(self, sessionId):
+            return False
+
+    with pytest.raises(TypeError):
+        PartialStore()
@@ -0,0 +1,57 @@
+
+# Third-Party
+import numpy as np
+
+# Custom
+from thePerfectlyJustSociety.coinFlip.solventIndex import SolventIndex
+
+
+def assertConsistent(index, money):
+    """The index has exactly the positions with money, and every member knows its place"""
+    assert sorted(index.members.tolist()) == np.flatnonzero(np.asarray(money) > 0).tolist()
+    for place, position in enumerate(index.members):
+        assert index._places[position] == place
+
+
+def test_init():
+    money = [3, 0, 5, -1, 2]
+    index = SolventIndex(money)
+    assert len(index) == 3 and index.populationSize == 5
+    assert 0 in index and 1 not in index and 3 not in index
+    assertConsistent(index, money)
+
+
+def test_swapRemove():
+    """Removing a member moves the last member into its place"""
+    index = SolventIndex([1, 1, 1, 1])
+    index.remove(1)
+    assert index.members.tolist() == [0, 3, 2]
+    assert index._places[1] == -1
+    # Removing someone who is not a member does nothing
+    index.remove(1)
+    index.remove(2)
+    assert index.members.tolist() == [0, 3]
+    index.add(1)
+    index.add(1)
+    assert index.members.tolist() == [0, 3, 1]
+
+
+def test_update():
+    rng = np.random.default_rng(0)
+    money = rng.integers(-2, 3, size=50)
+    index = SolventIndex(money)
+    for _ in range(500):
+        position = int(rng.integers(50))
+        money[position] += rng.choice([-1, 1])
+        index.update(position, money[position])
+        assertConsistent(index, money)
+
+
+def test_sample():
+    money = np.array([0, 4, 0, 2, 9, 0, 1])
+    index = SolventIndex(money)
+    for rng in (None, np.random.default_rng(1)):
+        picks = index.sample(4, rng)
+        assert sorted(picks) == [1, 3, 4, 6]
+        picks = index.sample(2, rng)
+        assert len(set(picks)) == 2 and all(money[p] > 0 for p in picks)
@@ -0,0 +1,117 @@
+
+# Built-In Python
+import json
+import shutil
+
+# Third-Party
+import numpy as np
+import pytest
+
+# Custom
+from thePerfectlyJustSociety.coinFlip import storage
+from thePerfectlyJustSociety.coinFlip.coinFlip import CoinFlipper
+from thePerfectlyJustSociety.coinFlip.history import History, StreamingHistory, DeltaHistory
+from thePerfectlyJustSociety.coinFlip.population import Population, COLUMNS
+from thePerfectlyJustSociety.coinFlip.flips import Flips
+
+
+def makeFlipper(history=None, flipRetention='all', numFlips=300):
+    flipper = CoinFlipper(Population.full(40, 10), seed=0, history=history, flipRetention=flipRetention,
+                          keepLastFlips=50)
+    flipper.flip(numFlips)
+    return flipper
+
+
+def assertSameFlipper(loaded, flipper):
+    for name in COLUMNS:
+        np.testing.assert_array_equal(loaded.population.getColumn(name), flipper.population.getColumn(name))
+    assert len(loaded.flips) == len(flipper.flips)
+    assert loaded.flips.numSettled == flipper.flips.numSettled
+    assert loaded.flips.retention == flipper.flips.retention
+    for name in Flips.COLUMNS:
+        np.testing.assert_array_equal(loaded.flips.getColumn(name), flipper.flips.getColumn(name))
+    assert type(loaded.history) is type(flipper.history)
+    assert len(loaded.history) == len(flipper.history)
+    assert loaded.rng.bit_generator.state == flipper.rng.bit_generator.state
+    stats, expected = loaded.history.getStatsOverTime(), flipper.history.getStatsOverTime()
+    for name in ('numFlips', 'total', 'max', 'min', 'mean', 'median'):
+        np.testing.assert_array_equal(stats[name].to_numpy(dtype=float), expected[name].to_numpy(dtype=float))
+
+
+@pytest.mark.parametrize('makeHistory', [History, lambda: StreamingHistory(orderStats=True),
+                                         lambda: DeltaHistory(keyframeEvery=100)])
+@pytest.mark.parametrize('mmap', [True, False])
+def test_roundTrip(tmp_path, makeHistory, mmap):
+    flipper = makeFlipper(history=makeHistory())
+    storage.saveFlipper(flipper, tmp_path.joinpath('saved'))
+    loaded = storage.loadFlipper(tmp_path.joinpath('saved'), CoinFlipper, mmap=mmap)
+    assertSameFlipper(loaded, flipper)
+
+
+@pytest.mark.parametrize('flipRetention', ['last', 'count'])
+def test_roundTripRetention(tmp_path, flipRetention):
+    flipper = makeFlipper(history=StreamingHistory(), flipRetention=flipRetention)
+    flipper.save(tmp_path.joinpath('saved.flipper'))
+    assertSameFlipper(CoinFlipper.load(tmp_path.joinpath('saved.flipper')), flipper)
+
+
+def test_saveOverLoaded(tmp_path):
+    """A flipper memory-mapped from a directory can be flipped and saved back over it"""
+    path = tmp_path.joinpath('saved')
+    storage.saveFlipper(makeFlipper(history=StreamingHistory()), path)
+    flipper = storage.loadFlipper(path, CoinFlipper)
+    flipper.flip(100, engine='numpy')
+    storage.saveFlipper(flipper, path)
+    assertSameFlipper(storage.loadFlipper(path, CoinFlipper), flipper)
+
+
+def test_previousSaveKept(tmp_path):
+    """The save before the last one is still there for readers that read its manifest, and no older ones are"""
+    path = tmp_path.joinpath('saved')
+    flipper = makeFlipper(history=StreamingHistory())
+    data_dirs = []
+    for _ in range(3):
+        storage.saveFlipper(flipper, path)
+        data_dirs.append(storage.readManifest(path)['dataDir'])
+    assert sorted(p.name for p in path.iterdir() if p.is_dir()) == sorted(data_dirs[1:])
+
+
+def test_version1(tmp_path):
+    """A save in the version 1 layout (the parts straight in the directory) loads, and is upgraded by the next save"""
+    path = tmp_path.joinpath('saved')
+    flipper = makeFlipper(history=DeltaHistory(keyframeEvery=100))
+    storage.saveFlipper(flipper, path)
+    manifest = storage.readManifest(path)
+    data_dir = path.joinpath(manifest.pop('dataDir'))
+    for part in storage.PARTS:
+        shutil.move(data_dir.joinpath(part), path.joinpath(part))
+    data_dir.rmdir()
+    manifest['formatVersion'] = 1
+    path.joinpath(storage.MANIFEST_FILE).write_text(json.dumps(manifest))
+
+    loaded = storage.loadFlipper(path, CoinFlipper, mmap=False)
+    assertSameFlipper(loaded, flipper)
+
+    loaded.flip(10)
+    storage.saveFlipper(loaded, path)
+    assert storage.readManifest(path)['formatVersion'] == storage.FORMAT_VERSION
+    assertSameFlipper(storage.loadFlipper(path, CoinFlipper), loaded)
+    # The version 1 parts are kept (as the previous save) until the save after
+    storage.saveFlipper(loaded, path)
+    assert not any(path.joinpath(part).exists() for part in storage.PARTS)
+
+
+def test_newerVersion(tmp_path):
+    path = tmp_path.joinpath('saved')
+    storage.saveFlipper(makeFlipper(numFlips=10), path)
+    manifest = json.loads(path.joinpath(storage.MANIFEST_FILE).read_text())
+    manifest['formatVersion'] = storage.FORMAT_VERSION + 1
+    path.joinpath(storage.MANIFEST_FILE).write_text(json.dumps(manifest))
+    with pytest.raises(Exception, match='format version'):
+        storage.loadFlipper(path, CoinFlipper)
+
+
+def test_pickle(tmp_path):
+    flipper = makeFlipper(history=StreamingHistory())
+    flipper.save(tmp_path.joinpath('saved.pickle'))
+    assertSameFlipper(CoinFlipper.load(tmp_path.joinpath('saved.pickle')), flipper)
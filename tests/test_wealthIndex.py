@@ -0,0 +1,84 @@
+
+# Third-Party
+import numpy as np
+import pandas as pd
+import pytest
+
+# Custom
+from thePerfectlyJustSociety.coinFlip.coinFlip import CoinFlipper
+from thePerfectlyJustSociety.coinFlip.history import StreamingHistory, getStatsRow
+from thePerfectlyJustSociety.coinFlip.population import Population
+from thePerfectlyJustSociety.coinFlip.wealthIndex import WealthIndex
+
+
+def assertMatchesSort(index, money):
+    sorted_money = np.sort(money)
+    assert len(index) == len(money) and index.total == sorted_money.sum()
+    for k in range(len(money)):
+        assert index.kth(k) == sorted_money[k]
+        assert index.sumSmallest(k) == sorted_money[:k].sum()
+        assert index.sumLargest(k) == sorted_money[len(money) - k:].sum()
+    assert index.median == np.median(money)
+    for includeTopX in (False, True):
+        assert index.statsRow(includeTopX=includeTopX) == pytest.approx(getStatsRow(money, includeTopX=includeTopX))
+
+
+def test_matchesSort():
+    rng = np.random.default_rng(0)
+    money = rng.integers(-20, 60, size=50)
+    index = WealthIndex(money)
+    assertMatchesSort(index, money)
+
+    # Moving People around (past the ends of the range, so it grows)
+    for _ in range(200):
+        rows = rng.choice(50, 2, replace=False)
+        new = money[rows] + rng.integers(-30, 30, size=2)
+        index.update(money[rows], new)
+        money[rows] = new
+        index.update(int(money[0]), int(money[0]) + 1)
+        money[0] += 1
+    assertMatchesSort(index, money)
+    index.add([7, 8])
+    index.add(-100)
+    assertMatchesSort(index, np.concatenate([money, [7, 8, -100]]))
+
+
+def test_sizedFromMoney():
+    """The trees only cover the money the People have, not a fixed minimum range"""
+    index = WealthIndex(np.full(30, 100))
+    assert len(index._countTree) < 10
+    index.update(100, 140)
+    assert len(index._countTree) < 100
+
+
+def test_tooWide():
+    with pytest.raises(OverflowError):
+        WealthIndex([0, WealthIndex.MIN_RANGE])
+    index = WealthIndex(np.zeros(WealthIndex.MIN_RANGE))
+    assert index.maxRange() == WealthIndex.MAX_RANGE_PER_PERSON * WealthIndex.MIN_RANGE
+    index = WealthIndex([0, 1])
+    with pytest.raises(OverflowError):
+        index.update(1, WealthIndex.MIN_RANGE)
+
+
+def test_populationFallback():
+    """A Population whose money gets too spread out for its index drops it, and its stats come from a sort"""
+    pop = Population.full(30, 10)
+    assert pop.wealthIndex is not None
+    pop[3].money = 10 ** 9
+    assert pop._wealthIndex is None and pop.wealthIndex is None
+    assert pop.maxWealth == 10 ** 9 and pop.medianWealth == 10 and pop.totalMoney == 29 * 10 + 10 ** 9
+
+
+@pytest.mark.parametrize('includeTopX', [False, True])
+def test_orderStats(includeTopX):
+    """A StreamingHistory keeps the same stats with orderStats, including after the index is dropped.
+    The 'top X' columns are always computed with a sort"""
+    histories = [StreamingHistory(includeTopX=includeTopX, orderStats=order_stats) for order_stats in (False, True)]
+    for history in histories:
+        flipper = CoinFlipper(Population.full(40, 5), seed=0, history=history)
+        flipper.flip(100)
+        assert (flipper.population._wealthIndex is not None) == (history.orderStats and not includeTopX)
+        flipper.population[0].money = 10 ** 9
+        flipper.flip(50)
+    pd.testing.assert_frame_equal(histories[1].getStatsOverTime(), histories[0].getStatsOverTime())
@@ -0,0 +1,66 @@
+
+# Built-In Python
+import base64
+import importlib
+import os
+
+# Third-Party
+import numpy as np
+import pytest
+
+pytest.importorskip('dash')
+pytest.importorskip('diskcache')
+
+MAX = 'max'
+PERCENT = 'top_0_to_1_percent_wealth'
+WEALTH = 'money'
+
+
+@pytest.fixture(scope='module')
+def main(tmp_path_factory):
+    """The webapp's main module, imported in a temporary directory so its stores and cache are made there"""
+    cwd = os.getcwd()
+    os.chdir(tmp_path_factory.mktemp('webapp'))
+    try:
+        return importlib.import_module('thePerfectlyJustSociety.webapp.main')
+    finally:
+        os.chdir(cwd)
+
+
+def historyUpdate(start, stop):
+    numFlips = np.arange(start, stop)
+    return {'historyRows': {'numFlips': numFlips, MAX: numFlips * 2, PERCENT: numFlips / 100}}
+
+
+def test_lastHistoryX(main):
+    assert main.lastHistoryX(None) is None
+    assert main.lastHistoryX({'data': []}) is None
+    assert main.lastHistoryX({'data': [{'x': []}]}) is None
+    assert main.lastHistoryX({'data': [{'x': [1, 5, 9]}]}) == 9
+    # How plotly sends numeric arrays
+    encoded = {'dtype': 'i4', 'bdata': base64.b64encode(np.array([3, 4, 7], dtype='i4').tobytes()).decode()}
+    assert main.lastHistoryX({'data': [{'x': encoded}]}) == 7
+
+
+def test_historyExtension(main):
+    """The rows of every update are sent, in order, for the selected column"""
+    updates = [historyUpdate(1, 4), {'other': 1}, historyUpdate(4, 6)]
+    assert main.getHistoryExtension(MAX, updates) == (dict(x=[[1, 2, 3, 4, 5]], y=[[2, 4, 6, 8, 10]]), [0])
+    extension, traces = main.getHistoryExtension(PERCENT, updates)
+    np.testing.assert_allclose(extension['y'][0], np.arange(1, 6) / 100)
+
+
+def test_historyExtensionAfter(main):
+    """Only the points the graph does not have yet are sent"""
+    updates = [historyUpdate(1, 6)]
+    assert main.getHistoryExtension(MAX, updates, after=3) == (dict(x=[[4, 5]], y=[[8, 10]]), [0])
+    assert main.getHistoryExtension(MAX, updates, after=5) is main.no_update
+
+
+def test_noHistoryExtension(main):
+    assert main.getHistoryExtension(MAX, []) is main.no_update
+    assert main.getHistoryExtension(MAX, [{'other': 1}]) is main.no_update
+    # The wealth distribution graphs are not made from the History's rows
+    assert main.getHistoryExtension(WEALTH, [historyUpdate(1, 4)]) is main.no_update
+    # Rows without the selected column
+    assert main.getHistoryExtension(MAX, [{'historyRows': {'numFlips': np.arange(3)}}]) is main.no_update
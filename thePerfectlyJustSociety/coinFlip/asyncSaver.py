@@ -0,0 +1,150 @@
+
+# Built-In Python
+import copy
+import logging
+import queue
+import threading
+
+# Third-Party
+import numpy as np
+
+# Custom
+from .population import Population, COLUMNS
+from .history import History, StreamingHistory, MemmapHistory, DeltaHistory
+
+
+class AsyncSaver:
+    """Saves CoinFlippers on a background thread, so flipping carries on while they are written
+
+        save() takes a consistent snapshot of the flipper (see freeze) and hands it to a writer thread, which saves it
+        with CoinFlipper.save (which replaces the old save atomically). The population's columns are copied into
+        buffers that are reused from one save to the next. Everything else that is only ever appended to (the flip
+        log, most Histories) is shared with the snapshot instead of copied.
+        At most maxPending snapshots wait to be written. If the writer falls behind, save() waits for room
+        (backpressure), so memory stays bounded: save() takes its snapshot before it waits, so there are at most
+        maxPending + 2 sets of buffers (one being written, maxPending waiting and the one save() has just filled).
+        An error in the writer is raised by the next save(), flush() or close().
+    """
+    def __init__(self, maxPending=1):
+        self._queue = queue.Queue(maxsize=maxPending)
+        self._freeBuffers = []
+        self._lock = threading.Lock()
+        self._error = None
+        self._thread = threading.Thread(target=self._write, name=f'{self.__class__.__name__}Writer', daemon=True)
+        self._thread.start()
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__} | Pending: {self._queue.qsize()}>"
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _raiseError(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise Exception(f"A background save failed: {error!r}") from error
+
+    def _takeBuffers(self, population: Population):
+        """Copies of the population's columns, in reused buffers when there are any that fit"""
+        with self._lock:
+            buffers = self._freeBuffers.pop() if self._freeBuffers else None
+        columns = {}
+        for name in COLUMNS:
+            values = population.getColumn(name, copy=False)
+            buffer = buffers.get(name) if buffers else None
+            if buffer is None or buffer.shape != values.shape or buffer.dtype != values.dtype:
+                buffer = np.empty_like(values)
+            np.copyto(buffer, values)
+            columns[name] = buffer
+        return columns
+
+    def _returnBuffers(self, population: Population):
+        with self._lock:
+            self._freeBuffers.append(population._columns)
+
+    def freeze(self, flipper):
+        """A copy of flipper that will not change as flipping carries on (see the class's docstring)"""
+        frozen = copy.copy(flipper)
+        frozen.population = Population._wrapColumns(self._takeBuffers(flipper.population))
+        frozen.rng = np.random.Generator(copy.deepcopy(flipper.rng.bit_generator))
+        frozen._solventIndex = None
+        frozen.flips = self._freezeFlips(flipper.flips, frozen.population)
+        frozen.history = self._freezeHistory(flipper.history)
+        return frozen
+
+    @staticmethod
+    def _freezeFlips(flips, population):
+        frozen = copy.copy(flips)
+        frozen.population = population
+        frozen._runFlips, frozen._runRecords = list(flips._runFlips), list(flips._runRecords)
+        if flips.retention == 'all':
+            # Only ever appended to (past the end of these views, or into new arrays when they grow)
+            frozen._columns = {name: col[:flips._size] for name, col in flips._columns.items()}
+        else:
+            # The oldest flips are dropped by moving the newest ones to the front
+            frozen._columns = {name: col[:flips._size].copy() for name, col in flips._columns.items()}
+        return frozen
+
+    @staticmethod
+    def _freezeHistory(history: History):
+        kind = type(history)
+        if kind not in (History, StreamingHistory, MemmapHistory, DeltaHistory):
+            return copy.deepcopy(history)
+        frozen = copy.copy(history)
+        if kind is History:
+            # The snapshots themselves are never changed, only added to
+            frozen.moneyStamps, frozen.numFlips = list(history.moneyStamps), list(history.numFlips)
+            frozen.populationDfs = list(history.populationDfs)
+        elif kind is StreamingHistory:
+            frozen._columns = {name: col[:history._size] for name, col in history._columns.items()}
+        elif kind is MemmapHistory:
+            # Its rows are in files. Make sure every row counted is in them and leave the files to history
+            history._flush()
+            frozen._moneyFile = frozen._numFlipsFile = None
+        elif kind is DeltaHistory:
+            frozen.numFlips = list(history.numFlips)
+            frozen._deltas = {name: col[:history._numDeltas] for name, col in history._deltas.items()}
+            frozen._keyframeFlips, frozen._keyframes = list(history._keyframeFlips), list(history._keyframes)
+        return frozen
+
+    def save(self, flipper, filepath, history=True, includeTopX=True):
+        """Save flipper in the background (see CoinFlipper.save for the arguments)
+            Waits (on the flipping thread) if maxPending saves are already waiting to be written
+        """
+        self._raiseError()
+        if history and type(flipper.history) in (History, MemmapHistory, DeltaHistory):
+            # These only compute the stats of rows added since the last time. Computing them on the snapshot would
+            # leave the History itself behind, so every save would compute every row again
+            flipper.history.getStatsOverTime(includeTopX=includeTopX)
+        self._queue.put((self.freeze(flipper), filepath, history, includeTopX))
+
+    def _write(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                frozen, filepath, history, includeTopX = item
+                frozen.save(filepath, history=history, includeTopX=includeTopX)
+                self._returnBuffers(frozen.population)
+            except Exception as e:
+                logging.exception(f'Background save to {item[1]} failed')
+                self._error = e
+            finally:
+                self._queue.task_done()
+
+    def flush(self):
+        """Wait for every save so far to be written"""
+        self._queue.join()
+        self._raiseError()
+
+    def close(self):
+        """Write every save so far and stop the writer thread"""
+        if self._thread.is_alive():
+            self._queue.join()
+            self._queue.put(None)
+            self._thread.join()
+        self._raiseError()
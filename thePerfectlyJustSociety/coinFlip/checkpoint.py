@@ -0,0 +1,217 @@
+
+# Built-In Python
+from pathlib import Path
+import logging
+import os
+import pickle
+import shutil
+import struct
+import zlib
+
+# Third-Party
+import numpy as np
+
+# Custom
+from .coinFlip import CoinFlipper
+from .history import StreamingHistory, MemmapHistory
+from . import storage
+
+# Every record in a write-ahead segment starts with the length of its payload and the payload's crc32
+RECORD_HEADER = struct.Struct('<QI')
+
+
+class Checkpointer:
+    """Append-only checkpoints of a CoinFlipper
+
+        A checkpoint directory holds a full snapshot (a saved flipper, see storage.py) and a write-ahead segment that
+        each checkpoint appends a record to: the flips logged since the last checkpoint, the History rows added since
+        then and the flipper's counters. So a checkpoint costs as much as the work done since the last one, not as much
+        as the whole flipper. Every compactEvery records (or when a record is not possible, see checkpoint) the segment
+        is compacted into a new snapshot.
+        Snapshots and segments are numbered. A new snapshot is complete before its segment starts and the old ones are
+        deleted, so recover() can always find the newest snapshot and replay every complete record in its segment. A
+        record cut short by a crash or a cancelled run is ignored.
+    """
+    SNAPSHOT_PREFIX = 'snapshot_'
+    SEGMENT_PREFIX = 'wal_'
+
+    def __init__(self, directory, compactEvery=100, fsync=False):
+        """
+            Args:
+                directory: Where the snapshots and segments go
+                compactEvery: The number of records in a segment before it is compacted into a new snapshot
+                fsync: If True, make sure every record is on disk (not just handed to the OS) before carrying on
+        """
+        self.directory = Path(directory)
+        self.compactEvery = int(compactEvery)
+        self.fsync = fsync
+        self.generation = None
+        self.numRecords = 0
+        self._segment = None
+        # What the last checkpoint covered
+        self._numFlips = 0
+        self._numRecorded = 0
+        self._historyLen = 0
+        self._historyDirectory = None
+        self._numPeople = 0
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__} {self.directory} | Generation: {self.generation} | " \
+               f"Records: {self.numRecords}>"
+
+    def _snapshotPath(self, generation):
+        return self.directory.joinpath(f'{self.SNAPSHOT_PREFIX}{generation:06d}')
+
+    def _segmentPath(self, generation):
+        return self.directory.joinpath(f'{self.SEGMENT_PREFIX}{generation:06d}.bin')
+
+    @classmethod
+    def _generations(cls, directory):
+        """The generations with a complete snapshot, from the oldest"""
+        return sorted(int(path.name[len(cls.SNAPSHOT_PREFIX):])
+                      for path in Path(directory).glob(f'{cls.SNAPSHOT_PREFIX}*') if storage.isSaved(path))
+
+    def _covered(self, flipper: CoinFlipper):
+        self._numFlips = len(flipper.flips)
+        self._numRecorded = flipper.flips.numRecorded
+        self._historyLen = len(flipper.history)
+        self._historyDirectory = getattr(flipper.history, 'directory', None)
+        self._numPeople = len(flipper.population)
+
+    def close(self):
+        if self._segment is not None:
+            self._segment.close()
+            self._segment = None
+
+    def compact(self, flipper: CoinFlipper):
+        """Save a full snapshot of flipper and start a new, empty segment after it"""
+        self.close()
+        self.directory.mkdir(parents=True, exist_ok=True)
+        generations = self._generations(self.directory)
+        self.generation = (generations[-1] + 1) if generations else 0
+        storage.saveFlipper(flipper, self._snapshotPath(self.generation), computeStats=False)
+        self._segment = open(self._segmentPath(self.generation), 'wb')
+        self.numRecords = 0
+        self._covered(flipper)
+        # The new snapshot is complete, so everything older can go
+        for generation in generations:
+            shutil.rmtree(self._snapshotPath(generation), ignore_errors=True)
+            self._segmentPath(generation).unlink(missing_ok=True)
+
+    def _historyRows(self, history):
+        """The History's new rows for a record, or False if this kind of History can not be checkpointed by rows"""
+        if type(history) is StreamingHistory:
+            return {name: col[self._historyLen:history._size].copy() for name, col in history._columns.items()}
+        if type(history) is MemmapHistory:
+            if history.directory != self._historyDirectory:
+                # It moved to a copy of its files (see MemmapHistory._open), which the snapshot does not know about
+                return False
+            # Its snapshots are already appended to files of their own. Only its length needs to be recorded
+            history._flush()
+            return None
+        return False
+
+    def checkpoint(self, flipper: CoinFlipper):
+        """Append a record of everything since the last checkpoint (or compact, if that is not possible)
+            A record is not possible when the flips since the last checkpoint were not all logged individually (see
+            Flips retention and CoinFlipper.fastForward), People were added or the History is not a StreamingHistory
+            or MemmapHistory. Changes to the People other than flips (e.g. Population.setColumn) are not recorded, so
+            call compact() after making any.
+        """
+        if self._segment is None:
+            return self.compact(flipper)
+        flips, history = flipper.flips, flipper.history
+        num_new = len(flips) - self._numFlips
+        if not num_new and len(history) == self._historyLen:
+            return
+        history_rows = self._historyRows(history)
+        if self.numRecords >= self.compactEvery or history_rows is False or \
+                len(flipper.population) != self._numPeople or \
+                flips.numRecorded - self._numRecorded != num_new or self._numRecorded < flips._numDropped:
+            return self.compact(flipper)
+
+        records = flips.recordsSince(self._numRecorded)
+        payload = pickle.dumps({
+            'numFlips': len(flips),
+            'numRounds': flipper.numRounds,
+            'rngState': flipper.rng.bit_generator.state,
+            'winners': records['winner'],
+            'losers': records['loser'],
+            'bets': records['bet'],
+            'settled': records['settled'],
+            'historyLen': len(history),
+            'historyRows': history_rows
+        }, protocol=pickle.HIGHEST_PROTOCOL)
+        self._segment.write(RECORD_HEADER.pack(len(payload), zlib.crc32(payload)))
+        self._segment.write(payload)
+        self._segment.flush()
+        if self.fsync:
+            os.fsync(self._segment.fileno())
+        self.numRecords += 1
+        self._covered(flipper)
+
+    @classmethod
+    def _readRecords(cls, path):
+        """Yield (where it ends, record) for every complete record in a segment, stopping at the first one that was
+        cut short or is corrupt"""
+        with open(path, 'rb') as f:
+            data = f.read()
+        pos = 0
+        while pos + RECORD_HEADER.size <= len(data):
+            length, crc = RECORD_HEADER.unpack_from(data, pos)
+            end = pos + RECORD_HEADER.size + length
+            payload = data[pos + RECORD_HEADER.size:end]
+            if len(payload) < length or zlib.crc32(payload) != crc:
+                logging.warning(f'Ignoring an incomplete record at byte {pos:,} of {path}')
+                return
+            yield end, pickle.loads(payload)
+            pos = end
+
+    @classmethod
+    def recover(cls, directory, mmap=True):
+        """The flipper as of the last complete record in directory
+            Returns:
+                (flipper, a Checkpointer that carries on checkpointing it in directory)
+        """
+        generations = cls._generations(directory)
+        if not generations:
+            raise Exception(f"There is no complete snapshot to recover in {directory}")
+        checkpointer = cls(directory)
+        checkpointer.generation = generations[-1]
+        flipper = CoinFlipper.load(checkpointer._snapshotPath(checkpointer.generation), mmap=mmap)
+        segment_path = checkpointer._segmentPath(checkpointer.generation)
+        complete_bytes = 0
+        if segment_path.exists():
+            for complete_bytes, record in cls._readRecords(segment_path):
+                cls._replay(flipper, record)
+                checkpointer.numRecords += 1
+        # Carry on after the last complete record
+        checkpointer._segment = open(segment_path, 'ab')
+        checkpointer._segment.truncate(complete_bytes)
+        checkpointer._covered(flipper)
+        logging.info(f'Recovered {len(flipper.flips):,} flips from {directory} '
+                     f'(generation {checkpointer.generation}, {checkpointer.numRecords} records)')
+        return flipper, checkpointer
+
+    @staticmethod
+    def _replay(flipper: CoinFlipper, record):
+        """Apply a record to a flipper loaded from the snapshot (or the records) before it"""
+        people = flipper.population
+        settled = np.asarray(record['settled'], dtype=bool)
+        winners, losers = record['winners'][settled], record['losers'][settled]
+        bets = np.asarray(record['bets'], dtype=np.int64)[settled]
+        for name, rows, change in (('money', winners, bets), ('money', losers, -bets),
+                                   ('numWins', winners, 1), ('numLosses', losers, 1)):
+            values = people.getColumn(name).astype(np.int64)
+            np.add.at(values, rows, change)
+            people.setColumn(name, values)
+        flipper.history.addFlips(people, record['winners'], record['losers'], record['bets'], settled,
+                                 firstFlip=len(flipper.flips))
+        flipper.flips.extendArrays(record['winners'], record['losers'], record['bets'], settled)
+        flipper.numRounds = record['numRounds']
+        flipper.rng.bit_generator.state = record['rngState']
+        if type(flipper.history) is MemmapHistory:
+            # Its rows are on disk already (along with any written after this record)
+            flipper.history._len = min(flipper.history._numRowsOnDisk(), record['historyLen'])
+        elif record['historyRows'] is not None:
+            flipper.history.addRows(record['historyRows'])
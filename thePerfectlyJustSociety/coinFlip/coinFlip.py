@@ -2,8 +2,8 @@
 # Built-In Python
 import time
 from pathlib import Path
+import os
 import pickle
-import random
 import logging
 
 # Third-Party
@@ -16,80 +16,35 @@ from fire import Fire
 # Custom
 from .population import Population
 from .flips import Flips, Flip
-
-
-class History:
-    def __init__(self):
-        self.moneyStamps = []
-        self.numFlips = []
-        self.populationDfs = []
-
-        self.stats = pd.DataFrame(columns=['numFlips', 'money', 'total', 'max', 'min', 'mean', 'median'])\
-            .set_index('numFlips', drop=False)
-
-    def __repr__(self):
-        return f"<{self.__class__.__name__} | Entries: {len(self)}>"
-
-    def __len__(self):
-        return len(self.moneyStamps)
-
-    def add(self, population: Population, numFlips: int):
-        self.moneyStamps.append(population.getMoneyStamp())
-        self.numFlips.append(numFlips)
-        self.populationDfs.append(population.toDf())
-
-    def getStatsOverTime(self, includeTopX=True, logProgress=False):
-        df = self.stats
-        new_data = []
-        if len(self):
-            start_flip = len(df)
-            for i in tqdm(range(start_flip, len(self)), desc=f'Converting History to df', disable=not logProgress):
-                # A DataFrame representing the population after a given number of flips (self.numFlips[i])
-                row = self.populationDfs[i]
-                # Converting the df to a single row, so it can be a part of the full history df
-                row_data = {
-                    'numFlips': self.numFlips[i],
-                    'money': row.money.values,  # This will be a numpy array, saved in a single cell of the df
-                    'total': row.money.sum(),
-                    'max': row.money.max(),
-                    'min': row.money.min(),
-                    'mean': row.money.mean(),
-                    'median': row.money.median()
-                }
-                if includeTopX:
-                    # Split the People into bins by
-                    money: np.ndarray = row.money.values
-                    money[::-1].sort()
-                    num_per_percent = round(len(money) * 0.1)
-                    _split = np.array_split(money, num_per_percent)
-                    use_indices = includeTopX if isinstance(includeTopX, list) else list(range(0, 100))
-                    for idx, top_x_range in enumerate(_split):
-                        if idx in use_indices:
-                            row_data[f"top_{idx}_to_{idx+1}_percent_wealth"] = top_x_range.sum() / row.money.sum() * 100
-
-                new_data.append(row_data)
-            new_df = pd.DataFrame(new_data)
-            df = pd.concat([self.stats, new_df])
-            self.stats = df
-        return self.stats
-
-    def save(self, filepath, includeTopX=True):
-        df = self.getStatsOverTime(includeTopX=includeTopX)
-        df.to_pickle(str(filepath))
+from .flipEngine import NumpyFlipEngine
+from .solventIndex import SolventIndex
+from .history import History, StreamingHistory
+from .asyncSaver import AsyncSaver
+from .resultCache import ResultCache
+from . import storage
 
 
 class CoinFlipper:
     def __init__(self, population: Population, dollarsPerFlip: int = 1, allowDebt: bool = False, brokeIsOut=True,
-                 selectionStyle: str = 'random', cacheDir='flipperCache/cli'):
+                 selectionStyle: str = 'random', cacheDir='flipperCache/cli', seed=None, flipRetention='all',
+                 keepLastFlips=10_000, history: History = None):
         self.population = population
         self.dollarsPerFlip = int(dollarsPerFlip)
         self.allowDebt = allowDebt
         self.brokeIsOut = brokeIsOut
         self.selectionStyle = selectionStyle
+        # Every random pick (with any engine) comes from this, so a seed makes a run reproducible
+        self.rng = np.random.default_rng(seed)
 
         self.cacheDir = Path(cacheDir)
-        self.flips: Flips = Flips()
-        self.history: History = History()
+        self._solventIndex = None
+        # The number of rounds flipped with the 'rounds' selectionStyle
+        self.numRounds = 0
+        # See Flips for the retention options
+        self.flips: Flips = Flips(retention=flipRetention, keepLast=keepLastFlips, population=self.population)
+        # A History keeps snapshots of the population. A StreamingHistory only keeps the stats, which uses far less
+        # memory
+        self.history: History = History() if history is None else history
         self.history.add(self.population, numFlips=len(self.flips))
 
     def __repr__(self):
@@ -99,70 +54,304 @@ class CoinFlipper:
         directory = Path(directory)
         return directory.joinpath(f'people_{len(self.population)}_start_{self.population[0].startMoney}_'
                                   f'bet_{self.dollarsPerFlip}_debt_{self.allowDebt}_'
-                                  f'flips_{len(self.flips)}.pickle')
+                                  f'flips_{len(self.flips)}.flipper')
 
     @property
     def numFlips(self):
         return len(self.flips)
 
-    def flip(self, num: int = 1, saveEvery=0, plotEvery=0, plotKind='topXPercentRanges', logProgress=False,
-             saveHistory=True, closePlt=True):
-        """Flip a coin some number of times and settle the bets"""
-        for i in tqdm(range(num), total=num, unit='flips', desc='Flipping Coins', disable=not logProgress):
-            self.flipOnce()
-
-            if saveHistory:
-                self.history.add(self.population, numFlips=len(self.flips))
+    @property
+    def solventIndex(self) -> SolventIndex:
+        """The People with more than $0 (who can flip when brokeIsOut is set), updated as bets are settled
+            The flipper keeps this up to date as it settles bets. It is rebuilt if the population was changed some
+            other way (see Population.version).
+        """
+        if self._solventIndex is None or self._solventIndex.version != self.population.version:
+            self._solventIndex = SolventIndex(self.population.getColumn('money', copy=False))
+            self._solventIndex.version = self.population.version
+        return self._solventIndex
 
-            if saveEvery and len(self.flips) > 0 and len(self.flips) % saveEvery == 0:
-                filepath = self.descriptiveFilepath(self.cacheDir)
-                self.save(filepath, history=True)
-            if plotEvery and len(self.flips) % plotEvery == 0:
-                self.population.plot(t=0.1, keepAx=True, kind=plotKind,
-                                     title=f'Population after {i + 1:,} flips (Total: ${self.population.totalMoney:,})')
+    def flip(self, num: int = 1, saveEvery=0, plotEvery=0, plotKind='topXPercentRanges', logProgress=False,
+             saveHistory=True, closePlt=True, engine='python', blockSize=10_000, asyncSave=False):
+        """Flip a coin some number of times and settle the bets
+            With the 'rounds' selectionStyle, num, saveEvery and plotEvery count rounds instead of flips, the History is
+            added to once per round and the engine does not matter (see flipRound).
+            Args:
+                num: The number of coins to flip
+                saveEvery: Save the flipper after every saveEvery flips (0 to never save)
+                plotEvery: Plot the population after every plotEvery flips (0 to never plot)
+                plotKind: The kind of plot (see Population.plot)
+                logProgress: If True, show a progress bar
+                saveHistory: If True, add the population to the History (see engine)
+                closePlt: If True, close the plot when done
+                engine: 'python' flips one coin at a time. 'numpy' flips blocks of coins as arrays, which is much
+                        faster for large runs. With the numpy engine, the History is added to once per block instead of
+                        once per flip
+                blockSize: The maximum number of flips in a block (numpy engine only)
+                asyncSave: If True, save in the background (see AsyncSaver) while flipping carries on. Every save is
+                           written before this returns
+        """
+        saver = AsyncSaver() if asyncSave and saveEvery else None
+        try:
+            self._flip(num, saveEvery=saveEvery, plotEvery=plotEvery, plotKind=plotKind, logProgress=logProgress,
+                       saveHistory=saveHistory, engine=engine, blockSize=blockSize, saver=saver)
+        finally:
+            if saver is not None:
+                saver.close()
         if closePlt:
             plt.close()
 
+    def _flip(self, num, saveEvery=0, plotEvery=0, plotKind='topXPercentRanges', logProgress=False, saveHistory=True,
+              engine='python', blockSize=10_000, saver=None):
+        """flip, without closing the plot or the saver"""
+        if self.selectionStyle == 'rounds':
+            for i in tqdm(range(num), total=num, unit='rounds', desc='Flipping Coins', disable=not logProgress):
+                self.flipRound()
+                self._afterFlips(i + 1, saveEvery=saveEvery, plotEvery=plotEvery, plotKind=plotKind,
+                                 saveHistory=saveHistory, counter=self.numRounds, unit='rounds', saver=saver)
+        elif engine == 'python':
+            for i in tqdm(range(num), total=num, unit='flips', desc='Flipping Coins', disable=not logProgress):
+                self.flipOnce()
+                self._afterFlips(i + 1, saveEvery=saveEvery, plotEvery=plotEvery, plotKind=plotKind,
+                                 saveHistory=saveHistory, saver=saver)
+        elif engine == 'numpy':
+            self._flipNumpy(num, saveEvery=saveEvery, plotEvery=plotEvery, plotKind=plotKind, logProgress=logProgress,
+                            saveHistory=saveHistory, blockSize=blockSize, saver=saver)
+        else:
+            raise Exception(f"Unknown engine: {engine}")
+
+    def _afterFlips(self, numDone, saveEvery=0, plotEvery=0, plotKind='topXPercentRanges', saveHistory=True,
+                    counter=None, unit='flips', saver=None):
+        """Record, save and plot as requested after some flips
+            Args:
+                numDone: The number of flips (or rounds) in this call so far
+                counter: What saveEvery and plotEvery count (the total number of flips by default)
+                saver: An AsyncSaver to save with (saves on this thread if None)
+        """
+        counter = len(self.flips) if counter is None else counter
+        if saveHistory:
+            self.history.add(self.population, numFlips=len(self.flips))
+
+        if saveEvery and counter > 0 and counter % saveEvery == 0:
+            filepath = self.descriptiveFilepath(self.cacheDir)
+            if saver is not None:
+                saver.save(self, filepath, history=True)
+            else:
+                self.save(filepath, history=True)
+        if plotEvery and counter % plotEvery == 0:
+            self.population.plot(t=0.1, keepAx=True, kind=plotKind,
+                                 title=f'Population after {numDone:,} {unit} (Total: ${self.population.totalMoney:,})')
+
+    def _flipNumpy(self, num, saveEvery=0, plotEvery=0, plotKind='topXPercentRanges', logProgress=False,
+                   saveHistory=True, blockSize=10_000, saver=None):
+        """Flip coins in blocks with a NumpyFlipEngine. Blocks end on every multiple of saveEvery and plotEvery"""
+        if self.selectionStyle != 'random':
+            raise Exception(f"The numpy engine only supports the 'random' selectionStyle, not {self.selectionStyle}")
+        people = self.population
+        engine = NumpyFlipEngine(money=people.getColumn('money'), numWins=people.getColumn('numWins'),
+                                 numLosses=people.getColumn('numLosses'), dollarsPerFlip=self.dollarsPerFlip,
+                                 allowDebt=self.allowDebt, brokeIsOut=self.brokeIsOut, rng=self.rng,
+                                 blockSize=blockSize, solvent=self.solventIndex if self.brokeIsOut else None)
+        done = 0
+        with tqdm(total=num, unit='flips', desc='Flipping Coins', disable=not logProgress) as progress:
+            while done < num:
+                n = min(blockSize, num - done)
+                for every in (saveEvery, plotEvery):
+                    if every:
+                        n = min(n, every - len(self.flips) % every)
+                winners, losers, settled = engine.flip(n)
+
+                # Copy the results back to the People who flipped
+                flipped = np.unique(np.concatenate([winners, losers]))
+                people.setColumn('money', engine.money[flipped], rows=flipped)
+                people.setColumn('numWins', engine.numWins[flipped], rows=flipped)
+                people.setColumn('numLosses', engine.numLosses[flipped], rows=flipped)
+                if engine.solvent is not None:
+                    engine.solvent.version = people.version
+                self.history.addFlips(people, winners, losers, self.dollarsPerFlip, settled, firstFlip=len(self.flips))
+                self.flips.extendArrays(winners, losers, self.dollarsPerFlip, settled)
+
+                done += n
+                progress.update(n)
+                self._afterFlips(done, saveEvery=saveEvery, plotEvery=plotEvery, plotKind=plotKind,
+                                 saveHistory=saveHistory, saver=saver)
+
+    def fastForward(self, numFlips, saveHistory=True):
+        """Jump straight to the population after numFlips more flips, without flipping them one at a time
+
+            This only works when there is nothing to stop a flip (allowDebt is set and brokeIsOut is not), since then
+            each person's wealth only depends on how many flips they won and lost, not on the order of the flips.
+            Every flip has a winner picked uniformly at random and a loser picked uniformly from everyone else, so the
+            wins are drawn from a multinomial distribution over numFlips flips and the losses given the wins (see
+            _drawLosses). The total wins always equals the total losses, so no money is created or destroyed. The cost
+            is O(population * log(population)) no matter how big numFlips is.
+            The flips are counted in self.flips, but not logged individually.
+        """
+        if not self.allowDebt or self.brokeIsOut:
+            raise Exception(f"fastForward only works when allowDebt is True and brokeIsOut is False. "
+                            f"Got allowDebt={self.allowDebt}, brokeIsOut={self.brokeIsOut}")
+        if self.selectionStyle != 'random':
+            raise Exception(f"fastForward only supports the 'random' selectionStyle, not {self.selectionStyle}")
+        if len(self.population) < 2:
+            raise Exception(f"Can not flip with {len(self.population)} people")
+        numFlips = int(numFlips)
+        people = self.population
+        wins = self.rng.multinomial(numFlips, np.full(len(people), 1 / len(people)))
+        losses = self._drawLosses(wins)
+
+        money = people.getColumn('money', copy=False).astype(np.int64)
+        people.setColumn('money', money + self.dollarsPerFlip * (wins - losses))
+        people.setColumn('numWins', people.getColumn('numWins', copy=False).astype(np.int64) + wins)
+        people.setColumn('numLosses', people.getColumn('numLosses', copy=False).astype(np.int64) + losses)
+        self.flips.advance(numFlips)
+        self.history.populationChanged(self.population, numFlips=len(self.flips))
+
+        if saveHistory:
+            self.history.add(self.population, numFlips=len(self.flips))
+
+    def _drawLosses(self, wins):
+        """How many flips each person lost, given how many each won, when every loser is picked uniformly from everyone
+        but the flip's winner
+
+            The people are split in halves, over and over. For a group of people, each of a winner's flips that are
+            still to be placed in the group lands in the winner's own half with probability (half - 1) / (group - 1)
+            (so each winner's share is binomial), and the rest go to the other half, where anyone can lose them. Those
+            are split between the halves of that half in proportion to their sizes, and so on down to single people.
+            Every level is one vectorized pass over the population.
+        """
+        n = len(wins)
+        # Flips (by winner) whose loser is someone in the winner's group other than the winner
+        own = wins.astype(np.int64)
+        # Flips (by group) whose loser is anyone in the group
+        anyone = np.zeros(1, dtype=np.int64)
+        bounds = np.array([0, n])
+        while len(bounds) <= n:
+            lo, hi = bounds[:-1], bounds[1:]
+            size = hi - lo
+            # Groups of one are "split" into an empty half and themselves, and the empty halves are dropped below
+            mid = lo + size // 2
+            group = np.repeat(np.arange(len(size)), size)
+            in_low = np.arange(n) < mid[group]
+            half = np.where(in_low, (mid - lo)[group], (hi - mid)[group])
+            stay_chance = np.where(size[group] > 1, (half - 1) / np.maximum(size[group] - 1, 1), 0.0)
+            stays = self.rng.binomial(own, stay_chance)
+            leaving = np.concatenate([[0], np.cumsum(own - stays)])
+            anyone_low = self.rng.binomial(anyone, (mid - lo) / size)
+
+            # Low halves get the flips leaving high halves, and the other way around
+            anyone = np.stack([anyone_low + leaving[hi] - leaving[mid],
+                               anyone - anyone_low + leaving[mid] - leaving[lo]], axis=1).ravel()
+            bounds = np.append(np.stack([lo, mid], axis=1).ravel(), n)
+            non_empty = np.diff(bounds) > 0
+            bounds, anyone = np.append(bounds[:-1][non_empty], n), anyone[non_empty]
+            own = stays
+        return anyone
+
+    def flipRound(self):
+        """Pair up everyone who can flip (at random) and flip a coin for every pair at once
+
+            One random permutation splits the eligible people into disjoint pairs (one person sits out if there is an
+            odd number of them). Since no one is in two pairs, every bet in the round can be settled at the same time.
+        """
+        people = self.population
+        eligible = self.solventIndex.members if self.brokeIsOut else np.arange(len(people))
+        if len(eligible) < 2:
+            raise Exception(f"Can not flip a round with {len(eligible)} eligible people")
+        shuffled = self.rng.permutation(eligible)
+        num_pairs = len(shuffled) // 2
+        first, second = shuffled[0:2 * num_pairs:2], shuffled[1:2 * num_pairs:2]
+        swap = self.rng.random(num_pairs) < 0.5
+        winners, losers = np.where(swap, second, first), np.where(swap, first, second)
+
+        money = people.getColumn('money', copy=False).astype(np.int64)
+        settled = np.ones(num_pairs, dtype=bool) if self.allowDebt else money[losers] >= self.dollarsPerFlip
+        settled_winners, settled_losers = winners[settled], losers[settled]
+        people.setColumn('money', money[settled_winners] + self.dollarsPerFlip, rows=settled_winners)
+        people.setColumn('money', money[settled_losers] - self.dollarsPerFlip, rows=settled_losers)
+        people.setColumn('numWins', people.getColumn('numWins', copy=False)[settled_winners].astype(np.int64) + 1,
+                         rows=settled_winners)
+        people.setColumn('numLosses', people.getColumn('numLosses', copy=False)[settled_losers].astype(np.int64) + 1,
+                         rows=settled_losers)
+
+        if self.brokeIsOut:
+            solvent = self._solventIndex
+            for loser in settled_losers[money[settled_losers] - self.dollarsPerFlip <= 0].tolist():
+                solvent.remove(loser)
+            solvent.version = people.version
+        self.history.addFlips(people, winners, losers, self.dollarsPerFlip, settled, firstFlip=len(self.flips))
+        self.flips.extendArrays(winners, losers, self.dollarsPerFlip, settled)
+        self.numRounds += 1
+
     def flipOnce(self):
         # Pick 2 random people from the group to "flip" against each other
         p1, p2 = self.getPeople(2)
-        winner = random.choice([p1, p2])
-        loser = p1 if winner == p2 else p2
+        winner, loser = (p1, p2) if self.rng.random() < 0.5 else (p2, p1)
         # Since both are random selections, we just assume the "first" one was the winner
         flip = Flip(winner=winner, loser=loser, bet=self.dollarsPerFlip)
-        # Log the flip
-        self.flips.append(flip)
 
         if loser.has(self.dollarsPerFlip) or self.allowDebt:
+            # Get the index before settling, since settling changes the population's version
+            solvent = self.solventIndex if self.brokeIsOut else None
             flip.settleBet()
+            if solvent is not None:
+                # Only the loser can go broke
+                solvent.update(loser.row, loser.money)
+                solvent.version = self.population.version
+        # Log the flip
+        self.history.addFlips(self.population, [winner.row], [loser.row], flip.bet, [flip.settled],
+                              firstFlip=len(self.flips))
+        self.flips.append(flip)
 
     def getPeople(self, n):
-        pop = self.population.getPeopleWithMoreThan(0) if self.brokeIsOut else self.population
         if self.selectionStyle == 'random':
-            return pop.pickRandoms(n)
+            if self.brokeIsOut:
+                return [self.population[i] for i in self.solventIndex.sample(n, rng=self.rng)]
+            return self.population.pickRandoms(n, rng=self.rng)
         elif self.selectionStyle == 'sequential':
             if self.brokeIsOut:
                 raise Exception(f'Can not use sequential selection when brokeIsOut is set to True.')
-            nex = [pop.next(loop=True) for _ in range(n)]
+            nex = [self.population.next(loop=True) for _ in range(n)]
             return nex
+        elif self.selectionStyle == 'rounds':
+            raise Exception(f"The 'rounds' selectionStyle pairs everyone up at once. Use flip() or flipRound()")
         else:
             raise Exception(f"Unknown selectionStyle: {self.selectionStyle}")
 
     def save(self, filepath, history=True, includeTopX=True):
+        """Save the flipper
+            Args:
+                filepath: Where to save it. A directory in the columnar format of storage.py, unless it ends in
+                          .pickle (the old format, a pickle of the whole flipper). If it has no suffix, or is a
+                          directory that is not a saved flipper, a descriptiveFilepath in it is used
+                history: If True, compute the History's stats first, so they are saved too
+        """
         filepath = Path(filepath)
-        if filepath.is_dir() or not filepath.suffix:
+        if not filepath.suffix or (filepath.is_dir() and not storage.isSaved(filepath)):
             filepath = self.descriptiveFilepath(filepath)
         filepath.parent.mkdir(parents=True, exist_ok=True)
 
-        with open(str(filepath), 'wb') as pf:
+        if filepath.suffix != '.pickle':
+            storage.saveFlipper(self, filepath, computeStats=history, includeTopX=includeTopX)
+            return
+
+        # Write to a temporary file and rename it, so filepath is never left half written
+        tmp_path = filepath.with_name(f'.{filepath.name}.tmp')
+        with open(str(tmp_path), 'wb') as pf:
             pickle.dump(self, pf)
+        os.replace(tmp_path, filepath)
 
         if history:
             self.history.save(filepath.with_stem(f"{filepath.stem}_history"), includeTopX=includeTopX)
 
     @classmethod
-    def load(cls, filepath):
+    def load(cls, filepath, mmap=True):
+        """Load a flipper saved by save()
+            Args:
+                mmap: If True (and it was saved in the columnar format), memory-map its arrays instead of reading them
+        """
         filepath = Path(filepath)
+        if filepath.is_dir():
+            return storage.loadFlipper(filepath, cls, mmap=mmap)
         if filepath.exists():
             flipper: cls
             with open(str(filepath), 'rb') as pf:
@@ -187,21 +376,28 @@ class CoinFlipper:
 
 def flipCoins(numFlips=10_000, numPeople=1000, startMoney=100, dollarsPerFlip=1, allowDebt=False,
               plot=False, plotEvery=100, saveHistory=False, showResults=True, plotKind='topXPercentRanges',
-              useCache=False):
-
-    people = Population([])
-    people.add(numPeople, startMoney)
-
-    flipper = CoinFlipper(people, dollarsPerFlip, allowDebt)
-    flipper.flip(numFlips, saveEvery=0, plotEvery=plotEvery if plot else 0, logProgress=True, saveHistory=saveHistory,
-                 plotKind=plotKind, closePlt=False)
-
-    if useCache:
-        cache_dir = Path('flipperCache/cli')
-        flipper_path = cache_dir.joinpath(
-            f'people_{numPeople}_start_{startMoney}_bet_{dollarsPerFlip}_debt_{allowDebt}_'
-            f'flips_{numFlips}.pickle')
-        flipper.save(flipper_path)
+              useCache=False, engine='python', seed=None, cacheDir='flipperCache/cli', maxCacheBytes=2 * 1024 ** 3):
+    """Flip coins from the command line
+        Args:
+            useCache: If True (and there is a seed), reuse the cached run with the same numFlips, numPeople,
+                      startMoney, dollarsPerFlip, allowDebt, seed and engine, or cache this run when done (see
+                      ResultCache)
+            cacheDir: Where runs are cached
+            maxCacheBytes: The most disk space cached runs may take up before the least recently used are evicted
+    """
+    if useCache and seed is None:
+        logging.warning('Not using the cache: runs without a seed are all different')
+    cache = ResultCache(cacheDir, maxBytes=maxCacheBytes) if useCache and seed is not None else None
+    key = {'numFlips': numFlips, 'numPeople': numPeople, 'startMoney': startMoney, 'dollarsPerFlip': dollarsPerFlip,
+           'allowDebt': allowDebt, 'seed': seed, 'engine': engine}
+    flipper = cache.get(key, CoinFlipper, history=saveHistory) if cache else None
+    if flipper is None:
+        people = Population.full(numPeople, startMoney)
+        flipper = CoinFlipper(people, dollarsPerFlip, allowDebt, history=StreamingHistory(orderStats=True), seed=seed)
+        flipper.flip(numFlips, saveEvery=0, plotEvery=plotEvery if plot else 0, logProgress=True,
+                     saveHistory=saveHistory, plotKind=plotKind, closePlt=False, engine=engine)
+        if cache:
+            cache.put(key, flipper, history=saveHistory)
 
     if showResults:
         print()
@@ -0,0 +1,122 @@
+
+# Built-In Python
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from itertools import product
+from pathlib import Path
+import logging
+
+# Third-Party
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+from fire import Fire
+
+# Custom
+from .population import Population
+from .coinFlip import CoinFlipper
+
+# The parameters that make up a parameter set
+PARAMETERS = ['numPeople', 'startMoney', 'dollarsPerFlip', 'allowDebt']
+# The summary stats recorded for every run
+METRICS = ['top_1_percent_wealth', 'top_10_percent_wealth', 'median', 'max', 'min']
+
+
+def _asList(value):
+    return list(value) if isinstance(value, (list, tuple)) else [value]
+
+
+def runOne(job):
+    """Run a single simulation and summarize it every recordEvery flips (this runs in a worker process)
+        Args:
+            job: A dict with the PARAMETERS, plus run, seed (a np.random.SeedSequence), numFlips, recordEvery and engine
+        Returns:
+            A list of summary rows (dicts)
+    """
+    population = Population().add(job['numPeople'], job['startMoney'])
+    flipper = CoinFlipper(population, dollarsPerFlip=job['dollarsPerFlip'], allowDebt=job['allowDebt'],
+                          seed=job['seed'], flipRetention='count')
+
+    def summarize():
+        return {
+            'run': job['run'],
+            **{param: job[param] for param in PARAMETERS},
+            'numFlips': len(flipper.flips),
+            'top_1_percent_wealth': population.getWealthiestXPercent(1).percentWealthOfParent,
+            'top_10_percent_wealth': population.getWealthiestXPercent(10).percentWealthOfParent,
+            'median': population.medianWealth,
+            'max': population.maxWealth,
+            'min': population.minWealth,
+        }
+
+    rows = [summarize()]
+    while len(flipper.flips) < job['numFlips']:
+        flipper.flip(min(job['recordEvery'], job['numFlips'] - len(flipper.flips)), saveHistory=False,
+                     closePlt=False, engine=job['engine'])
+        rows.append(summarize())
+    return rows
+
+
+def runEnsemble(numRuns=100, numFlips=10_000, numPeople=1000, startMoney=100, dollarsPerFlip=1, allowDebt=False,
+                seed=None, recordEvery=1000, outputPath='flipperCache/ensemble/runs.csv', maxWorkers=None,
+                quantiles=(0.05, 0.5, 0.95), engine='numpy', logProgress=True):
+    """Run many simulations for one or more parameter sets across a pool of processes
+
+        Every run gets its own independent random stream, spawned from seed. Each run's summary rows (see METRICS,
+        every recordEvery flips) are appended to outputPath as soon as the run finishes.
+        Args:
+            numRuns: The number of runs for each parameter set
+            numPeople, startMoney, dollarsPerFlip, allowDebt: A value or a list of values. Every combination of these
+                                                              is a parameter set
+            seed: The seed everything is spawned from (None for a random one)
+            recordEvery: The number of flips between summary rows (at least 1)
+            outputPath: A csv file for the per-run summary rows (replaced if it exists)
+            maxWorkers: The number of processes (None for one per core)
+            quantiles: The quantiles to aggregate the METRICS over
+        Returns:
+            A DataFrame with the mean and quantiles of each of the METRICS, per parameter set and number of flips
+    """
+    if int(recordEvery) < 1:
+        raise Exception(f"recordEvery must be at least 1, got {recordEvery}")
+    parameter_sets = [dict(zip(PARAMETERS, values)) for values in
+                      product(_asList(numPeople), _asList(startMoney), _asList(dollarsPerFlip), _asList(allowDebt))]
+    seeds = np.random.SeedSequence(seed).spawn(len(parameter_sets) * numRuns)
+    jobs = [{**params, 'run': run, 'seed': seeds[i * numRuns + run], 'numFlips': int(numFlips),
+             'recordEvery': int(recordEvery), 'engine': engine}
+            for i, params in enumerate(parameter_sets) for run in range(numRuns)]
+
+    output_path = Path(outputPath)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    output_path.unlink(missing_ok=True)
+    logging.info(f'Running {len(jobs):,} simulations. Writing results to {output_path}')
+
+    all_rows = []
+    with ProcessPoolExecutor(max_workers=maxWorkers) as executor:
+        futures = [executor.submit(runOne, job) for job in jobs]
+        for future in tqdm(as_completed(futures), total=len(futures), desc='Running simulations',
+                           disable=not logProgress):
+            rows = future.result()
+            pd.DataFrame(rows).to_csv(output_path, mode='a', header=not output_path.exists(), index=False)
+            all_rows.extend(rows)
+
+    return aggregateRuns(pd.DataFrame(all_rows), quantiles=quantiles)
+
+
+def showResult(result):
+    """Show DataFrames as tables instead of letting Fire treat them as something to explore"""
+    return result.to_string() if isinstance(result, pd.DataFrame) else result
+
+
+def aggregateRuns(runs, quantiles=(0.05, 0.5, 0.95)):
+    """The mean and quantiles of each of the METRICS over runs, per parameter set and number of flips
+        Args:
+            runs: A DataFrame of summary rows, like the ones runEnsemble writes
+    """
+    grouped = runs.groupby(PARAMETERS + ['numFlips'])[METRICS]
+    agg = grouped.mean().add_suffix('_mean')
+    for q in _asList(quantiles):
+        agg = agg.join(grouped.quantile(q).add_suffix(f'_q{round(q * 100):02d}'))
+    return agg.reset_index()
+
+
+if __name__ == '__main__':
+    Fire(runEnsemble, serialize=showResult)
@@ -0,0 +1,140 @@
+
+# Third-Party
+import numpy as np
+
+# Custom
+from .solventIndex import SolventIndex
+
+
+class NumpyFlipEngine:
+    """Flips coins in blocks using NumPy arrays instead of one Python-level flip at a time
+
+        Pairs and outcomes for a whole block are drawn at once and settled against an integer money array.
+        A block is only settled up to the first flip that would change the rules for the flips after it (a loser who
+        can not pay, or a loser who goes broke while brokeIsOut is set). That flip is settled on its own and the rest
+        of the block continues from there, so the results follow exactly the same rules as CoinFlipper.flipOnce.
+    """
+    MIN_BLOCK_SIZE = 64
+
+    def __init__(self, money, numWins, numLosses, dollarsPerFlip: int = 1, allowDebt: bool = False,
+                 brokeIsOut: bool = True, rng: np.random.Generator = None, blockSize: int = 10_000,
+                 solvent: SolventIndex = None):
+        self.money = np.asarray(money, dtype=np.int64)
+        self.numWins = np.asarray(numWins, dtype=np.int64)
+        self.numLosses = np.asarray(numLosses, dtype=np.int64)
+        self.dollarsPerFlip = int(dollarsPerFlip)
+        self.allowDebt = allowDebt
+        self.brokeIsOut = brokeIsOut
+        self.rng = rng or np.random.default_rng()
+        self.maxBlockSize = max(int(blockSize), self.MIN_BLOCK_SIZE)
+        self.blockSize = self.maxBlockSize
+
+        # With brokeIsOut, the eligible people are the solvent ones, which are tracked as they change
+        self.solvent = (solvent or SolventIndex(self.money)) if brokeIsOut else None
+        self._everyone = None if brokeIsOut else np.arange(len(self.money))
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__} | People: {len(self.money):,}>"
+
+    @property
+    def eligible(self):
+        """The indices of the people who can currently be picked for a flip"""
+        return self.solvent.members if self.brokeIsOut else self._everyone
+
+    def drawPairs(self, n):
+        """Draw n (winner, loser) pairs of two different people from the eligible people"""
+        eligible = self.eligible
+        if len(eligible) < 2:
+            raise Exception(f"Can not flip a coin with {len(eligible)} eligible people")
+        first = self.rng.integers(0, len(eligible), size=n)
+        second = self.rng.integers(0, len(eligible) - 1, size=n)
+        # Skip over the first person, so the two are always different people
+        second += second >= first
+        # Either person is equally likely to win
+        swap = self.rng.random(n) < 0.5
+        winners = np.where(swap, second, first)
+        losers = np.where(swap, first, second)
+        return eligible[winners], eligible[losers]
+
+    def settle(self, winners, losers):
+        """Settle as many of the given flips as possible, in order
+            Returns:
+                The number of flips that were handled, a boolean array of which of those were settled and whether the
+                eligible people changed (in which case any remaining flips must be re-drawn)
+        """
+        bet = self.dollarsPerFlip
+        k = len(winners)
+        # Every flip is two entries: +bet for the winner and -bet for the loser
+        who = np.empty(2 * k, dtype=np.int64)
+        who[0::2], who[1::2] = winners, losers
+        delta = np.empty(2 * k, dtype=np.int64)
+        delta[0::2], delta[1::2] = bet, -bet
+        # Group the entries by person (a stable sort keeps each person's entries in flip order)
+        order = np.argsort(who, kind='stable')
+        sorted_who, sorted_delta = who[order], delta[order]
+        # Each person's running money, assuming every flip in the block is settled
+        running = np.cumsum(sorted_delta)
+        starts = np.empty(2 * k, dtype=bool)
+        starts[0] = True
+        starts[1:] = sorted_who[1:] != sorted_who[:-1]
+        running -= (running - sorted_delta)[starts][np.cumsum(starts) - 1]
+        after = np.empty(2 * k, dtype=np.int64)
+        after[order] = self.money[sorted_who] + running
+        loser_after = after[1::2]
+        loser_before = loser_after + bet
+
+        # The first flip that does not follow the assumption above ends the block
+        unsettled = np.zeros(k, dtype=bool) if self.allowDebt else loser_before < bet
+        broke = loser_after <= 0 if self.brokeIsOut else np.zeros(k, dtype=bool)
+        special = unsettled | broke
+        last = int(np.argmax(special)) if special.any() else k - 1
+        num = last + 1
+
+        settled = np.ones(num, dtype=bool)
+        settled[last] = not unsettled[last]
+        eligible_changed = bool(settled[last] and broke[last])
+
+        settled_winners, settled_losers = winners[:num][settled], losers[:num][settled]
+        np.add.at(self.money, settled_winners, bet)
+        np.add.at(self.numWins, settled_winners, 1)
+        np.subtract.at(self.money, settled_losers, bet)
+        np.add.at(self.numLosses, settled_losers, 1)
+
+        if eligible_changed:
+            self.solvent.remove(losers[last])
+        return num, settled, eligible_changed
+
+    def flip(self, num):
+        """Flip num coins
+            Returns:
+                Arrays of the winners, the losers and whether each flip was settled, in flip order
+        """
+        all_winners, all_losers, all_settled = [], [], []
+        pending_winners = pending_losers = np.empty(0, dtype=np.int64)
+        remaining = int(num)
+        while remaining:
+            if not len(pending_winners):
+                pending_winners, pending_losers = self.drawPairs(min(self.blockSize, remaining))
+            handled, settled, eligible_changed = self.settle(pending_winners, pending_losers)
+            all_winners.append(pending_winners[:handled])
+            all_losers.append(pending_losers[:handled])
+            all_settled.append(settled)
+            remaining -= handled
+
+            if handled == len(pending_winners):
+                # The whole block went through, so try a bigger one next time
+                self.blockSize = min(self.blockSize * 2, self.maxBlockSize)
+            else:
+                # Keep blocks close to the distance between special flips, so little work is thrown away
+                self.blockSize = max(handled * 2, self.MIN_BLOCK_SIZE)
+
+            if eligible_changed:
+                # The remaining pairs were drawn from the old eligible people
+                pending_winners = pending_losers = np.empty(0, dtype=np.int64)
+            else:
+                pending_winners, pending_losers = pending_winners[handled:], pending_losers[handled:]
+
+        if not all_winners:
+            empty = np.empty(0, dtype=np.int64)
+            return empty, empty, np.empty(0, dtype=bool)
+        return np.concatenate(all_winners), np.concatenate(all_losers), np.concatenate(all_settled)
@@ -1,72 +1,202 @@
 
 import logging
+import os
+import threading
+from collections import OrderedDict
 from pathlib import Path
 from flask import request
 
-from .coinFlip import CoinFlipper, Flips, Flip, History
+from .coinFlip import CoinFlipper, Flips, Flip, History, StreamingHistory
 from .population import Population
+from .sessionStore import SessionStore, FileSessionStore
+from . import storage
+
+
+class FlipperCache:
+    """Loaded flippers kept in memory between callbacks, shared by every session in the process
+
+        Each entry has a stamp: something that changes whenever the flipper is saved (see SessionStore.version and
+        fileStamp). An entry is only used while its stamp is current, so a save by another process or worker is loaded
+        instead of a stale flipper. Once the entries' arrays take up more than maxBytes (or there are more than
+        maxEntries of them), the least recently used are dropped.
+    """
+    def __init__(self, maxBytes=1024 ** 3, maxEntries=64):
+        self.maxBytes = int(maxBytes)
+        self.maxEntries = int(maxEntries)
+        self.hits = 0
+        self.misses = 0
+        # {key: (stamp, flipper, size in bytes)}, from the least recently used
+        self._entries = OrderedDict()
+        self._numBytes = 0
+        self._lock = threading.RLock()
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__} | Entries: {len(self._entries)} | Size: {self._numBytes:,} bytes | " \
+               f"Hits: {self.hits:,} | Misses: {self.misses:,}>"
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def fileStamp(filepath):
+        """The stamp of a flipper saved to filepath: the (modified time, size) of its manifest (or of the file, for a
+        pickle). Saves replace the manifest, so every save changes it"""
+        path = Path(filepath)
+        if path.is_dir():
+            path = path.joinpath(storage.MANIFEST_FILE)
+        stat = path.stat()
+        return stat.st_mtime_ns, stat.st_size
+
+    @staticmethod
+    def sizeOf(flipper):
+        """Roughly how many bytes a flipper's arrays take up"""
+        arrays = [*flipper.population._columns.values(), *flipper.flips._columns.values(),
+                  *getattr(flipper.history, '_columns', {}).values()]
+        size = sum(a.nbytes for a in arrays)
+        for df in getattr(flipper.history, 'populationDfs', []):
+            size += int(df.memory_usage(deep=False).sum())
+        return size
+
+    def get(self, key, stamp, load):
+        """The flipper for key, from memory if its stamp is current, otherwise from load()"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == stamp:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        flipper = load()
+        self.put(key, stamp, flipper)
+        return flipper
+
+    def put(self, key, stamp, flipper):
+        """Keep flipper, which has just been saved with the given stamp"""
+        size = self.sizeOf(flipper)
+        with self._lock:
+            self._drop(key)
+            self._entries[key] = (stamp, flipper, size)
+            self._numBytes += size
+            # Evict the least recently used, but always keep the newest
+            while len(self._entries) > 1 and (self._numBytes > self.maxBytes or len(self._entries) > self.maxEntries):
+                self._drop(next(iter(self._entries)))
+
+    def _drop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._numBytes -= entry[2]
+
+    def invalidate(self, key):
+        """Forget the flipper for key (e.g. before changing it without saving it)"""
+        with self._lock:
+            self._drop(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._numBytes = 0
+
+
+# Shared by every FlipperManager in the process
+FLIPPER_CACHE = FlipperCache()
 
 
 class FlipperManager:
-    def __init__(self, popSize, startMoney, dollarsPerFlip, allowDebt, includeTopX):
+    def __init__(self, popSize, startMoney, dollarsPerFlip, allowDebt, includeTopX, sessionId=None,
+                 store: SessionStore = None):
+        """
+            Args:
+                sessionId: The session to manage (the client's IP address by default)
+                store: Where the session's flipper is kept (a FileSessionStore by default)
+        """
         self.popSize = popSize
         self.startMoney = startMoney
         self.dollarsPerFlip = dollarsPerFlip
         self.allowDebt = allowDebt
         self.includeTopX = includeTopX
+        self._sessionId = sessionId
+        self.store = store or FileSessionStore()
+
+    @property
+    def sessionId(self):
+        return self._sessionId or request.remote_addr
 
-        self._cachedFlipper = None
+    @property
+    def _cacheKey(self):
+        return repr(self.store), self.sessionId
 
     @property
     def sessionInProgress(self):
-        return self.getFilepath().exists()
+        return self.store.exists(self.sessionId)
 
     @property
     def hasFlipped(self):
-        return self.sessionInProgress and len(self.get().population.flips)
+        return self.sessionInProgress and len(self.get().flips)
+
+    @property
+    def tmpDir(self):
+        """A directory for the session's temporary files"""
+        return self.store.tmpDir(self.sessionId)
 
     @classmethod
     def getFilepath(cls, ip=None):
-        ip = ip or request.remote_addr
-        return Path(f'flipperCache/sessions/{ip}/currentFlipper.pickle')
+        """Where a FileSessionStore keeps the flipper of the session for ip"""
+        return FileSessionStore().getFilepath(ip or request.remote_addr)
 
     def reset(self):
-        filepath = self.getFilepath()
-        filepath.unlink(missing_ok=True)
+        FLIPPER_CACHE.invalidate(self._cacheKey)
+        self.store.delete(self.sessionId)
+
+    def invalidate(self):
+        """Forget the session's cached flipper (e.g. before changing it without saving it)"""
+        FLIPPER_CACHE.invalidate(self._cacheKey)
 
     def new(self, filepath=None):
-        filepath = Path(filepath or self.getFilepath())
-        if filepath.exists():
-            logging.warning(f'Overwriting {filepath} with a new flipper / population')
+        """Start a new flipper and save it to the session (or to filepath)"""
+        if filepath is None and self.sessionInProgress:
+            logging.warning(f'Overwriting the flipper of session {self.sessionId} with a new flipper / population')
 
         logging.info(f'Starting a new Population with {self.popSize} people')
         population = Population()
         population.add(self.popSize, startMoney=self.startMoney)
         flipper = CoinFlipper(population, dollarsPerFlip=self.dollarsPerFlip, allowDebt=self.allowDebt,
-                              selectionStyle='random')
-        flipper.save(filepath, includeTopX=self.includeTopX)
+                              selectionStyle='random',
+                              history=StreamingHistory(includeTopX=self.includeTopX, orderStats=True))
+        self.save(flipper, filepath, includeTopX=self.includeTopX)
         return flipper
 
     def get(self, filepath=None):
-        if filepath or not self._cachedFlipper:
-            filepath = Path(filepath or self.getFilepath())
-            if filepath.exists():
-                logging.info(f'Loading {filepath}')
-                flipper = CoinFlipper.load(filepath)
-                logging.info(f'{filepath} has been loaded')
-                self._cachedFlipper = flipper
-            else:
-                raise Exception(f"No active CoinFlipper. Call {self}.new().")
-            return flipper
-        else:
-            return self._cachedFlipper
+        """The session's flipper (or the one saved to filepath), from FLIPPER_CACHE unless it has been saved since"""
+        if filepath is not None:
+            filepath = Path(filepath)
+            if not filepath.exists():
+                raise Exception(f"There is no CoinFlipper saved to {filepath}")
+            return FLIPPER_CACHE.get(os.path.abspath(filepath), FLIPPER_CACHE.fileStamp(filepath),
+                                     lambda: self._load(filepath, CoinFlipper.load))
+        session_id = self.sessionId
+        if not self.store.exists(session_id):
+            raise Exception(f"No active CoinFlipper. Call {self}.new().")
+        return FLIPPER_CACHE.get(self._cacheKey, self.store.version(session_id),
+                                 lambda: self._load(session_id, self.store.load))
 
-    @classmethod
-    def save(cls, coinFlipper, filepath):
+    @staticmethod
+    def _load(source, load):
+        logging.info(f'Loading {source}')
+        flipper = load(source)
+        logging.info(f'{source} has been loaded')
+        return flipper
+
+    def save(self, coinFlipper, filepath=None, includeTopX=True):
+        """Save a flipper to the session (or to filepath)"""
+        if filepath is None:
+            logging.info(f'Saving session {self.sessionId}')
+            # The History's stats are saved with it
+            version = self.store.save(self.sessionId, coinFlipper, includeTopX=includeTopX)
+            FLIPPER_CACHE.put(self._cacheKey, version, coinFlipper)
+            logging.info(f'Session {self.sessionId} has been saved')
+            return
         logging.info(f'Saving {filepath}')
-        filepath = filepath or coinFlipper.descriptiveFilepath(coinFlipper.cacheDir)
-        coinFlipper.save(filepath)
-        history = coinFlipper.history.getStatsOverTime(includeTopX=True)
-        history.to_pickle(filepath.with_stem(f"{filepath.stem}_history"))
+        coinFlipper.save(filepath, history=True, includeTopX=includeTopX)
+        if Path(filepath).exists():
+            FLIPPER_CACHE.put(os.path.abspath(filepath), FLIPPER_CACHE.fileStamp(filepath), coinFlipper)
         logging.info(f'{filepath} has been saved')
-
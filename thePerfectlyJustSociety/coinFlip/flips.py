@@ -1,12 +1,16 @@
+from bisect import bisect_right
 from collections.abc import Sequence
 
+# Third-Party
+import numpy as np
+
 
 class Flip:
-    def __init__(self, winner, loser, bet: int):
+    def __init__(self, winner, loser, bet: int, settled=False):
         self.winner = winner
         self.loser = loser
         self.bet = int(bet)
-        self.settled = False
+        self.settled = settled
 
     def __repr__(self):
         return f"<{self.__class__.__name__} +{self.winner} -{self.loser} (${self.bet:,})>"
@@ -24,20 +28,170 @@ class Flip:
 
 
 class Flips(Sequence):
-    def __init__(self, flips=None):
-        self.flips = flips or []
+    """A log of coin flips
+
+        Flips are stored as columns (the winner's and loser's rows in the Population, the bet and whether it was
+        settled) and Flip objects are only created when a flip is accessed. How much is kept depends on retention:
+            'all': Keep every flip
+            'last': Keep the last keepLast flips
+            'count': Only count the flips (and how many were settled)
+            'off': Only count the flips
+        len() is always the total number of flips. Indexing works for any flip that is still kept.
+        Flips that were counted without being logged individually (see advance) can not be indexed.
+        Iterating only goes over the flips that are still kept (numKept of them, oldest first), so it can yield fewer
+        flips than len().
+    """
+    RETENTIONS = ('all', 'last', 'count', 'off')
+    COLUMNS = {'winner': np.int32, 'loser': np.int32, 'bet': np.int64, 'settled': np.bool_}
+
+    def __init__(self, flips=None, retention='all', keepLast=10_000, population=None):
+        if retention not in self.RETENTIONS:
+            raise Exception(f"Unknown retention: {retention}. Must be one of {self.RETENTIONS}")
+        self.retention = retention
+        self.keepLast = int(keepLast)
+        # The Population the winner and loser rows refer to
+        self.population = population
+
+        self._columns = {name: np.empty(0, dtype=dtype) for name, dtype in self.COLUMNS.items()}
+        # The number of records kept in self._columns
+        self._size = 0
+        # The total number of flips and how many were settled
+        self._count = 0
+        self._numSettled = 0
+        # The number of records ever logged and how many of those were dropped (retention='last')
+        self._numRecorded = 0
+        self._numDropped = 0
+        # Runs of consecutive logged flips, as the first flip number and first record number of each run.
+        # A new run starts after flips are counted without being logged (see advance)
+        self._runFlips = [0]
+        self._runRecords = [0]
+
+        for flip in flips or []:
+            self.append(flip)
 
     def __repr__(self):
         return f"<{self.__class__.__name__} | Num: {len(self)}>"
 
     def __len__(self):
-        return len(self.flips)
+        return self._count
 
     def __getitem__(self, item):
-        return self.flips[item]
+        if isinstance(item, slice):
+            return [self[i] for i in range(*item.indices(len(self)))]
+        item = int(item)
+        if item < 0:
+            item += len(self)
+        if not 0 <= item < len(self):
+            raise IndexError(f"{self} has no flip at index {item}")
+        run = bisect_right(self._runFlips, item) - 1
+        record = self._runRecords[run] + item - self._runFlips[run]
+        run_end = self._runRecords[run + 1] if run + 1 < len(self._runRecords) else self._numRecorded
+        if record >= run_end:
+            raise IndexError(f"Flip {item:,} was not logged individually")
+        if record < self._numDropped:
+            raise IndexError(f"Flip {item:,} is no longer kept (retention: {self.retention})")
+        return self._getFlip(record - self._numDropped)
 
     def __iter__(self):
-        return iter(self.flips)
+        """The flips that are still kept (see numKept), oldest first"""
+        return (self._getFlip(record) for record in range(self._size))
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # Don't pickle the spare capacity
+        state['_columns'] = {name: col[:self._size].copy() for name, col in self._columns.items()}
+        return state
+
+    def __setstate__(self, d):
+        self.__dict__ = d
+
+    @property
+    def numSettled(self):
+        return self._numSettled
+
+    def getColumn(self, name):
+        """The kept flips' values for one of the columns (see Flips.COLUMNS) as a NumPy array"""
+        return self._columns[name][:self._size].copy()
+
+    @property
+    def numKept(self):
+        """The number of flips that are still kept (the ones iterating goes over)"""
+        return self._size
+
+    @property
+    def numRecorded(self):
+        """The number of flips ever logged individually (including any that are no longer kept)"""
+        return self._numRecorded
+
+    def recordsSince(self, numRecorded):
+        """The columns (see Flips.COLUMNS) of the flips logged after the first numRecorded, as read-only views"""
+        if numRecorded < self._numDropped:
+            raise IndexError(f"Flips logged before record {self._numDropped:,} are no longer kept "
+                             f"(retention: {self.retention})")
+        start = numRecorded - self._numDropped
+        records = {}
+        for name, col in self._columns.items():
+            records[name] = col[start:self._size]
+            records[name].flags.writeable = False
+        return records
+
+    def _getFlip(self, record):
+        if self.population is None:
+            raise Exception(f"Can not get a flip from {self}. It has no Population for the winner and loser rows")
+        cols = self._columns
+        return Flip(winner=self.population[cols['winner'][record]], loser=self.population[cols['loser'][record]],
+                    bet=cols['bet'][record], settled=bool(cols['settled'][record]))
 
     def append(self, val):
-        self.flips.append(val)
+        self.extendArrays([val.winner.row], [val.loser.row], val.bet, [val.settled])
+
+    def extend(self, vals):
+        for val in vals:
+            self.append(val)
+
+    def advance(self, num, numSettled=None):
+        """Count num flips (numSettled of which were settled, all of them by default) without logging them"""
+        num = int(num)
+        self._count += num
+        if self.retention != 'off':
+            self._numSettled += num if numSettled is None else int(numSettled)
+        if num and self.retention in ('all', 'last'):
+            self._runFlips.append(self._count)
+            self._runRecords.append(self._numRecorded)
+
+    def extendArrays(self, winners, losers, bets, settled):
+        """Log flips from arrays of the winners' and losers' rows, the bets (or one bet for all) and settled flags"""
+        settled = np.asarray(settled, dtype=bool)
+        n = len(settled)
+        self._count += n
+        if self.retention != 'off':
+            self._numSettled += int(settled.sum())
+        if self.retention not in ('all', 'last'):
+            return
+
+        new = {'winner': winners, 'loser': losers, 'bet': np.broadcast_to(bets, (n,)), 'settled': settled}
+        self._numRecorded += n
+        if self.retention == 'last':
+            if n >= self.keepLast:
+                # Only the newest flips will be kept
+                new = {name: np.asarray(values)[n - self.keepLast:] for name, values in new.items()}
+                self._numDropped += self._size + n - self.keepLast
+                self._size = 0
+            elif self._size + n > 2 * self.keepLast:
+                # Drop the oldest flips. Only doing this when twice as many are kept keeps appending cheap
+                drop = self._size + n - self.keepLast
+                for col in self._columns.values():
+                    col[:self._size - drop] = col[drop:self._size]
+                self._size -= drop
+                self._numDropped += drop
+
+        n = len(new['settled'])
+        new_size = self._size + n
+        for name, col in self._columns.items():
+            if len(col) < new_size:
+                # Grow geometrically, so appending one flip at a time is cheap
+                grown = np.empty(max(new_size, 2 * len(col)), dtype=col.dtype)
+                grown[:self._size] = col[:self._size]
+                self._columns[name] = col = grown
+            col[self._size:new_size] = new[name]
+        self._size = new_size
@@ -0,0 +1,533 @@
+
+# Built-In Python
+from bisect import bisect_right
+from pathlib import Path
+import json
+import logging
+import shutil
+import uuid
+
+# Third-Party
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+
+# Custom
+from .population import Population
+from .metrics import METRICS, inequalityStats
+
+
+def getStatsRow(money, includeTopX=True):
+    """The stats History keeps for a population with the given money (everything but numFlips and money)
+        Args:
+            money: The money of each person in the population
+            includeTopX: If True, include the percent of the total wealth held by each 'top X' bin of people.
+                         If a list, only include the bins at these indices
+    """
+    money = np.asarray(money)
+    total = money.sum()
+    row_data = {
+        'total': total,
+        'max': money.max(),
+        'min': money.min(),
+        'mean': money.mean(),
+        'median': np.median(money)
+    }
+    if includeTopX:
+        # Split the People into bins by wealth (as np.array_split(sorted_money, num_bins) would)
+        num_bins = round(len(money) * 0.1)
+        if num_bins:
+            sorted_money = np.sort(money)[::-1]
+            bin_size, num_bigger = divmod(len(money), num_bins)
+            bin_sizes = np.full(num_bins, bin_size)
+            bin_sizes[:num_bigger] += 1
+            bin_starts = np.concatenate([[0], np.cumsum(bin_sizes)[:-1]])
+            bin_totals = np.add.reduceat(sorted_money, bin_starts)
+            use_indices = includeTopX if isinstance(includeTopX, list) else list(range(0, 100))
+            for idx in use_indices:
+                if idx < num_bins:
+                    row_data[f"top_{idx}_to_{idx+1}_percent_wealth"] = bin_totals[idx] / total * 100
+    return row_data
+
+
+class History:
+    def __init__(self):
+        self.moneyStamps = []
+        self.numFlips = []
+        self.populationDfs = []
+
+        self.stats = pd.DataFrame(columns=['numFlips', 'money', 'total', 'max', 'min', 'mean', 'median'])\
+            .set_index('numFlips', drop=False)
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__} | Entries: {len(self)}>"
+
+    def __len__(self):
+        return len(self.moneyStamps)
+
+    def add(self, population: Population, numFlips: int):
+        # One copy of the columns, shared by the DataFrame and the money stamp
+        df = population.toDf()
+        self.moneyStamps.append(df['money'].to_numpy())
+        self.numFlips.append(numFlips)
+        self.populationDfs.append(df)
+
+    def addFlips(self, population: Population, winners, losers, bets, settled, firstFlip: int):
+        """Called by CoinFlipper after it settles flips, with the winners' and losers' rows, the bets (or one bet for
+        all), whether each was settled and the number of the first of these flips. History does not need them"""
+
+    def populationChanged(self, population: Population, numFlips: int):
+        """Called by CoinFlipper when it changes the population some way other than settling flips (like
+        CoinFlipper.fastForward). History does not need to know"""
+
+    def at(self, numFlips):
+        """The Population as it was after numFlips flips (only if it was added at exactly that number of flips)"""
+        if numFlips not in self.numFlips:
+            raise Exception(f"{self} has no snapshot after {numFlips:,} flips")
+        return Population.fromDf(self.populationDfs[self.numFlips.index(numFlips)])
+
+    def getStatsOverTime(self, includeTopX=True, logProgress=False):
+        df = self.stats
+        new_data = []
+        if len(self):
+            start_flip = len(df)
+            for i in tqdm(range(start_flip, len(self)), desc=f'Converting History to df', disable=not logProgress):
+                # A DataFrame representing the population after a given number of flips (self.numFlips[i])
+                row = self.populationDfs[i]
+                # Converting the df to a single row, so it can be a part of the full history df
+                row_data = {
+                    'numFlips': self.numFlips[i],
+                    'money': row.money.values,  # This will be a numpy array, saved in a single cell of the df
+                    **getStatsRow(row.money.values, includeTopX=includeTopX)
+                }
+                new_data.append(row_data)
+            new_df = pd.DataFrame(new_data)
+            df = pd.concat([self.stats, new_df])
+            self.stats = df
+        return self.stats
+
+    def _moneyChunks(self, chunkSize):
+        """Yield (numFlips, a (snapshots x people) matrix of money) for up to chunkSize snapshots at a time"""
+        money_stamps, num_flips = self.moneyStamps, self.numFlips
+        start = 0
+        while start < len(self):
+            end = min(start + chunkSize, len(self))
+            # Snapshots in a matrix must have the same number of people
+            size = len(money_stamps[start])
+            end = next((i for i in range(start, end) if len(money_stamps[i]) != size), end)
+            yield num_flips[start:end], np.stack([np.asarray(money) for money in money_stamps[start:end]])
+            start = end
+
+    def getInequalityOverTime(self, chunkSize=256, logProgress=False):
+        """The inequality metrics (see metrics.METRICS) after each number of flips
+            Args:
+                chunkSize: The number of snapshots computed together (in a single batched call)
+        """
+        data = {'numFlips': [], **{metric: [] for metric in METRICS}}
+        with tqdm(total=len(self), desc='Measuring inequality', disable=not logProgress) as progress:
+            for num_flips, money in self._moneyChunks(chunkSize):
+                data['numFlips'].extend(num_flips)
+                for metric, values in inequalityStats(money).items():
+                    data[metric].extend(np.atleast_1d(values).tolist())
+                progress.update(len(num_flips))
+        return pd.DataFrame(data)
+
+    def save(self, filepath, includeTopX=True):
+        df = self.getStatsOverTime(includeTopX=includeTopX)
+        df.to_pickle(str(filepath))
+
+
+class StreamingHistory(History):
+    """A History that computes its stats when a population is added, instead of keeping snapshots of it
+
+        Each row of stats goes into preallocated columns (grown geometrically), so memory is O(stats x entries)
+        instead of O(people x entries). The stats are the same as History's, except there is no 'money' column.
+        Which 'top X' columns are kept is decided up front, by includeTopX.
+        With orderStats (and no 'top X' columns), the stats come from the population's WealthIndex (see
+        Population.wealthIndex) instead of a sort, so adding a row costs O(log N) and a row can be kept after every
+        flip. The 'top X' columns, or money too spread out for an index, are computed with a sort instead.
+        With inequality, each row also gets the inequality metrics (see metrics.METRICS).
+    """
+    def __init__(self, includeTopX=True, capacity=1024, orderStats=False, inequality=False):
+        self.includeTopX = includeTopX
+        self.orderStats = orderStats
+        self.inequality = inequality
+        self._columns = {'numFlips': np.empty(capacity, dtype=np.int64)}
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # Don't pickle the spare capacity
+        state['_columns'] = {name: col[:self._size].copy() for name, col in self._columns.items()}
+        return state
+
+    def __setstate__(self, d):
+        self.__dict__ = d
+
+    @property
+    def numFlips(self):
+        return self._columns['numFlips'][:self._size].tolist()
+
+    @property
+    def stats(self):
+        return self.getStatsOverTime()
+
+    def add(self, population: Population, numFlips: int):
+        # Without an index (or if the money is too spread out for one, or the 'top X' bins are wanted), sort
+        index = population.wealthIndex if self.orderStats and not self.includeTopX else None
+        if index is not None:
+            stats = index.statsRow(includeTopX=self.includeTopX)
+        else:
+            stats = getStatsRow(population.getMoneyStamp(copy=False), includeTopX=self.includeTopX)
+        if self.inequality:
+            stats.update(inequalityStats(population if index is None else index))
+        self.addRow({'numFlips': numFlips, **stats})
+
+    def addRow(self, row):
+        """Add a row of stats (a dict of {column: value})"""
+        if self._size == len(self._columns['numFlips']):
+            # Grow geometrically, so adding rows is cheap
+            for name, col in self._columns.items():
+                grown = np.full(2 * len(col), np.nan, dtype=col.dtype) if col.dtype.kind == 'f' \
+                    else np.empty(2 * len(col), dtype=col.dtype)
+                grown[:self._size] = col[:self._size]
+                self._columns[name] = grown
+        for name, value in row.items():
+            if name not in self._columns:
+                # Rows added before this column existed are left as NaN
+                dtype = np.int64 if isinstance(value, (int, np.integer)) and not self._size else np.float64
+                self._columns[name] = np.full(len(self._columns['numFlips']), np.nan if dtype == np.float64 else 0,
+                                              dtype=dtype)
+            self._columns[name][self._size] = value
+        self._size += 1
+
+    def addRows(self, columns):
+        """Add many rows of stats at once (a dict of {column: array of values})"""
+        n = len(columns['numFlips'])
+        new_size = self._size + n
+        capacity = len(self._columns['numFlips'])
+        if new_size > capacity:
+            capacity = max(new_size, 2 * capacity)
+            for name, col in self._columns.items():
+                grown = np.full(capacity, np.nan, dtype=col.dtype) if col.dtype.kind == 'f' \
+                    else np.empty(capacity, dtype=col.dtype)
+                grown[:self._size] = col[:self._size]
+                self._columns[name] = grown
+        for name, values in columns.items():
+            if name not in self._columns:
+                # Rows added before this column existed are left as NaN
+                values = np.asarray(values)
+                dtype = values.dtype if values.dtype.kind in 'iu' and not self._size else np.float64
+                self._columns[name] = np.full(capacity, np.nan if dtype == np.float64 else 0, dtype=dtype)
+            self._columns[name][self._size:new_size] = values
+        self._size = new_size
+
+    def getStatsOverTime(self, includeTopX=True, logProgress=False):
+        """The stats as a DataFrame. includeTopX and logProgress are only here to match History (see includeTopX in
+        StreamingHistory.__init__)"""
+        return pd.DataFrame({name: col[:self._size] for name, col in self._columns.items()})
+
+    def at(self, numFlips):
+        raise Exception(f"{self.__class__.__name__} does not keep populations. Use a History or DeltaHistory")
+
+    def getInequalityOverTime(self, chunkSize=256, logProgress=False):
+        """The inequality metrics kept with each row (see inequality in StreamingHistory.__init__)"""
+        if not self.inequality:
+            raise Exception(f"{self} does not keep snapshots. Create it with inequality=True to keep the metrics")
+        return self.getStatsOverTime()[['numFlips', *METRICS]]
+
+
+class MemmapHistory(History):
+    """A History that keeps its money snapshots on disk instead of in memory
+
+        Each snapshot is appended as a row of a (snapshots x people) matrix in a raw file in directory, and read back
+        through np.memmap, so only the rows that are used are ever loaded. Pickling a MemmapHistory only pickles the
+        directory and some counters. Creating a MemmapHistory for a directory that already has snapshots continues it.
+        Rows are never overwritten: a MemmapHistory that has fewer rows than its files (like one loaded from an older
+        save) copies its rows to a new directory before adding any.
+        The stats are the same as History's, except there is no 'money' column.
+    """
+    MONEY_FILE = 'money.bin'
+    NUM_FLIPS_FILE = 'numFlips.bin'
+    META_FILE = 'meta.json'
+
+    def __init__(self, directory, includeTopX=True):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.includeTopX = includeTopX
+        self.stats = pd.DataFrame(columns=['numFlips', 'total', 'max', 'min', 'mean', 'median'])
+
+        self.numPeople = None
+        self.dtype = None
+        meta_path = self.directory.joinpath(self.META_FILE)
+        if meta_path.exists():
+            meta = json.loads(meta_path.read_text())
+            self.numPeople, self.dtype = meta['numPeople'], np.dtype(meta['dtype'])
+        self._len = self._numRowsOnDisk()
+        self._moneyFile = None
+        self._numFlipsFile = None
+
+    def __len__(self):
+        return self._len
+
+    def __getstate__(self):
+        # Make sure everything counted is on disk
+        self._flush()
+        state = self.__dict__.copy()
+        state['_moneyFile'] = state['_numFlipsFile'] = None
+        return state
+
+    def __setstate__(self, d):
+        self.__dict__ = d
+
+    def _numRowsOnDisk(self):
+        """The number of complete rows in the files (the last one may be cut short if a write was interrupted)"""
+        if self.numPeople is None:
+            return 0
+        row_bytes = self.numPeople * self.dtype.itemsize
+        return min(self._fileSize(self.MONEY_FILE) // row_bytes, self._fileSize(self.NUM_FLIPS_FILE) // 8)
+
+    def _fileSize(self, filename):
+        path = self.directory.joinpath(filename)
+        return path.stat().st_size if path.exists() else 0
+
+    def _flush(self):
+        for f in (self._moneyFile, self._numFlipsFile):
+            if f is not None:
+                f.flush()
+
+    def close(self):
+        for f in (self._moneyFile, self._numFlipsFile):
+            if f is not None:
+                f.close()
+        self._moneyFile = self._numFlipsFile = None
+
+    def _open(self):
+        if self._moneyFile is None:
+            if self._numRowsOnDisk() > self._len:
+                # The rows past this one's may belong to someone else (like a newer save of the same run), so carry on
+                # in a copy instead of overwriting them
+                self._copyTo(self.directory.with_name(f'{self.directory.name}_{uuid.uuid4().hex[:8]}'))
+            money_path = self.directory.joinpath(self.MONEY_FILE)
+            num_flips_path = self.directory.joinpath(self.NUM_FLIPS_FILE)
+            row_bytes = self.numPeople * self.dtype.itemsize
+            self._moneyFile = open(money_path, 'ab')
+            self._numFlipsFile = open(num_flips_path, 'ab')
+            # Drop a row cut short by an interrupted write (no one else can be using it)
+            self._moneyFile.truncate(self._len * row_bytes)
+            self._numFlipsFile.truncate(self._len * 8)
+
+    def _copyTo(self, directory):
+        """Copy this History's rows to a new directory and carry on there"""
+        directory.mkdir(parents=True)
+        row_bytes = self.numPeople * self.dtype.itemsize
+        for filename, num_bytes in ((self.MONEY_FILE, self._len * row_bytes), (self.NUM_FLIPS_FILE, self._len * 8)):
+            with open(self.directory.joinpath(filename), 'rb') as src, open(directory.joinpath(filename), 'wb') as dst:
+                while num_bytes > 0:
+                    chunk = src.read(min(num_bytes, 1 << 24))
+                    dst.write(chunk)
+                    num_bytes -= len(chunk)
+        shutil.copyfile(self.directory.joinpath(self.META_FILE), directory.joinpath(self.META_FILE))
+        logging.info(f'{self.directory} has rows past the {self._len:,} of {self}. Carrying on in a copy: {directory}')
+        self.directory = directory
+
+    @property
+    def moneyStamps(self):
+        """Every snapshot as a read-only (snapshots x people) memory-mapped matrix"""
+        if not self._len:
+            return np.empty((0, self.numPeople or 0), dtype=self.dtype or np.int64)
+        self._flush()
+        return np.memmap(self.directory.joinpath(self.MONEY_FILE), dtype=self.dtype, mode='r',
+                         shape=(self._len, self.numPeople))
+
+    @property
+    def numFlips(self):
+        if not self._len:
+            return []
+        self._flush()
+        return np.memmap(self.directory.joinpath(self.NUM_FLIPS_FILE), dtype=np.int64, mode='r',
+                         shape=(self._len,)).tolist()
+
+    def getMoneyStamp(self, index):
+        """The money of each person in a single snapshot (a read-only view, read from disk when used)"""
+        return self.moneyStamps[index]
+
+    def at(self, numFlips):
+        raise Exception(f"{self.__class__.__name__} only keeps money. Use getMoneyStamp, or a History or DeltaHistory")
+
+    def add(self, population: Population, numFlips: int):
+        money = population.getMoneyStamp(copy=False)
+        if self.numPeople is None:
+            self.numPeople, self.dtype = len(money), money.dtype
+            self.directory.joinpath(self.META_FILE).write_text(
+                json.dumps({'numPeople': self.numPeople, 'dtype': self.dtype.str}))
+        elif len(money) != self.numPeople:
+            raise Exception(f"{self} holds snapshots of {self.numPeople:,} people, not {len(money):,}")
+        if money.dtype != self.dtype:
+            if len(money) and not (np.iinfo(self.dtype).min <= money.min() and money.max() <= np.iinfo(self.dtype).max):
+                raise OverflowError(f"Money from {money.min():,} to {money.max():,} does not fit in {self.dtype}")
+            money = money.astype(self.dtype)
+
+        self._open()
+        self._moneyFile.write(np.ascontiguousarray(money).data)
+        self._numFlipsFile.write(np.int64(numFlips).tobytes())
+        self._len += 1
+
+    def getStatsOverTime(self, includeTopX=True, logProgress=False):
+        """The stats for each snapshot. Snapshots are read from disk one at a time, and only the first time
+            includeTopX is only here to match History (see includeTopX in MemmapHistory.__init__)
+        """
+        start = len(self.stats)
+        if start < len(self):
+            money_stamps, num_flips = self.moneyStamps, self.numFlips
+            new_data = [{'numFlips': num_flips[i], **getStatsRow(money_stamps[i], includeTopX=self.includeTopX)}
+                        for i in tqdm(range(start, len(self)), desc=f'Converting History to df',
+                                      disable=not logProgress)]
+            new_df = pd.DataFrame(new_data)
+            self.stats = new_df if self.stats.empty else pd.concat([self.stats, new_df], ignore_index=True)
+        return self.stats
+
+
+class DeltaHistory(History):
+    """A History that keeps what each flip changed instead of snapshots of the population
+
+        Every settled flip is kept as a delta (flip number, winner, loser, amount) and a full keyframe of the
+        population's changing columns is kept every keyframeEvery flips (and whenever the population changes some
+        other way). at(numFlips) rebuilds the population at any flip since the first keyframe by replaying the deltas
+        after the nearest keyframe, so storage is O(flips + people x keyframes) instead of O(people x snapshots).
+        The stats are the same as History's, except there is no 'money' column.
+    """
+    DELTA_COLUMNS = {'flip': np.int64, 'winner': np.int32, 'loser': np.int32, 'amount': np.int64}
+    KEYFRAME_COLUMNS = ('money', 'numWins', 'numLosses')
+
+    def __init__(self, keyframeEvery=10_000, includeTopX=True):
+        self.keyframeEvery = int(keyframeEvery)
+        self.includeTopX = includeTopX
+        self.numFlips = []
+        self.stats = pd.DataFrame(columns=['numFlips', 'total', 'max', 'min', 'mean', 'median'])
+
+        self._deltas = {name: np.empty(0, dtype=dtype) for name, dtype in self.DELTA_COLUMNS.items()}
+        self._numDeltas = 0
+        # The number of flips at each keyframe, and the keyframes ({column: values})
+        self._keyframeFlips = []
+        self._keyframes = []
+        # The columns that never change (idNum and startMoney), from the latest keyframe
+        self._fixedColumns = None
+
+    def __len__(self):
+        return len(self.numFlips)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # Don't pickle the spare capacity
+        state['_deltas'] = {name: col[:self._numDeltas].copy() for name, col in self._deltas.items()}
+        return state
+
+    def __setstate__(self, d):
+        self.__dict__ = d
+
+    @property
+    def numDeltas(self):
+        return self._numDeltas
+
+    @property
+    def numKeyframes(self):
+        return len(self._keyframes)
+
+    def addKeyframe(self, population: Population, numFlips: int):
+        """Keep a full copy of the population's changing columns after numFlips flips"""
+        if self._keyframeFlips and self._keyframeFlips[-1] == numFlips:
+            # Replace the keyframe for the same flip, rather than keeping two
+            self._keyframeFlips.pop()
+            self._keyframes.pop()
+        self._keyframeFlips.append(int(numFlips))
+        self._keyframes.append({name: population.getColumn(name) for name in self.KEYFRAME_COLUMNS})
+        if self._fixedColumns is None or len(self._fixedColumns['idNum']) != len(population):
+            self._fixedColumns = {'idNum': population.getColumn('idNum'),
+                                  'startMoney': population.getColumn('startMoney')}
+
+    def add(self, population: Population, numFlips: int):
+        if not self._keyframes or len(self._keyframes[-1]['money']) != len(population):
+            self.addKeyframe(population, numFlips)
+        self.numFlips.append(int(numFlips))
+
+    def addFlips(self, population: Population, winners, losers, bets, settled, firstFlip: int):
+        settled = np.asarray(settled, dtype=bool)
+        n = len(settled)
+        new = {
+            'flip': (firstFlip + np.arange(n))[settled],
+            'winner': np.asarray(winners)[settled],
+            'loser': np.asarray(losers)[settled],
+            'amount': np.broadcast_to(bets, (n,))[settled]
+        }
+        num_new = len(new['flip'])
+        new_size = self._numDeltas + num_new
+        for name, col in self._deltas.items():
+            if len(col) < new_size:
+                # Grow geometrically, so adding one flip at a time is cheap
+                grown = np.empty(max(new_size, 2 * len(col)), dtype=col.dtype)
+                grown[:self._numDeltas] = col[:self._numDeltas]
+                self._deltas[name] = col = grown
+            col[self._numDeltas:new_size] = new[name]
+        self._numDeltas = new_size
+
+        num_flips = firstFlip + n
+        if not self._keyframes or num_flips - self._keyframeFlips[-1] >= self.keyframeEvery:
+            self.addKeyframe(population, num_flips)
+
+    def populationChanged(self, population: Population, numFlips: int):
+        # The deltas can not describe the change, so start again from a keyframe
+        self.addKeyframe(population, numFlips)
+
+    def _replay(self, numFlipsList):
+        """Yield the changing columns after each of numFlipsList (which must be in order), replaying as little as
+        possible"""
+        columns, current = None, None
+        for num_flips in numFlipsList:
+            keyframe_idx = bisect_right(self._keyframeFlips, num_flips) - 1
+            if keyframe_idx < 0:
+                raise Exception(f"{self} has no keyframe at or before {num_flips:,} flips")
+            keyframe_flips = self._keyframeFlips[keyframe_idx]
+            if columns is None or current < keyframe_flips or current > num_flips:
+                # Jump to the keyframe (replaying from where we are would be no cheaper)
+                columns = {name: values.astype(np.int64) for name, values in self._keyframes[keyframe_idx].items()}
+                current = keyframe_flips
+            flips = self._deltas['flip'][:self._numDeltas]
+            start, end = np.searchsorted(flips, [current, num_flips])
+            winners = self._deltas['winner'][start:end]
+            losers = self._deltas['loser'][start:end]
+            amounts = self._deltas['amount'][start:end]
+            np.add.at(columns['money'], winners, amounts)
+            np.subtract.at(columns['money'], losers, amounts)
+            np.add.at(columns['numWins'], winners, 1)
+            np.add.at(columns['numLosses'], losers, 1)
+            current = num_flips
+            yield columns
+
+    def _moneyChunks(self, chunkSize):
+        num_flips = self.numFlips
+        for start in range(0, len(self), chunkSize):
+            chunk = num_flips[start:start + chunkSize]
+            yield chunk, np.stack([columns['money'].copy() for columns in self._replay(chunk)])
+
+    def at(self, numFlips):
+        """The Population as it was after numFlips flips (rebuilt from the nearest keyframe and the deltas after it)"""
+        columns = next(self._replay([int(numFlips)]))
+        return Population._fromColumns({**self._fixedColumns, **columns})
+
+    def getStatsOverTime(self, includeTopX=True, logProgress=False):
+        """The stats after each added number of flips (rebuilt by replaying the deltas, only the first time)
+            includeTopX is only here to match History (see includeTopX in DeltaHistory.__init__)
+        """
+        start = len(self.stats)
+        if start < len(self):
+            num_flips = self.numFlips[start:]
+            new_data = [{'numFlips': n, **getStatsRow(columns['money'], includeTopX=self.includeTopX)}
+                        for n, columns in tqdm(zip(num_flips, self._replay(num_flips)), total=len(num_flips),
+                                               desc=f'Converting History to df', disable=not logProgress)]
+            new_df = pd.DataFrame(new_data)
+            self.stats = new_df if self.stats.empty else pd.concat([self.stats, new_df], ignore_index=True)
+        return self.stats
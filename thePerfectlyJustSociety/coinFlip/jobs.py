@@ -0,0 +1,532 @@
+
+# Built-In Python
+from pathlib import Path
+import json
+import logging
+import multiprocessing
+import os
+import pickle
+import shutil
+import sqlite3
+import time
+import traceback
+import uuid
+
+# Third-Party
+from fire import Fire
+
+# Custom
+from .sessionStore import SessionStore
+from .history import StreamingHistory
+from .checkpoint import Checkpointer
+from . import storage
+
+# The states a job ends in
+FINISHED = ('done', 'failed', 'cancelled')
+
+
+class JobCancelled(Exception):
+    """Raised by a job (see Job.checkCancelled) to stop once it has been cancelled"""
+
+
+class TooManyJobs(Exception):
+    """Raised by JobQueue.submit when a session already has as many jobs waiting or running as it may"""
+
+
+class Job:
+    """What a job's function gets as its first argument, to report its progress, publish updates (e.g. partial
+    results) and find out if it was cancelled
+        setProgress and cancelled only touch the database every updateEvery seconds, so they can be called after every
+        flip.
+    """
+    def __init__(self, queue, jobId, updateEvery=0.2):
+        self.queue = queue
+        self.jobId = jobId
+        self.updateEvery = updateEvery
+        self._lastUpdate = 0
+        self._lastCheck = 0
+        self._cancelled = False
+        self._numPublished = 0
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__} {self.jobId}>"
+
+    def setProgress(self, progress):
+        """Record how far along the job is (from 0 to 1)"""
+        now = time.monotonic()
+        if now - self._lastUpdate >= self.updateEvery or progress >= 1:
+            self._lastUpdate = now
+            self.queue._execute('UPDATE jobs SET progress = ? WHERE jobId = ?', (float(progress), self.jobId))
+
+    def cancelled(self):
+        """True once the job has been cancelled, or abandoned by whatever was waiting for it (see JobQueue.submit)"""
+        now = time.monotonic()
+        if not self._cancelled and now - self._lastCheck >= self.updateEvery:
+            self._lastCheck = now
+            row = self.queue._execute('SELECT cancelRequested, abandonAfter, lastPolled FROM jobs WHERE jobId = ?',
+                                      (self.jobId,)).fetchone()
+            cancel_requested, abandon_after, last_polled = row
+            self._cancelled = bool(cancel_requested) or \
+                (abandon_after is not None and time.time() - last_polled > abandon_after)
+        return self._cancelled
+
+    def checkCancelled(self):
+        if self.cancelled():
+            raise JobCancelled(f"{self} was cancelled")
+
+    def publish(self, update):
+        """Publish something (picklable) for whatever is waiting on the job to pick up (see JobQueue.updates)"""
+        self.queue._execute('INSERT INTO jobUpdates VALUES (?, ?, ?)',
+                            (self.jobId, self._numPublished, pickle.dumps(update, protocol=pickle.HIGHEST_PROTOCOL)))
+        self._numPublished += 1
+
+
+class JobQueue:
+    """A queue of jobs (functions run in a pool of worker processes) that any process can submit to and poll
+
+        The queue is a SQLite database, so the web app's callbacks (which each run in a process of their own) and its
+        workers all share it. start() runs maxWorkers worker processes, each of which takes the next job, runs it and
+        records its result. The next job is picked fairly between sessions: from the session with the fewest running
+        jobs, then the one that has waited longest since a job of its own started, then the oldest. A session can have
+        at most maxJobsPerSession jobs waiting or running.
+        A job's function is called with a Job (to report progress and check for cancellation) and the arguments it was
+        submitted with. It has to be importable by the workers (a module-level function) and its arguments and result
+        have to be picklable.
+        Only one pool of workers runs for a database at a time: start() takes a lock file next to it (held for as long
+        as the pool runs), and does nothing if another process already has it. workersAlive() tells any process whether
+        there is a pool, so whatever is waiting on a job can give up instead of waiting for ever.
+    """
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS jobs (
+            jobId TEXT PRIMARY KEY,
+            sessionId TEXT NOT NULL,
+            state TEXT NOT NULL,
+            call BLOB NOT NULL,
+            submitted REAL NOT NULL,
+            started REAL,
+            finished REAL,
+            progress REAL NOT NULL DEFAULT 0,
+            cancelRequested INTEGER NOT NULL DEFAULT 0,
+            abandonAfter REAL,
+            lastPolled REAL NOT NULL,
+            result BLOB,
+            error TEXT
+        );
+        CREATE INDEX IF NOT EXISTS jobsByState ON jobs (state, submitted);
+        CREATE INDEX IF NOT EXISTS jobsBySession ON jobs (sessionId, state);
+        CREATE TABLE IF NOT EXISTS jobUpdates (
+            jobId TEXT NOT NULL,
+            seq INTEGER NOT NULL,
+            data BLOB NOT NULL,
+            PRIMARY KEY (jobId, seq)
+        );
+    """
+    # Pick the next job fairly between sessions (see the class's docstring)
+    NEXT_JOB = """
+        SELECT jobId FROM jobs AS j WHERE state = 'queued'
+        ORDER BY (SELECT COUNT(*) FROM jobs WHERE sessionId = j.sessionId AND state = 'running'),
+                 (SELECT COALESCE(MAX(started), 0) FROM jobs WHERE sessionId = j.sessionId),
+                 submitted
+        LIMIT 1
+    """
+
+    def __init__(self, path='flipperCache/jobs.sqlite', maxWorkers=None, maxJobsPerSession=2, keepFinished=60 * 60,
+                 timeout=30, pollEvery=0.1):
+        """
+            Args:
+                path: The database file (created if it does not exist)
+                maxWorkers: The number of worker processes start() runs (the number of CPUs by default)
+                maxJobsPerSession: The most jobs a session can have waiting or running at once
+                keepFinished: How many seconds to keep finished jobs (and their results) for
+                timeout: How many seconds to wait for another process's write to the database
+                pollEvery: How often (in seconds) idle workers look for a job and result() checks on one
+        """
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.maxWorkers = maxWorkers or os.cpu_count() or 1
+        self.maxJobsPerSession = maxJobsPerSession
+        self.keepFinished = keepFinished
+        self.timeout = timeout
+        self.pollEvery = pollEvery
+        self._db = None
+        self._pid = None
+        self._workers = []
+        self._stop = None
+        self._poolLock = None
+        # The process that started the workers (processes forked from it get copies of _workers they can not use)
+        self._poolPid = None
+        self._connect().executescript(self.SCHEMA)
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__} {self.path} | Workers: {len(self._workers)}>"
+
+    def __getstate__(self):
+        # Connections and worker processes stay with the process that made them
+        state = self.__dict__.copy()
+        state.update(_db=None, _pid=None, _workers=[], _stop=None, _poolLock=None, _poolPid=None)
+        return state
+
+    def _connect(self):
+        """This process's connection"""
+        if self._db is None or self._pid != os.getpid():
+            self._db = sqlite3.connect(str(self.path), timeout=self.timeout, isolation_level=None,
+                                       check_same_thread=False)
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute('PRAGMA synchronous=NORMAL')
+            self._pid = os.getpid()
+        return self._db
+
+    def _execute(self, sql, params=()):
+        return self._connect().execute(sql, params)
+
+    def submit(self, sessionId, fn, *args, abandonAfter=None, **kwargs):
+        """Queue fn(job, *args, **kwargs) to run in a worker
+            Args:
+                sessionId: The session the job is for (see maxJobsPerSession)
+                abandonAfter: If given, cancel the job once status() has not been called for this many seconds (so
+                              a job is not left running after whatever was waiting for it is gone)
+            Returns:
+                The job's id
+        """
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        call = pickle.dumps((fn, args, kwargs), protocol=pickle.HIGHEST_PROTOCOL)
+        db = self._connect()
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            db.execute(f"DELETE FROM jobs WHERE state IN {FINISHED} AND finished < ?", (now - self.keepFinished,))
+            db.execute('DELETE FROM jobUpdates WHERE jobId NOT IN (SELECT jobId FROM jobs)')
+            num_jobs = db.execute("SELECT COUNT(*) FROM jobs WHERE sessionId = ? AND state IN ('queued', 'running')",
+                                  (str(sessionId),)).fetchone()[0]
+            if num_jobs >= self.maxJobsPerSession:
+                raise TooManyJobs(f"Session {sessionId} already has {num_jobs} jobs waiting or running "
+                                  f"(the most allowed is {self.maxJobsPerSession})")
+            db.execute("INSERT INTO jobs (jobId, sessionId, state, call, submitted, abandonAfter, lastPolled) "
+                       "VALUES (?, ?, 'queued', ?, ?, ?, ?)", (job_id, str(sessionId), call, now, abandonAfter, now))
+            db.execute('COMMIT')
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+        return job_id
+
+    def status(self, jobId):
+        """A dict of the job's state ('queued', 'running', 'done', 'failed' or 'cancelled'), progress (from 0 to 1),
+        error (for a failed job) and, for a queued job, the number of jobs ahead of it"""
+        db = self._connect()
+        db.execute('UPDATE jobs SET lastPolled = ? WHERE jobId = ?', (time.time(), jobId))
+        row = db.execute('SELECT state, progress, error, submitted FROM jobs WHERE jobId = ?', (jobId,)).fetchone()
+        if row is None:
+            raise Exception(f"{self} has no job {jobId}")
+        state, progress, error, submitted = row
+        status = {'state': state, 'progress': progress, 'error': error}
+        if state == 'queued':
+            status['ahead'] = db.execute("SELECT COUNT(*) FROM jobs WHERE state = 'queued' AND submitted < ?",
+                                         (submitted,)).fetchone()[0]
+        return status
+
+    def result(self, jobId, timeout=None):
+        """Wait for a job to finish and return what its function returned
+            Raises an Exception if it failed, was cancelled or is not done after timeout seconds
+        """
+        start = time.monotonic()
+        while True:
+            state = self.status(jobId)['state']
+            if state in FINISHED:
+                break
+            if timeout is not None and time.monotonic() - start > timeout:
+                raise Exception(f"Job {jobId} is still {state} after {timeout} seconds")
+            time.sleep(self.pollEvery)
+        state, result, error = self._execute('SELECT state, result, error FROM jobs WHERE jobId = ?',
+                                             (jobId,)).fetchone()
+        if state == 'failed':
+            raise Exception(f"Job {jobId} failed:\n{error}")
+        if state == 'cancelled':
+            raise JobCancelled(f"Job {jobId} was cancelled")
+        return pickle.loads(result) if result is not None else None
+
+    def updates(self, jobId, since=0):
+        """What a job has published (see Job.publish) after its first since updates
+            Returns:
+                (a list of the updates, the number of updates published so far, to pass as since next time)
+        """
+        rows = self._execute('SELECT seq, data FROM jobUpdates WHERE jobId = ? AND seq >= ? ORDER BY seq',
+                             (jobId, since)).fetchall()
+        return [pickle.loads(data) for _, data in rows], (rows[-1][0] + 1 if rows else since)
+
+    def cancel(self, jobId):
+        """Cancel a job. A queued job never starts. A running job stops the next time it checks (see Job.cancelled)
+            Returns:
+                False if the job had already finished
+        """
+        db = self._connect()
+        queued = db.execute("UPDATE jobs SET state = 'cancelled', finished = ? WHERE jobId = ? AND state = 'queued'",
+                            (time.time(), jobId)).rowcount
+        running = db.execute("UPDATE jobs SET cancelRequested = 1 WHERE jobId = ? AND state = 'running'",
+                             (jobId,)).rowcount
+        return bool(queued or running)
+
+    def cancelSession(self, sessionId, wait=None):
+        """Cancel every job a session has waiting or running (see cancel)
+            Args:
+                wait: If given, wait up to this many seconds for the session's running jobs to stop
+            Returns:
+                True if the session has no jobs waiting or running any more
+        """
+        start = time.monotonic()
+        for job_id, _, state, _ in self.jobs(sessionId):
+            if state not in FINISHED:
+                self.cancel(job_id)
+        while True:
+            if all(state in FINISHED for _, _, state, _ in self.jobs(sessionId)):
+                return True
+            if wait is None or time.monotonic() - start > wait:
+                return False
+            time.sleep(self.pollEvery)
+
+    def jobs(self, sessionId=None):
+        """(jobId, sessionId, state, progress) of every job kept (or just a session's), from the oldest"""
+        if sessionId is None:
+            return self._execute('SELECT jobId, sessionId, state, progress FROM jobs ORDER BY submitted').fetchall()
+        return self._execute('SELECT jobId, sessionId, state, progress FROM jobs WHERE sessionId = ? '
+                             'ORDER BY submitted', (str(sessionId),)).fetchall()
+
+    def _claim(self):
+        """Take the next job (see NEXT_JOB). Returns (jobId, call) or None if there are none waiting"""
+        db = self._connect()
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            row = db.execute(self.NEXT_JOB).fetchone()
+            if row is None:
+                db.execute('COMMIT')
+                return None
+            job_id = row[0]
+            db.execute("UPDATE jobs SET state = 'running', started = ? WHERE jobId = ?", (time.time(), job_id))
+            call = db.execute('SELECT call FROM jobs WHERE jobId = ?', (job_id,)).fetchone()[0]
+            db.execute('COMMIT')
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+        return job_id, call
+
+    def _finish(self, jobId, state, result=None, error=None):
+        self._execute('UPDATE jobs SET state = ?, finished = ?, progress = CASE WHEN ? THEN 1 ELSE progress END, '
+                      'result = ?, error = ? WHERE jobId = ?',
+                      (state, time.time(), state == 'done', result, error, jobId))
+
+    def runNext(self):
+        """Run the next job in this process. Returns False if there was none waiting"""
+        claimed = self._claim()
+        if claimed is None:
+            return False
+        job_id, call = claimed
+        try:
+            fn, args, kwargs = pickle.loads(call)
+            result = fn(Job(self, job_id), *args, **kwargs)
+            self._finish(job_id, 'done', result=pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL))
+        except JobCancelled:
+            self._finish(job_id, 'cancelled')
+        except Exception:
+            logging.exception(f'Job {job_id} failed')
+            self._finish(job_id, 'failed', error=traceback.format_exc())
+        return True
+
+    def _work(self, stop):
+        while not stop.is_set():
+            if not self.runNext():
+                stop.wait(self.pollEvery)
+
+    @property
+    def lockPath(self):
+        """The lock file held by the pool of workers (see start)"""
+        return self.path.with_name(f'{self.path.name}.workers.lock')
+
+    def _lockPool(self, shared=False):
+        """Take the pool's lock without waiting. Returns the open lock file, or None if a pool already has the lock
+            Args:
+                shared: If True, only take it to check that no pool has it (any number of processes can do that at once)
+        """
+        lock_file = open(self.lockPath, 'a')
+        try:
+            if os.name == 'nt':
+                # Windows has no flock. msvcrt only has exclusive locks, so checking takes the lock for a moment
+                # (start() keeps trying for a while, in case something else was only checking)
+                import msvcrt
+                lock_file.seek(0)
+                try:
+                    msvcrt.locking(lock_file.fileno(), msvcrt.LK_NBLCK, 1)
+                except OSError:
+                    raise BlockingIOError(f'{self.lockPath} is locked')
+            else:
+                import fcntl
+                fcntl.flock(lock_file, (fcntl.LOCK_SH if shared else fcntl.LOCK_EX) | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            return None
+        return lock_file
+
+    def workersAlive(self):
+        """True if a pool of workers (in this or any other process) is running for this database"""
+        if self._workers and self._poolPid == os.getpid():
+            return any(worker.is_alive() for worker in self._workers)
+        lock_file = self._lockPool(shared=True)
+        if lock_file is None:
+            return True
+        lock_file.close()
+        return False
+
+    def start(self, lockTimeout=1):
+        """Start the worker processes, unless a pool is already running for this database (see the class's docstring)
+            Jobs left running by workers that are gone (e.g. from before a restart) are queued again first.
+            Args:
+                lockTimeout: How many seconds to keep trying for the lock (which workersAlive() takes for a moment)
+            Returns:
+                True if this started the workers (or already had)
+        """
+        if self._workers:
+            return self._poolPid == os.getpid()
+        start = time.monotonic()
+        while self._poolLock is None:
+            self._poolLock = self._lockPool()
+            if self._poolLock is None:
+                if time.monotonic() - start > lockTimeout:
+                    logging.info(f'{self.path} already has a pool of job workers')
+                    return False
+                time.sleep(0.05)
+        self._execute("UPDATE jobs SET state = 'queued', started = NULL, progress = 0 WHERE state = 'running'")
+        self._execute("DELETE FROM jobUpdates WHERE jobId IN (SELECT jobId FROM jobs WHERE state = 'queued')")
+        self._stop = multiprocessing.Event()
+        self._poolPid = os.getpid()
+        for i in range(self.maxWorkers):
+            worker = multiprocessing.Process(target=self._work, args=(self._stop,), name=f'JobWorker-{i}', daemon=True)
+            worker.start()
+            self._workers.append(worker)
+        logging.info(f'Started {self.maxWorkers} job workers for {self.path}')
+        return True
+
+    def shutdown(self, wait=True):
+        """Stop the worker processes (after the jobs they are running, if wait, otherwise straight away)"""
+        if self._stop is not None:
+            self._stop.set()
+        for worker in self._workers:
+            if wait:
+                worker.join()
+            else:
+                worker.terminate()
+        self._workers = []
+        if self._poolLock is not None:
+            self._poolLock.close()
+            self._poolLock = None
+
+    def serve(self):
+        """Run the pool of workers until interrupted (for running them apart from the web app, see runWorkers)"""
+        if not self.start():
+            raise Exception(f"{self.path} already has a pool of job workers")
+        try:
+            while any(worker.is_alive() for worker in self._workers):
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.shutdown(wait=False)
+
+
+# The job file kept next to a flipJob's checkpoints (see flipJob)
+FLIP_JOB_FILE = 'job.json'
+
+
+def _resumeFlipJob(directory: Path, baseVersion, numFlips):
+    """The flipper, Checkpointer and job file of a flipJob checkpointed to directory, or None if there is none it
+    can carry on (it was for another number of flips, or the session's flipper has been saved since it started)"""
+    job_path = directory.joinpath(FLIP_JOB_FILE)
+    if not job_path.exists():
+        return None
+    run = json.loads(job_path.read_text())
+    if run['baseVersion'] != baseVersion or run['numFlips'] != numFlips:
+        return None
+    try:
+        flipper, checkpointer = Checkpointer.recover(directory, mmap=False)
+    except Exception as e:
+        logging.warning(f'Could not carry on the flipJob in {directory}: {e}')
+        return None
+    return flipper, checkpointer, run
+
+
+def flipJob(job: Job, store: SessionStore, sessionId, numFlips, engine='numpy', historyPoints=2000, includeTopX=True,
+            publishEvery=0.1, checkpointEvery=5):
+    """Flip numFlips coins for a session and save its flipper back to store (a job for JobQueue)
+        A History row is added every historyEvery = numFlips // historyPoints flips (at least every flip, so a run of
+        up to historyPoints flips gets a row after every flip, as the python engine would), by flipping blocks of that
+        many. Progress is reported and cancellation checked after every 100 rows.
+        A cancelled job leaves the session's flipper as it was, but checkpoints the flips it got through to the
+        session's tmpDir (see Checkpointer), as it does every checkpointEvery seconds anyway. The session's next
+        flipJob for the same numFlips carries on from there, as long as the session's flipper has not been saved
+        since (a job queued again after its worker died carries on from its last checkpoint the same way).
+        With a StreamingHistory, the History rows added since the last update are published (as {'historyRows':
+        {column: array}}, see Job.publish) at most every publishEvery seconds, and once more at the end. A job that
+        carries on another one publishes that one's rows again first.
+        Returns:
+            The session's total number of flips
+    """
+    directory = store.tmpDir(sessionId).joinpath('flipJob')
+    base_version = str(store.version(sessionId))
+    resumed = _resumeFlipJob(directory, base_version, numFlips)
+    if resumed:
+        flipper, checkpointer, run = resumed
+        logging.info(f'Carrying on a flipJob for session {sessionId} at {len(flipper.flips) - run["startFlips"]:,} '
+                     f'of {numFlips:,} flips')
+    else:
+        shutil.rmtree(directory, ignore_errors=True)
+        flipper = store.load(sessionId)
+        checkpointer = Checkpointer(directory)
+        run = {'baseVersion': base_version, 'numFlips': numFlips, 'startFlips': len(flipper.flips),
+               'startRows': len(flipper.history)}
+    history = flipper.history
+    streaming = type(history) is StreamingHistory
+    num_published, last_published = run['startRows'], time.monotonic()
+    last_checkpoint = time.monotonic()
+    history_every = max(1, numFlips // historyPoints)
+    chunk_size = 100 * history_every
+
+    def checkpoint():
+        if checkpointer.generation is None:
+            # The first checkpoint. The job file says what it is a checkpoint of
+            directory.mkdir(parents=True, exist_ok=True)
+            storage._writeFile(directory.joinpath(FLIP_JOB_FILE), lambda f: f.write(json.dumps(run).encode()))
+        checkpointer.checkpoint(flipper)
+
+    done = len(flipper.flips) - run['startFlips']
+    try:
+        while done < numFlips:
+            job.checkCancelled()
+            n = min(chunk_size, numFlips - done)
+            flipper.flip(n, logProgress=False, engine=engine, blockSize=history_every, closePlt=False)
+            done += n
+            job.setProgress(done / numFlips)
+            if streaming and len(history) > num_published and \
+                    (done == numFlips or time.monotonic() - last_published >= publishEvery):
+                job.publish({'historyRows': {name: col[num_published:len(history)].copy()
+                                             for name, col in history._columns.items()}})
+                num_published, last_published = len(history), time.monotonic()
+            if done < numFlips and time.monotonic() - last_checkpoint >= checkpointEvery:
+                checkpoint()
+                last_checkpoint = time.monotonic()
+    except JobCancelled:
+        if done:
+            checkpoint()
+        checkpointer.close()
+        raise
+    store.save(sessionId, flipper, includeTopX=includeTopX)
+    checkpointer.close()
+    shutil.rmtree(directory, ignore_errors=True)
+    return len(flipper.flips)
+
+
+def runWorkers(path='flipperCache/jobs.sqlite', maxWorkers=None, verbosity='INFO'):
+    """Run a pool of job workers for the web app in the foreground, e.g. when it is served by a WSGI server (which
+    does not start them)"""
+    logging.getLogger().setLevel(verbosity)
+    JobQueue(path, maxWorkers=maxWorkers).serve()
+
+
+if __name__ == '__main__':
+    Fire(runWorkers)
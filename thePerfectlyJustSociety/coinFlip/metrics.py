@@ -0,0 +1,183 @@
+
+# Third-Party
+import numpy as np
+
+# Custom
+from .population import Population
+from .wealthIndex import WealthIndex
+
+# The metrics inequalityStats returns, in order
+METRICS = ('gini', 'theil', 'palma', 'ratio_90_10')
+
+
+def _sortedMoney(money):
+    """Money sorted from the poorest, along the last axis, as floats
+        Args:
+            money: A Population, an array of money or a (snapshots x people) matrix of money
+    """
+    if isinstance(money, Population):
+        # Populations cache their sort, so this is free if something else has already sorted them
+        return money._sortedByWealth(ascending=True)[1].astype(np.float64)
+    return np.sort(np.asarray(money, dtype=np.float64), axis=-1)
+
+
+def _histogram(money):
+    """(values, counts) of the money if it is (or is a Population that keeps) a WealthIndex, otherwise None"""
+    if isinstance(money, Population):
+        money = money._liveWealthIndex
+    if isinstance(money, WealthIndex):
+        values, counts = money.histogram()
+        return values.astype(np.float64), counts.astype(np.float64)
+    return None
+
+
+def _sumSmallest(sorted_money, k):
+    """The total of the k smallest values along the last axis (k from 0 to n)"""
+    cumulative = np.cumsum(sorted_money, axis=-1)
+    return np.where(k > 0, cumulative[..., max(k, 1) - 1], 0.)
+
+
+def _percentile(sorted_money, q):
+    """The q-th percentile along the last axis, interpolated as np.percentile does by default"""
+    n = sorted_money.shape[-1]
+    pos = (n - 1) * q / 100
+    low = int(np.floor(pos))
+    high = min(low + 1, n - 1)
+    return sorted_money[..., low] + (sorted_money[..., high] - sorted_money[..., low]) * (pos - low)
+
+
+def _histogramRank(values, counts, ranks):
+    """The value at each (0-based) rank of the People described by a histogram"""
+    return values[np.searchsorted(np.cumsum(counts), np.asarray(ranks) + 1)]
+
+
+def _histogramPercentile(values, counts, q):
+    n = int(counts.sum())
+    pos = (n - 1) * q / 100
+    low = int(np.floor(pos))
+    low_value, high_value = _histogramRank(values, counts, [low, min(low + 1, n - 1)])
+    return low_value + (high_value - low_value) * (pos - low)
+
+
+def _histogramSumSmallest(values, counts, k):
+    """The total of the k poorest People described by a histogram"""
+    if k <= 0:
+        return 0.
+    cumulative = np.cumsum(counts)
+    idx = int(np.searchsorted(cumulative, k))
+    below = cumulative[idx - 1] if idx else 0.
+    below_sum = (values[:idx] * counts[:idx]).sum()
+    return below_sum + (k - below) * values[idx]
+
+
+def _gini(sorted_money):
+    n = sorted_money.shape[-1]
+    ranks = np.arange(1, n + 1, dtype=np.float64)
+    return 2 * (sorted_money * ranks).sum(axis=-1) / (n * sorted_money.sum(axis=-1)) - (n + 1) / n
+
+
+def _theil(ratios, weights):
+    """The Theil index from each value's ratio to the mean and its weight (its share of the People)"""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        terms = np.where(ratios > 0, ratios * np.log(np.where(ratios > 0, ratios, 1)), 0.)
+        terms = np.where(ratios < 0, np.nan, terms)
+    return (terms * weights).sum(axis=-1)
+
+
+def _palma(sorted_money):
+    n = sorted_money.shape[-1]
+    top, bottom = round(n * 0.1), round(n * 0.4)
+    top_wealth = sorted_money.sum(axis=-1) - _sumSmallest(sorted_money, n - top)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return top_wealth / _sumSmallest(sorted_money, bottom)
+
+
+def _percentileRatio(sorted_money, high, low):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return _percentile(sorted_money, high) / _percentile(sorted_money, low)
+
+
+def gini(money):
+    """The Gini coefficient (0 when everyone has the same, close to 1 when one person has everything)
+        Args:
+            money: A Population, a WealthIndex, an array of money or a (snapshots x people) matrix of money (which
+                   gives one value per snapshot)
+    """
+    histogram = _histogram(money)
+    if histogram is None:
+        return _gini(_sortedMoney(money))
+    values, counts = histogram
+    n, total = counts.sum(), (values * counts).sum()
+    # The sum of rank x money over the sorted People, where the People with one value share consecutive ranks
+    before = np.cumsum(counts) - counts
+    ranked_sum = (values * (counts * before + counts * (counts + 1) / 2)).sum()
+    return 2 * ranked_sum / (n * total) - (n + 1) / n
+
+
+def lorenzCurve(money, numPoints=None):
+    """The Lorenz curve: the share of the total wealth held by the poorest share of the People
+        Args:
+            money: A Population, an array of money or a (snapshots x people) matrix of money
+            numPoints: The number of evenly spaced population shares to include (every person by default)
+        Returns:
+            (population shares, wealth shares), both starting at 0 and ending at 1. For a matrix, wealth shares has a
+            row for each snapshot
+    """
+    sorted_money = _sortedMoney(money)
+    n = sorted_money.shape[-1]
+    cumulative = np.cumsum(sorted_money, axis=-1)
+    cumulative = np.concatenate([np.zeros(cumulative.shape[:-1] + (1,)), cumulative], axis=-1)
+    ranks = np.arange(n + 1) if numPoints is None else np.round(np.linspace(0, n, numPoints)).astype(np.int64)
+    return ranks / n, cumulative[..., ranks] / cumulative[..., -1:]
+
+
+def theil(money):
+    """The Theil (T) index (0 when everyone has the same, ln(N) when one person has everything)
+        People with $0 add nothing. It is NaN if anyone has less than $0.
+    """
+    histogram = _histogram(money)
+    if histogram is None:
+        money = _sortedMoney(money)
+        return _theil(money / money.mean(axis=-1, keepdims=True), 1 / money.shape[-1])
+    values, counts = histogram
+    return _theil(values / ((values * counts).sum() / counts.sum()), counts / counts.sum())
+
+
+def palma(money):
+    """The Palma ratio: the wealth of the wealthiest 10% over the wealth of the poorest 40%"""
+    histogram = _histogram(money)
+    if histogram is None:
+        return _palma(_sortedMoney(money))
+    values, counts = histogram
+    n = int(counts.sum())
+    top_wealth = (values * counts).sum() - _histogramSumSmallest(values, counts, n - round(n * 0.1))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return top_wealth / _histogramSumSmallest(values, counts, round(n * 0.4))
+
+
+def percentileRatio(money, high=90, low=10):
+    """The ratio of two percentiles of wealth (the 90/10 ratio by default)"""
+    histogram = _histogram(money)
+    if histogram is None:
+        return _percentileRatio(_sortedMoney(money), high, low)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return _histogramPercentile(*histogram, high) / _histogramPercentile(*histogram, low)
+
+
+def inequalityStats(money):
+    """All of the METRICS, with a single sort (or none, for a WealthIndex or a Population that keeps one)
+        Args:
+            money: A Population, a WealthIndex, an array of money or a (snapshots x people) matrix of money
+        Returns:
+            A dict of {metric: value} (or {metric: array of values, one per snapshot}, for a matrix)
+    """
+    if _histogram(money) is not None:
+        return {'gini': gini(money), 'theil': theil(money), 'palma': palma(money),
+                'ratio_90_10': percentileRatio(money, high=90, low=10)}
+    sorted_money = _sortedMoney(money)
+    return {
+        'gini': _gini(sorted_money),
+        'theil': _theil(sorted_money / sorted_money.mean(axis=-1, keepdims=True), 1 / sorted_money.shape[-1]),
+        'palma': _palma(sorted_money),
+        'ratio_90_10': _percentileRatio(sorted_money, high=90, low=10)
+    }
@@ -1,11 +1,20 @@
 
 # Built-In Python
+from pathlib import Path
+import json
+import logging
 import threading
 import time
 
 # Third-Party
 from tqdm import tqdm
 
+# Custom
+from .coinFlip import CoinFlipper
+from .checkpoint import Checkpointer
+from .asyncSaver import AsyncSaver
+from . import storage
+
 
 class StoppableThread(threading.Thread):
     def __init__(self, *args, **kwargs):
@@ -16,7 +25,7 @@ class StoppableThread(threading.Thread):
         self.__stop.set()
 
     def stopped(self):
-        return self.__stop.isSet()
+        return self.__stop.is_set()
 
     def wait(self, pingEvery=0.1):
         while self.is_alive():
@@ -24,18 +33,55 @@ class StoppableThread(threading.Thread):
 
 
 class PollableCoinFlipper(StoppableThread):
+    """Flips coins on a thread of its own, so its progress can be polled while it runs
+
+        stop() is honoured within progressEvery flips: the run stops, saves where it got to (see below) and sets
+        cancelled. resume() carries it on from there, and recover() carries on a run that was stopped or crashed from
+        its last save.
+        Where a run saves to depends on checkpointDir. With it, every save is a checkpoint (see Checkpointer) and
+        flipperPath is only saved at the end. Without it, flipperPath is saved every saveEvery flips. Either way, the
+        total number of flips the run is going for is kept in a job file next to them until the run is done.
+    """
+    JOB_FILE = 'job.json'
+
     def __init__(self, *args, flipper=None, flipperPath=None, numFlips=1, progressEvery=1, saveEvery=1, saveTopX=True,
-                 logProgress=True, callback=None, **kwargs):
+                 logProgress=True, callback=None, checkpointDir=None, compactEvery=100, asyncSave=True,
+                 **kwargs):
+        """
+            Args:
+                checkpointDir: If given, checkpoint to this directory every saveEvery flips instead of saving the whole
+                               flipper to flipperPath (which is only saved at the end). See Checkpointer
+                compactEvery: The number of checkpoints between full snapshots (with checkpointDir)
+                asyncSave: If True, save to flipperPath in the background (see AsyncSaver) while flipping carries on,
+                           instead of pausing for every save
+        """
         super().__init__(*args, **kwargs)
         self.flipper = flipper
         self.flipperPath = flipperPath
+        self.checkpointDir = checkpointDir
+        self.compactEvery = compactEvery
+        self.checkpointer = Checkpointer(checkpointDir, compactEvery=compactEvery) if checkpointDir else None
+        self.asyncSave = asyncSave
         self.numFlips = numFlips
         self.progressEvery = progressEvery
         self.saveEvery = saveEvery
         self.saveTopX = saveTopX
         self.progress = 0
         self.logProgress = logProgress
-        self.callback = None
+        self.callback = callback
+        self.cancelled = False
+        # The total number of flips the flipper will have once the run is done (set when it starts)
+        self.targetFlips = None
+
+    @staticmethod
+    def _jobPath(flipperPath=None, checkpointDir=None):
+        """Where the job file of a run saving to flipperPath or checkpointDir goes"""
+        if checkpointDir:
+            return Path(checkpointDir).joinpath(PollableCoinFlipper.JOB_FILE)
+        if flipperPath:
+            flipper_path = Path(flipperPath)
+            return flipper_path.with_name(f'{flipper_path.name}.{PollableCoinFlipper.JOB_FILE}')
+        return None
 
     def run(self):
         try:
@@ -45,20 +91,97 @@ class PollableCoinFlipper(StoppableThread):
             return f"That's not a number! Please enter a number of coins to flip"
 
         filepath = self.flipperPath
+        self.targetFlips = len(self.flipper.flips) + self.numFlips
+        job_path = self._jobPath(filepath, self.checkpointDir)
+        if job_path:
+            job_path.parent.mkdir(parents=True, exist_ok=True)
+            storage._writeFile(job_path, lambda f: f.write(json.dumps({'targetFlips': self.targetFlips}).encode()))
+        if self.checkpointer:
+            self.checkpointer.compact(self.flipper)
+        saver = AsyncSaver() if self.asyncSave and filepath and not self.checkpointer else None
+        try:
+            self._flip(filepath, saver)
+        finally:
+            if saver is not None:
+                # Every background save is written before the last one
+                saver.close()
+
+        # Save at the end (or where the run stopped, so it can be resumed)
+        if self.checkpointer:
+            self.checkpointer.checkpoint(self.flipper)
+            self.checkpointer.close()
+        if self.cancelled:
+            logging.info(f'Stopped after {self.progress:,} of {self.numFlips:,} flips')
+            if not self.checkpointer and filepath:
+                self.flipper.save(filepath, history=True, includeTopX=self.saveTopX)
+            return
+        if filepath:
+            self.flipper.save(filepath, history=True, includeTopX=self.saveTopX)
+        if job_path:
+            job_path.unlink(missing_ok=True)
+        if self.callback:
+            self.callback()
+
+    def _flip(self, filepath, saver=None):
         for i in tqdm(range(0, self.numFlips, self.progressEvery), desc=f'Flipping {self.numFlips} coins',
                       disable=not self.logProgress):
-            self.flipper.flip(self.progressEvery, logProgress=False)
-            self.progress = i + self.progressEvery
+            if self.stopped():
+                self.cancelled = True
+                return
+            self.flipper.flip(min(self.progressEvery, self.numFlips - i), logProgress=False)
+            self.progress = min(i + self.progressEvery, self.numFlips)
             if i % self.saveEvery == 0:
                 # Save to disk
-                self.flipper.save(filepath, history=True, includeTopX=self.saveTopX)
+                if self.checkpointer:
+                    self.checkpointer.checkpoint(self.flipper)
+                elif saver is not None:
+                    saver.save(self.flipper, filepath, history=True, includeTopX=self.saveTopX)
+                elif filepath:
+                    self.flipper.save(filepath, history=True, includeTopX=self.saveTopX)
 
-        # Save at the end
-        self.flipper.save(filepath, history=True)
-        if self.callback:
-            self.callback()
+    def _carryOn(self, flipper, numFlips, **kwargs):
+        """A new PollableCoinFlipper with this one's settings (threads can only be started once)"""
+        settings = dict(flipperPath=self.flipperPath, progressEvery=self.progressEvery, saveEvery=self.saveEvery,
+                        saveTopX=self.saveTopX, logProgress=self.logProgress, callback=self.callback,
+                        checkpointDir=self.checkpointDir, compactEvery=self.compactEvery, asyncSave=self.asyncSave)
+        settings.update(kwargs)
+        return type(self)(flipper=flipper, numFlips=numFlips, **settings)
+
+    def resume(self, **kwargs):
+        """A new PollableCoinFlipper (not started yet) for the rest of this run's flips, from where it stopped
+            Args:
+                kwargs: Settings to change (see __init__)
+        """
+        if self.is_alive():
+            raise Exception(f"{self} is still running. Call stop() and wait for it first")
+        if self.targetFlips is None:
+            raise Exception(f"{self} has not been started, so there is nothing to resume")
+        return self._carryOn(self.flipper, max(self.targetFlips - len(self.flipper.flips), 0), **kwargs)
+
+    @classmethod
+    def recover(cls, flipperPath=None, checkpointDir=None, **kwargs):
+        """A new PollableCoinFlipper (not started yet) for the rest of a run that was stopped or crashed, from its last
+        save (its last checkpoint in checkpointDir, if it had one, otherwise flipperPath)
+            Args:
+                kwargs: Other settings (see __init__)
+        """
+        job_path = cls._jobPath(flipperPath, checkpointDir)
+        if job_path is None or not job_path.exists():
+            raise Exception(f"There is no unfinished run to recover for {checkpointDir or flipperPath}")
+        target_flips = json.loads(job_path.read_text())['targetFlips']
+        if checkpointDir:
+            flipper, checkpointer = Checkpointer.recover(checkpointDir)
+            checkpointer.close()
+        else:
+            flipper = CoinFlipper.load(flipperPath)
+        logging.info(f'Recovered a run at {len(flipper.flips):,} of {target_flips:,} flips')
+        return cls(flipper=flipper, flipperPath=flipperPath, checkpointDir=checkpointDir,
+                   numFlips=max(target_flips - len(flipper.flips), 0), **kwargs)
 
     def pollProgress(self):
+        if not self.numFlips:
+            # Nothing to flip, so it is as done as it will get
+            return 1.0
         return self.progress / self.numFlips
 
     def pollEvery(self, t, callback, pollAtStart=False):
@@ -1,33 +1,104 @@
 # Built-In Python
 import random
 from collections.abc import Sequence
-import statistics
-import sys
 
 # Third-Party
 import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
-from tqdm import tqdm
+
+# Custom
+from .wealthIndex import WealthIndex
+
+
+# The columns every Population keeps for its People, in order
+COLUMNS = ('idNum', 'startMoney', 'money', 'numWins', 'numLosses')
+# Columns start with the smallest dtype and are promoted along this list when a value does not fit
+DTYPES = (np.int32, np.int64)
+
+
+def _personColumn(name):
+    """A Person property that reads/writes a column of its Population (or its own record, if it has no Population)"""
+    def fget(self):
+        if self._population is None:
+            return self._record[name]
+        return int(self._population._columns[name][self._row])
+
+    def fset(self, value):
+        if self._population is None:
+            self._record[name] = int(value)
+        else:
+            self._population._setValues(name, self._row, value)
+
+    return property(fget, fset)
 
 
 class Person:
+    """A person in a Population
+
+        A Person is a lightweight view into one row of its Population's columns, so reading or changing its money
+        reads or changes the Population. A Person created directly (not through a Population) keeps its own values
+        until it is added to a Population.
+    """
+    __slots__ = ('_population', '_row', '_record')
+
+    idNum = _personColumn('idNum')
+    startMoney = _personColumn('startMoney')
+    money = _personColumn('money')
+    numWins = _personColumn('numWins')
+    numLosses = _personColumn('numLosses')
+
     def __init__(self, idNum, startMoney: int, money: int = None, numWins=0, numLosses=0, population=None):
-        self.idNum = idNum
-        self.startMoney = int(startMoney)
-        self.money = int(money)
-        self.numWins = numWins
-        self.numLosses = numLosses
-        self.population = population
+        self._population = None
+        self._row = None
+        self._record = {
+            'idNum': int(idNum),
+            'startMoney': int(startMoney),
+            'money': int(startMoney if money is None else money),
+            'numWins': int(numWins),
+            'numLosses': int(numLosses)
+        }
+
+    @classmethod
+    def _view(cls, population, row):
+        """A Person that is a view into a row of the columns owned by population"""
+        person = cls.__new__(cls)
+        person._population = population
+        person._row = int(row)
+        person._record = None
+        return person
 
     def __repr__(self):
         return f"<{self.__class__.__name__} {self.idNum:,} | ${self.money:,} | Flips: {self.numFlips:,} " \
                f"({self.numWins:,} - {self.numLosses:,})>"
 
+    def __eq__(self, other):
+        if not isinstance(other, Person):
+            return NotImplemented
+        if self._population is None or other._population is None:
+            return self is other
+        return self._population is other._population and self._row == other._row
+
+    def __hash__(self):
+        return id(self) if self._population is None else hash((id(self._population), self._row))
+
+    def _bind(self, population, row):
+        """Move this Person's values into a row of population's columns"""
+        self._population = population
+        self._row = int(row)
+        self._record = None
+
+    @property
+    def population(self):
+        return self._population
+
+    @property
+    def row(self):
+        """This Person's row in its Population's columns"""
+        return self._row
+
     def toDict(self):
-        exclude = 'population'
-        d = self.__dict__.copy()
-        return {k: v for k, v in d.items() if k not in exclude}
+        return {name: getattr(self, name) for name in COLUMNS}
 
     @property
     def numFlips(self):
@@ -38,43 +109,230 @@ class Person:
 
 
 class Population(Sequence):
+    """A group of People
+
+        The People's values are stored column-wise in NumPy arrays (see COLUMNS), and People are only created (as
+        views into a row) when they are accessed individually.
+        A SubPopulation (one with a parent, e.g. from getWealthiest) does not copy any values. It keeps the rows it
+        covers and reads them from the Population that owns the columns.
+    """
     def __init__(self, people=None, parent=None):
-        self.people = people or []
         self._parent = parent
         self._iterator = None
         self._currentPlotAx = None
 
+        # The Population that owns the columns and, for a SubPopulation, which of its rows this one covers
+        self._owner = self
+        self._rows = None
+        self._columns = {name: np.empty(0, dtype=DTYPES[0]) for name in COLUMNS}
+        self._size = 0
+        # Bumped every time the owner's columns change, so cached results know when they are stale
+        self._version = 0
+        # {ascending: (version, order, sorted money)}
+        self._sortCache = {}
+        # Kept up to date with every change to money, once something asks for it (see wealthIndex)
+        self._wealthIndex = None
+
+        people = list(people or [])
+        owners = {id(p._population) for p in people}
+        if people and len(owners) == 1 and people[0]._population is not None:
+            # Views into a single Population, so just keep their rows
+            self._owner = people[0]._population
+            self._rows = np.array([p._row for p in people], dtype=np.int64)
+        elif people:
+            self._append({name: [getattr(p, name) for p in people] for name in COLUMNS})
+            for row, person in enumerate(people):
+                if person._population is None:
+                    person._bind(self, row)
+
+    @classmethod
+    def _fromColumns(cls, columns, parent=None):
+        """A new Population that owns a copy of the given columns"""
+        pop = cls(parent=parent)
+        pop._append(columns)
+        return pop
+
+    @classmethod
+    def _wrapColumns(cls, columns):
+        """A new Population that uses the given columns (arrays of the same length) as they are, without copying"""
+        pop = cls()
+        pop._columns = {name: columns[name] for name in COLUMNS}
+        pop._size = len(pop._columns[COLUMNS[0]])
+        return pop
+
+    def _subPopulation(self, rows, parent=None):
+        """A SubPopulation covering some of this Population's rows (positions in self, not in the owner)"""
+        rows = np.asarray(rows, dtype=np.int64)
+        pop = self.__class__(parent=parent)
+        pop._owner = self._owner
+        pop._rows = rows if self._rows is None else self._rows[rows]
+        return pop
+
     def __repr__(self):
-        return f"<{self.__class__.__name__} Num: {len(self.people)}>"
+        return f"<{self.__class__.__name__} Num: {len(self)}>"
 
     def __len__(self):
-        return len(self.people)
+        return self._size if self._rows is None else len(self._rows)
 
     def __iter__(self):
-        return iter(self.people)
+        rows = range(self._size) if self._rows is None else self._rows.tolist()
+        return (Person._view(self._owner, row) for row in rows)
 
     def __getitem__(self, item):
-        return self.people[item]
+        if isinstance(item, slice):
+            return [self[i] for i in range(*item.indices(len(self)))]
+        item = int(item)
+        if item < 0:
+            item += len(self)
+        if not 0 <= item < len(self):
+            raise IndexError(f"{self} has no Person at index {item}")
+        return Person._view(self._owner, item if self._rows is None else self._rows[item])
 
     def __getstate__(self):
         state = self.__dict__.copy()
         state['_iterator'] = None
+        state['_sortCache'] = {}
+        state['_wealthIndex'] = None
+        if self._rows is None:
+            # Don't pickle the spare capacity
+            state['_columns'] = {name: col[:self._size].copy() for name, col in self._columns.items()}
         return state
 
     def __setstate__(self, d):
-        self.__dict__ = d
+        self.__dict__ = {'_wealthIndex': None, **d}
+
+    @property
+    def people(self):
+        return list(self)
+
+    @property
+    def version(self):
+        """A counter that goes up every time any People's values change or People are added"""
+        return self._owner._version
+
+    def getColumn(self, name, copy=True):
+        """One of the People's columns (see COLUMNS) as a NumPy array
+            Args:
+                copy: If False, return a read-only view of the column instead of a copy. A view costs nothing, but it
+                      sees later changes to the People, and is left behind if People are added (the columns grow into
+                      new arrays). A SubPopulation's rows are not contiguous, so it always returns a copy
+        """
+        column = self._owner._columns[name]
+        if self._rows is not None:
+            return column[self._rows]
+        if copy:
+            return column[:self._size].copy()
+        view = column[:self._size]
+        view.flags.writeable = False
+        return view
+
+    def setColumn(self, name, values, rows=None):
+        """Set one of the People's columns (see COLUMNS) for all People, or just some rows"""
+        rows = np.arange(len(self)) if rows is None else np.asarray(rows, dtype=np.int64)
+        self._owner._setValues(name, rows if self._rows is None else self._rows[rows], values)
+
+    def _setValues(self, name, rows, values):
+        """Set values of a column this Population owns, promoting the column's dtype if they do not fit"""
+        values = np.asarray(values)
+        if values.size:
+            self._fit(name, values.min(), values.max())
+        if name == 'money' and self._wealthIndex is not None:
+            old = self._columns[name][rows]
+            self._columns[name][rows] = values
+            try:
+                self._wealthIndex.update(old, self._columns[name][rows])
+            except OverflowError:
+                # The money no longer fits in an index. Sort instead
+                self._wealthIndex = None
+        else:
+            self._columns[name][rows] = values
+        self._version += 1
+
+    def _fit(self, name, low, high):
+        """Make sure a column's dtype can hold values from low to high"""
+        column = self._columns[name]
+        if np.iinfo(column.dtype).min <= low and high <= np.iinfo(column.dtype).max:
+            return
+        for dtype in DTYPES:
+            if np.iinfo(dtype).min <= low and high <= np.iinfo(dtype).max:
+                self._columns[name] = column.astype(dtype)
+                return
+        raise OverflowError(f"{name} values from {low:,} to {high:,} do not fit in any of {DTYPES}")
+
+    def _append(self, columns):
+        """Append rows to the columns this Population owns
+            Args:
+                columns: A dict of {column name: values} with a value (or a single value for all rows) for each column
+        """
+        if self._rows is not None:
+            raise Exception(f"Can not add People to {self}. It is a SubPopulation.")
+        n = max((np.size(values) for values in columns.values()), default=0)
+        if not n:
+            return
+        new_size = self._size + n
+        for name in COLUMNS:
+            values = np.broadcast_to(np.asarray(columns[name]), (n,))
+            self._fit(name, values.min(), values.max())
+            column = self._columns[name]
+            if len(column) < new_size:
+                # Grow geometrically, so adding one Person at a time is cheap
+                grown = np.empty(max(new_size, 2 * len(column)), dtype=column.dtype)
+                grown[:self._size] = column[:self._size]
+                self._columns[name] = column = grown
+            column[self._size:new_size] = values
+        if self._wealthIndex is not None:
+            try:
+                self._wealthIndex.add(self._columns['money'][self._size:new_size])
+            except OverflowError:
+                self._wealthIndex = None
+        self._size = new_size
+        self._version += 1
+
+    @classmethod
+    def full(cls, n, startMoney):
+        """A new Population of n People who all start with startMoney"""
+        return cls().add(n, startMoney)
+
+    @classmethod
+    def fromArrays(cls, startMoney, money=None, numWins=0, numLosses=0, idNum=None):
+        """A new Population with a Person for each value of startMoney, allocated in one go
+            Args:
+                startMoney: An array with each Person's starting money
+                money: Each Person's current money (startMoney by default)
+                numWins, numLosses: Each Person's number of wins and losses (an array or a single value for everyone)
+                idNum: Each Person's id (0 to N-1 by default)
+        """
+        start_money = np.asarray(startMoney)
+        n = len(start_money)
+        columns = {
+            'idNum': np.arange(n) if idNum is None else idNum,
+            'startMoney': start_money,
+            'money': start_money if money is None else money,
+            'numWins': numWins,
+            'numLosses': numLosses
+        }
+        for name, values in columns.items():
+            if np.ndim(values) and len(values) != n:
+                raise Exception(f"{name} has {len(values):,} values, but startMoney has {n:,}")
+        return cls._fromColumns(columns)
 
     @classmethod
     def fromDf(cls, df):
-        people = [Person(**row) for i, row in df.iterrows()]
-        return cls(people)
+        """A new Population from a DataFrame with a row per Person (like the ones toDf makes)"""
+        return cls.fromArrays(**{name: df[name].to_numpy() for name in COLUMNS if name in df.columns})
 
-    def getMoneyStamp(self):
-        return [p.money for p in self.people]
+    def getMoneyStamp(self, copy=True):
+        """Each Person's money (a read-only view with copy=False, see getColumn)"""
+        return self.getColumn('money', copy=copy)
 
-    def toDf(self, sortBy=None):
-        people = [p.toDict() for p in self.people]
-        df = pd.DataFrame(people)
+    def toDf(self, sortBy=None, copy=True):
+        """A DataFrame with a row per Person and a column for each of COLUMNS
+            Args:
+                sortBy: A column to sort by (from the largest), adding a rank_by_<sortBy> column
+                copy: If False (and not sorting), the DataFrame's columns are read-only views of this Population's
+                      columns (see getColumn)
+        """
+        df = pd.DataFrame({name: self.getColumn(name, copy=copy) for name in COLUMNS}, copy=False)
         if sortBy:
             df = df.sort_values(by=sortBy, ascending=False).reset_index(drop=True)
             df[f'rank_by_{sortBy}'] = range(1, len(df) + 1)
@@ -103,13 +361,37 @@ class Population(Sequence):
         else:
             return default
 
+    @property
+    def wealthIndex(self):
+        """A WealthIndex of the People's money (for order statistics in O(log N))
+            The first time this is used on a Population, the Population starts keeping the index up to date with every
+            change to money. A SubPopulation gets a new index of its current money, which is not kept up to date.
+            None if the money is spread over too wide a range for an index (see WealthIndex.maxRange), in which case
+            the stats have to be computed with a sort.
+        """
+        try:
+            if self._rows is not None:
+                return WealthIndex(self.getColumn('money', copy=False))
+            if self._wealthIndex is None:
+                self._wealthIndex = WealthIndex(self.getColumn('money', copy=False))
+        except OverflowError:
+            return None
+        return self._wealthIndex
+
+    @property
+    def _liveWealthIndex(self):
+        """The WealthIndex this Population is keeping up to date, if any"""
+        return self._wealthIndex if self._rows is None and len(self) else None
+
     @property
     def moneyPerPerson(self):
-        return [p.money for p in self.people]
+        return self.getColumn('money')
 
     @property
     def totalMoney(self):
-        return sum(self.moneyPerPerson)
+        if self._liveWealthIndex is not None:
+            return self._wealthIndex.total
+        return int(self.getColumn('money', copy=False).sum(dtype=np.int64))
 
     @property
     def percentPopulationOfParent(self):
@@ -121,31 +403,62 @@ class Population(Sequence):
 
     @property
     def meanWealth(self):
-        return statistics.mean(self.moneyPerPerson)
+        if self._liveWealthIndex is not None:
+            return float(self._wealthIndex.mean)
+        return float(self.getColumn('money', copy=False).mean())
 
     @property
     def medianWealth(self):
-        return statistics.median(self.moneyPerPerson)
+        if self._liveWealthIndex is not None:
+            return float(self._wealthIndex.median)
+        return float(np.median(self.getColumn('money', copy=False)))
 
     @property
     def minWealth(self):
-        return min(self.moneyPerPerson)
+        if self._liveWealthIndex is not None:
+            return int(self._wealthIndex.min)
+        return int(self.getColumn('money', copy=False).min())
 
     @property
     def maxWealth(self):
-        return max(self.moneyPerPerson)
+        if self._liveWealthIndex is not None:
+            return int(self._wealthIndex.max)
+        return int(self.getColumn('money', copy=False).max())
 
     def add(self, n, startMoney):
-        self.people.extend([Person(i, startMoney, startMoney, population=self)
-                            for i in tqdm(range(n), desc='Adding people to population')])
+        """Add n People, who start with startMoney (a single value for everyone, or an array with a value for each)"""
+        start = len(self)
+        start_money = np.asarray(startMoney)
+        if start_money.ndim and len(start_money) != n:
+            raise Exception(f"Got {len(start_money):,} values of startMoney for {n:,} People")
+        self._append({'idNum': np.arange(start, start + n), 'startMoney': start_money, 'money': start_money,
+                      'numWins': 0, 'numLosses': 0})
         return self
 
     def addOne(self, startMoney):
-        i = len(self)
-        self.people.append(Person(i, startMoney, startMoney, population=self))
+        self.add(1, startMoney)
+
+    def _sortedByWealth(self, ascending=False):
+        """The positions of the People sorted by wealth (ties keep their order, like sorted()) and their sorted money
+            The sort is cached until the Population's version changes, so repeated queries between flips are free.
+            Both arrays are read-only.
+        """
+        cached = self._sortCache.get(ascending)
+        if cached and cached[0] == self.version:
+            return cached[1], cached[2]
+        money = self.getColumn('money', copy=False).astype(np.int64)
+        order = np.argsort(money if ascending else -money, kind='stable')
+        sorted_money = money[order]
+        order.flags.writeable = sorted_money.flags.writeable = False
+        self._sortCache[ascending] = (self.version, order, sorted_money)
+        return order, sorted_money
+
+    def _wealthOrder(self, ascending=False):
+        """The positions of the People, sorted by wealth (see _sortedByWealth)"""
+        return self._sortedByWealth(ascending=ascending)[0]
 
     def sortedByWealth(self, ascending=False):
-        return Population(sorted(self.people, key=lambda x: x.money, reverse=not ascending))
+        return self._subPopulation(self._wealthOrder(ascending=ascending))
 
     def getWealthiest(self, n, least=False):
         """Get the people in the population with the most (or least) money
@@ -153,25 +466,28 @@ class Population(Sequence):
                 n: The number of people to get
                 least: If True, get the least wealthy instead of the most wealthy
         """
-        sorted_by_wealth = self.sortedByWealth(ascending=least)
         if n <= len(self):
-            top = sorted_by_wealth[:] if n == len(self) else sorted_by_wealth[:n]
-            return Population(top, parent=self)
+            return self._subPopulation(self._wealthOrder(ascending=least)[:n], parent=self)
         else:
             raise Exception(f"Can not get {n} wealthiest from {self}. It only has {len(self)} people")
 
     def getWealthiestXPercent(self, topX, least=False):
-        pop = self.sortedByWealth(ascending=least)
-        num_people_in_top_x = round(len(pop) * (topX / 100))
+        num_people_in_top_x = round(len(self) * (topX / 100))
         return self.getWealthiest(num_people_in_top_x)
 
     def getWealthRangeByPercent(self, lowPercent, highPercent):
-        pop = self.sortedByWealth(ascending=False)
-        this_range = pop[round(len(pop) * highPercent / 100): round(len(pop) * lowPercent / 100)]
-        return Population(this_range, parent=self)
+        order = self._wealthOrder(ascending=False)
+        this_range = order[round(len(self) * highPercent / 100): round(len(self) * lowPercent / 100)]
+        return self._subPopulation(this_range, parent=self)
 
-    def pickRandoms(self, numRandoms):
-        return random.sample(self.people, numRandoms)
+    def pickRandoms(self, numRandoms, rng=None):
+        """numRandoms different People, picked uniformly at random
+            Args:
+                rng: A np.random.Generator to pick them with (the built-in random module if None)
+        """
+        rows = random.sample(range(len(self)), numRandoms) if rng is None \
+            else rng.choice(len(self), numRandoms, replace=False).tolist()
+        return [self[i] for i in rows]
 
     def statsDict(self, **kwargs):
         return {
@@ -186,19 +502,65 @@ class Population(Sequence):
         }
 
     def getStatsByTopX(self, percentages=None):
+        """statsDict() for the wealthiest X percent of the population, for each X in percentages"""
         top_x_percentages = percentages or [1, 2, 3, 5, 10, 25, 50, 75, 90, 99, 100]
-        stats = [self.getWealthiestXPercent(x).statsDict(top_x=x) for x in top_x_percentages]
-        return pd.DataFrame(stats)
+        ends = [round(len(self) * (x / 100)) for x in top_x_percentages]
+        return self._statsByWealthRanges(starts=[0] * len(ends), ends=ends, top_x=list(top_x_percentages))
 
     def getStatsByTopXRanges(self, percentages=None):
-        top_x_percentages = percentages or range(101)
-        stats = [self.getWealthRangeByPercent(lowPercent=top_x_percentages[i + 1], highPercent=p)
-                     .statsDict(top_x_percent_low=int(top_x_percentages[i + 1]), top_x_percent_high=int(p))
-                 for i, p in enumerate(top_x_percentages[:-1])]
-        return pd.DataFrame(stats)
+        """statsDict() for each range of the population between two consecutive percentages (sorted by wealth)"""
+        top_x_percentages = list(percentages or range(101))
+        return self._statsByWealthRanges(
+            starts=[round(len(self) * p / 100) for p in top_x_percentages[:-1]],
+            ends=[round(len(self) * p / 100) for p in top_x_percentages[1:]],
+            top_x_percent_low=[int(p) for p in top_x_percentages[1:]],
+            top_x_percent_high=[int(p) for p in top_x_percentages[:-1]]
+        )
+
+    def _statsByWealthRanges(self, starts, ends, **kwargs):
+        """statsDict() for ranges of the population sorted by wealth (most to least), all from a single sort
+            Args:
+                starts: The first position of each range
+                ends: The position after the last position of each range
+                kwargs: Extra columns to add to the DataFrame
+        """
+        sorted_money = self._sortedByWealth(ascending=False)[1]
+        starts, ends = np.asarray(starts, dtype=np.int64), np.asarray(ends, dtype=np.int64)
+        counts = ends - starts
+        empty = counts <= 0
+        cumulative = np.concatenate([[0], np.cumsum(sorted_money)])
+        total_money = cumulative[-1]
+        totals = cumulative[ends] - cumulative[starts]
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            means = totals / counts
+            # Positions clipped into range, so empty ranges can still be indexed (they are set to NaN below)
+            first = np.clip(starts, 0, max(len(self) - 1, 0))
+            last = np.clip(ends - 1, 0, max(len(self) - 1, 0))
+            mid_low = np.clip(starts + (counts - 1) // 2, 0, max(len(self) - 1, 0))
+            mid_high = np.clip(starts + counts // 2, 0, max(len(self) - 1, 0))
+            if len(self):
+                maxes, mins = sorted_money[first], sorted_money[last]
+                medians = (sorted_money[mid_low] + sorted_money[mid_high]) / 2
+            else:
+                maxes = mins = medians = np.zeros(len(starts))
+
+            stats = {
+                'total': totals,
+                'mean': means,
+                'median': medians,
+                'min': mins,
+                'max': maxes,
+                'percent_population': counts / len(self) * 100,
+                'percent_wealth': totals / total_money * 100,
+            }
+        if empty.any():
+            for key in ('mean', 'median', 'min', 'max'):
+                stats[key] = np.where(empty, np.nan, stats[key])
+        return pd.DataFrame({**stats, **kwargs})
 
     def getPeopleWithMoreThan(self, val):
-        return Population([i for i in self if i.money > val], parent=self)
+        return self._subPopulation(np.flatnonzero(self.getColumn('money', copy=False) > val), parent=self)
 
     def plot(self, t=0, title='', kind='distribution', keepAx=False):
         if self._currentPlotAx:
@@ -0,0 +1,118 @@
+
+# Built-In Python
+from pathlib import Path
+import logging
+import os
+import shutil
+
+# Custom
+from . import storage
+
+# What makes two flipCoins runs the same run
+KEY_FIELDS = ('numFlips', 'numPeople', 'startMoney', 'dollarsPerFlip', 'allowDebt', 'seed', 'engine')
+
+
+class ResultCache:
+    """flipCoins runs kept on disk, so running the same run again costs nothing
+
+        There is one entry for each key (see KEY_FIELDS), saved in the columnar format of storage.py. Entries are
+        evicted from the least recently used once they take up more than maxBytes between them.
+        Only a run for exactly as many flips is reused. Cutting a longer run short would not leave its random generator
+        where a run for fewer flips would have, and carrying on a shorter one is not flip for flip the run a single call
+        would make (the numpy engine's blocks fall in different places and, once anyone has gone broke, the
+        SolventIndex rebuilt on loading orders the solvent People differently). So what the cache returns never
+        depends on what else is in it.
+        Runs without a seed are never cached, since every one of them is different.
+        Each entry's manifest records whether its run kept a History (see put), since a run that did not still has the
+        row every flipper starts with.
+    """
+    SUFFIX = '.flipper'
+
+    def __init__(self, directory='flipperCache/cli', maxBytes=2 * 1024 ** 3):
+        self.directory = Path(directory)
+        self.maxBytes = int(maxBytes)
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__} {self.directory} | Entries: {len(self.entries())}>"
+
+    def entryPath(self, numFlips, numPeople, startMoney, dollarsPerFlip, allowDebt, seed, engine):
+        return self.directory.joinpath(f'flips_{numFlips}_people_{numPeople}_start_{startMoney}_bet_{dollarsPerFlip}_'
+                                       f'debt_{allowDebt}_seed_{seed}_engine_{engine}{self.SUFFIX}')
+
+    def entries(self):
+        """The saved entries, from the least recently used"""
+        paths = [path for path in self.directory.glob(f'*{self.SUFFIX}') if storage.isSaved(path)]
+        return sorted(paths, key=lambda path: path.joinpath(storage.MANIFEST_FILE).stat().st_mtime)
+
+    @staticmethod
+    def _touch(path):
+        os.utime(path.joinpath(storage.MANIFEST_FILE))
+
+    @staticmethod
+    def entrySize(path):
+        return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+
+    def get(self, key, flipperClass, history=True):
+        """The cached run for key (a dict of KEY_FIELDS)
+            Args:
+                flipperClass: The class of flipper to load (see storage.loadFlipper)
+                history: If True, only use an entry that kept a History
+            Returns:
+                A flipper with key['numFlips'] flips, or None if there is nothing usable (always, without a seed)
+        """
+        if key['seed'] is None:
+            return None
+        path = self.entryPath(**key)
+        if not storage.isSaved(path):
+            return None
+        try:
+            if history and not self.keptHistory(path):
+                return None
+            flipper = storage.loadFlipper(path, flipperClass)
+        except Exception as e:
+            logging.warning(f'Ignoring the cached run in {path}, which could not be loaded: {e!r}')
+            return None
+        if len(flipper.flips) != key['numFlips']:
+            logging.warning(f'Ignoring the cached run in {path}, which has {len(flipper.flips):,} flips')
+            return None
+        self._touch(path)
+        logging.info(f'Using the cached run in {path}')
+        return flipper
+
+    @staticmethod
+    def keptHistory(path):
+        """True if the run saved in path kept a History (older entries, which do not say, are assumed not to have)"""
+        if not storage.isSaved(path):
+            return False
+        return storage.readManifest(path).get('extra', {}).get('keptHistory', False)
+
+    def put(self, key, flipper, history=True):
+        """Keep flipper as the entry for key (a dict of KEY_FIELDS), unless the entry already kept a History and this
+        run did not. Runs without a seed are not kept
+            Args:
+                history: True if the run kept a History (added a row after every flip, or block of flips)
+        """
+        if key['seed'] is None:
+            return
+        if len(flipper.flips) != key['numFlips']:
+            raise Exception(f"{flipper} has {len(flipper.flips):,} flips, not the {key['numFlips']:,} of its key")
+        path = self.entryPath(**key)
+        if self.keptHistory(path) and not history:
+            self._touch(path)
+            return
+        path.mkdir(parents=True, exist_ok=True)
+        storage.saveFlipper(flipper, path, extra={'keptHistory': bool(history)})
+        self.evict(keep=path)
+
+    def evict(self, keep=None):
+        """Delete the least recently used entries (other than keep) until the rest fit in maxBytes"""
+        entries = [(path, self.entrySize(path)) for path in self.entries()]
+        total = sum(size for _, size in entries)
+        for path, size in entries:
+            if total <= self.maxBytes:
+                break
+            if keep is not None and path == Path(keep):
+                continue
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+            logging.info(f'Evicted {path} from {self} ({size:,} bytes)')
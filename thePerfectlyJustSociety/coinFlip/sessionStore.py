@@ -0,0 +1,368 @@
+
+# Built-In Python
+from abc import ABC, abstractmethod
+from pathlib import Path
+import io
+import json
+import logging
+import pickle
+import shutil
+import sqlite3
+import threading
+import time
+
+# Third-Party
+import numpy as np
+
+# Custom
+from .coinFlip import CoinFlipper
+from .population import Population, COLUMNS
+from .flips import Flips
+from .history import StreamingHistory
+from . import storage
+
+
+class SessionStore(ABC):
+    """Where the web app keeps each session's flipper (see FlipperManager)
+
+        A session is identified by a sessionId. version() changes whenever a session's flipper is saved, so a loaded
+        flipper can be kept in memory for as long as its version is current (see FlipperCache).
+        Subclasses must implement every abstract method.
+    """
+    @abstractmethod
+    def exists(self, sessionId):
+        """True if the session has a saved flipper"""
+
+    @abstractmethod
+    def version(self, sessionId):
+        """Something that changes whenever the session's flipper is saved"""
+
+    @abstractmethod
+    def load(self, sessionId):
+        """The session's flipper"""
+
+    @abstractmethod
+    def save(self, sessionId, flipper, includeTopX=True):
+        """Save the session's flipper (with its History's stats). Returns its new version"""
+
+    @abstractmethod
+    def delete(self, sessionId):
+        """Delete the session's flipper"""
+
+    @abstractmethod
+    def evict(self, keep=None):
+        """Delete the sessions that have expired or do not fit in the quota (apart from keep)"""
+
+    def tmpDir(self, sessionId):
+        """A directory for the session's temporary files (e.g. saves made while flipping)"""
+        return Path('flipperCache/sessions').joinpath(str(sessionId), 'tmp')
+
+
+class FileSessionStore(SessionStore):
+    """A directory per session, holding the session's flipper saved in the columnar format of storage.py
+
+        Only one process should write to a session at a time (there is no locking).
+    """
+    FILENAME = 'currentFlipper.flipper'
+
+    def __init__(self, directory='flipperCache/sessions', ttl=7 * 24 * 60 * 60):
+        self.directory = Path(directory)
+        self.ttl = ttl
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__} {self.directory}>"
+
+    def getFilepath(self, sessionId):
+        return self.directory.joinpath(str(sessionId), self.FILENAME)
+
+    def tmpDir(self, sessionId):
+        return self.directory.joinpath(str(sessionId), 'tmp')
+
+    def exists(self, sessionId):
+        return self.getFilepath(sessionId).exists()
+
+    def version(self, sessionId):
+        # Every save replaces the manifest
+        stat = self.getFilepath(sessionId).joinpath(storage.MANIFEST_FILE).stat()
+        return stat.st_mtime_ns, stat.st_size
+
+    def load(self, sessionId):
+        return CoinFlipper.load(self.getFilepath(sessionId))
+
+    def save(self, sessionId, flipper, includeTopX=True):
+        flipper.save(self.getFilepath(sessionId), history=True, includeTopX=includeTopX)
+        return self.version(sessionId)
+
+    def delete(self, sessionId):
+        shutil.rmtree(self.getFilepath(sessionId).parent, ignore_errors=True)
+
+    def evict(self, keep=None):
+        if not self.ttl:
+            return
+        for path in self.directory.glob(f'*/{self.FILENAME}'):
+            manifest_path = path.joinpath(storage.MANIFEST_FILE)
+            if path.parent.name != str(keep) and manifest_path.exists() and \
+                    manifest_path.stat().st_mtime < time.time() - self.ttl:
+                logging.info(f'Evicting the expired session in {path.parent}')
+                shutil.rmtree(path.parent, ignore_errors=True)
+
+
+class SqliteSessionStore(SessionStore):
+    """Sessions in a local SQLite database, which every worker process (and thread) can share
+
+        Each session has a row of parameters (the flipper's, its flip log's and its History's, as json), its columns
+        (the Population's and the flip log's, as .npy blobs) and, for a StreamingHistory, a row per History row (so a
+        save only inserts the rows added since the last one). Any other kind of History is pickled.
+        Every save is one transaction that also bumps the session's version. The database is in WAL mode, so loads
+        are not blocked by a save in another worker, and saves wait (up to timeout seconds) for each other.
+        Sessions not used for ttl seconds are evicted, as are the least recently used ones once the sessions take up
+        more than maxBytes.
+    """
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS sessions (
+            sessionId TEXT PRIMARY KEY,
+            params TEXT NOT NULL,
+            version INTEGER NOT NULL,
+            created REAL NOT NULL,
+            accessed REAL NOT NULL,
+            numBytes INTEGER NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS sessionsByAccessed ON sessions (accessed);
+        CREATE TABLE IF NOT EXISTS arrays (
+            sessionId TEXT NOT NULL REFERENCES sessions (sessionId) ON DELETE CASCADE,
+            part TEXT NOT NULL,
+            name TEXT NOT NULL,
+            data BLOB NOT NULL,
+            PRIMARY KEY (sessionId, part, name)
+        );
+        CREATE TABLE IF NOT EXISTS historyRows (
+            sessionId TEXT NOT NULL REFERENCES sessions (sessionId) ON DELETE CASCADE,
+            rowNum INTEGER NOT NULL,
+            data BLOB NOT NULL,
+            PRIMARY KEY (sessionId, rowNum)
+        );
+    """
+    # How stale a session's accessed time can get before reading it updates it (so reads are not all writes)
+    TOUCH_EVERY = 60
+
+    def __init__(self, path='flipperCache/sessions.sqlite', ttl=7 * 24 * 60 * 60, maxBytes=10 * 1024 ** 3,
+                 timeout=30, tmpDirectory='flipperCache/sessions'):
+        """
+            Args:
+                path: The database file (created if it does not exist)
+                ttl: Evict sessions not used for this many seconds (None to never expire them)
+                maxBytes: Evict the least recently used sessions once they take up more than this (None for no quota)
+                timeout: How many seconds to wait for another worker's save to finish
+                tmpDirectory: Where each session's temporary files go (see tmpDir)
+        """
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.ttl = ttl
+        self.maxBytes = maxBytes
+        self.timeout = timeout
+        self.tmpDirectory = Path(tmpDirectory)
+        self._local = threading.local()
+        self._db.executescript(self.SCHEMA)
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__} {self.path}>"
+
+    def __getstate__(self):
+        # Connections stay with the thread that made them, so a store can be sent to another process (see jobs.py)
+        state = self.__dict__.copy()
+        del state['_local']
+        return state
+
+    def __setstate__(self, d):
+        self.__dict__ = d
+        self._local = threading.local()
+
+    @property
+    def _db(self):
+        """This thread's connection (sqlite3 connections can not be shared between threads)"""
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(str(self.path), timeout=self.timeout, isolation_level=None)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            db.execute('PRAGMA foreign_keys=ON')
+            self._local.db = db
+        return db
+
+    def _transaction(self, immediate=False):
+        return _Transaction(self._db, immediate=immediate)
+
+    def tmpDir(self, sessionId):
+        return self.tmpDirectory.joinpath(str(sessionId), 'tmp')
+
+    @staticmethod
+    def _toBlob(values):
+        buffer = io.BytesIO()
+        np.save(buffer, np.ascontiguousarray(values), allow_pickle=False)
+        return buffer.getvalue()
+
+    @staticmethod
+    def _fromBlob(blob):
+        return np.load(io.BytesIO(blob), allow_pickle=False)
+
+    def exists(self, sessionId):
+        return self._db.execute('SELECT 1 FROM sessions WHERE sessionId = ?', (str(sessionId),)).fetchone() is not None
+
+    def version(self, sessionId):
+        session_id, now = str(sessionId), time.time()
+        row = self._db.execute('SELECT version, accessed FROM sessions WHERE sessionId = ?', (session_id,)).fetchone()
+        if row is None:
+            raise Exception(f"{self} has no session {sessionId}")
+        if row[1] < now - self.TOUCH_EVERY:
+            self._db.execute('UPDATE sessions SET accessed = ? WHERE sessionId = ?', (now, session_id))
+        return row[0]
+
+    def sessions(self):
+        """Every session's (sessionId, version, created, accessed, numBytes), from the least recently used"""
+        return self._db.execute('SELECT sessionId, version, created, accessed, numBytes FROM sessions '
+                                'ORDER BY accessed').fetchall()
+
+    def load(self, sessionId):
+        session_id = str(sessionId)
+        # One transaction, so every part comes from the same save
+        with self._transaction() as db:
+            row = db.execute('SELECT params FROM sessions WHERE sessionId = ?', (session_id,)).fetchone()
+            if row is None:
+                raise Exception(f"{self} has no session {sessionId}")
+            params = json.loads(row[0])
+            blobs = {(part, name): data for part, name, data in
+                     db.execute('SELECT part, name, data FROM arrays WHERE sessionId = ?', (session_id,))}
+            history_rows = [data for data, in db.execute('SELECT data FROM historyRows WHERE sessionId = ? '
+                                                         'ORDER BY rowNum', (session_id,))]
+        # Not in the read transaction: turning it into a write would fail straight away if another worker is saving
+        self._db.execute('UPDATE sessions SET accessed = ? WHERE sessionId = ?', (time.time(), session_id))
+
+        population = Population._wrapColumns({name: self._fromBlob(blobs['population', name]) for name in COLUMNS})
+        flips = storage.restoreFlips(params['flips'],
+                                     {name: self._fromBlob(blobs['flips', name]) for name in Flips.COLUMNS},
+                                     population=population)
+        meta = params['history']
+        if meta['type'] == 'StreamingHistory':
+            history = StreamingHistory(includeTopX=meta['includeTopX'], orderStats=meta['orderStats'],
+                                       inequality=meta['inequality'])
+            if history_rows:
+                rows = np.frombuffer(b''.join(history_rows), dtype=self._rowDtype(meta))
+                history._columns = {name: rows[name].copy() for name in rows.dtype.names}
+                history._size = len(rows)
+        else:
+            history = pickle.loads(blobs['history', 'pickle'])
+        return storage.restoreFlipper(CoinFlipper, params['flipper'], population, flips, history)
+
+    @staticmethod
+    def _rowDtype(meta):
+        return np.dtype([(name, dtype) for name, dtype in meta['columns']])
+
+    def _historyRows(self, db, session_id, history, old_meta, includeTopX):
+        """Update the session's History rows. Returns the History's params"""
+        if type(history) is not StreamingHistory:
+            history.getStatsOverTime(includeTopX=includeTopX)
+            db.execute('DELETE FROM historyRows WHERE sessionId = ?', (session_id,))
+            db.execute('INSERT INTO arrays VALUES (?, ?, ?, ?)',
+                       (session_id, 'history', 'pickle', pickle.dumps(history)))
+            return {'type': 'pickle', 'length': len(history)}
+
+        meta = {'type': 'StreamingHistory', 'includeTopX': history.includeTopX, 'orderStats': history.orderStats,
+                'inequality': history.inequality, 'length': len(history),
+                'columns': [[name, col.dtype.str] for name, col in history._columns.items()]}
+        rows = np.empty(len(history), dtype=self._rowDtype(meta))
+        for name, col in history._columns.items():
+            rows[name] = col[:len(history)]
+        # Only insert the new rows, as long as the stored ones are the start of this History
+        start = 0
+        if old_meta and old_meta.get('columns') == meta['columns'] and 0 < old_meta['length'] <= len(history):
+            last = db.execute('SELECT data FROM historyRows WHERE sessionId = ? AND rowNum = ?',
+                              (session_id, old_meta['length'] - 1)).fetchone()
+            if last is not None and last[0] == rows[old_meta['length'] - 1].tobytes():
+                start = old_meta['length']
+        if not start:
+            db.execute('DELETE FROM historyRows WHERE sessionId = ?', (session_id,))
+        db.executemany('INSERT INTO historyRows VALUES (?, ?, ?)',
+                       ((session_id, i, rows[i].tobytes()) for i in range(start, len(rows))))
+        return meta
+
+    def save(self, sessionId, flipper, includeTopX=True):
+        session_id, now = str(sessionId), time.time()
+        blobs = {('population', name): self._toBlob(flipper.population.getColumn(name, copy=False))
+                 for name in COLUMNS}
+        blobs.update({('flips', name): self._toBlob(flipper.flips.getColumn(name)) for name in Flips.COLUMNS})
+        with self._transaction(immediate=True) as db:
+            row = db.execute('SELECT params, version, created FROM sessions WHERE sessionId = ?',
+                             (session_id,)).fetchone()
+            old_params = json.loads(row[0]) if row else None
+            version, created = (row[1] + 1, row[2]) if row else (0, now)
+            if row is None:
+                # The session's row has to exist before its arrays and History rows can refer to it
+                db.execute('INSERT INTO sessions VALUES (?, ?, ?, ?, ?, ?)', (session_id, '{}', version, now, now, 0))
+            db.execute('DELETE FROM arrays WHERE sessionId = ?', (session_id,))
+            db.executemany('INSERT INTO arrays VALUES (?, ?, ?, ?)',
+                           ((session_id, part, name, blob) for (part, name), blob in blobs.items()))
+            params = {
+                'flipper': storage.flipperParams(flipper),
+                'flips': storage.flipsMeta(flipper.flips),
+                'history': self._historyRows(db, session_id, flipper.history,
+                                             old_params and old_params.get('history'), includeTopX)
+            }
+            num_bytes = db.execute('SELECT (SELECT COALESCE(SUM(LENGTH(data)), 0) FROM arrays WHERE sessionId = ?) + '
+                                   '(SELECT COALESCE(SUM(LENGTH(data)), 0) FROM historyRows WHERE sessionId = ?)',
+                                   (session_id, session_id)).fetchone()[0]
+            db.execute('UPDATE sessions SET params = ?, version = ?, created = ?, accessed = ?, numBytes = ? '
+                       'WHERE sessionId = ?', (json.dumps(params), version, created, now, num_bytes, session_id))
+        self.evict(keep=session_id)
+        return version
+
+    def delete(self, sessionId):
+        with self._transaction(immediate=True) as db:
+            db.execute('DELETE FROM sessions WHERE sessionId = ?', (str(sessionId),))
+        shutil.rmtree(self.tmpDir(sessionId), ignore_errors=True)
+
+    def evict(self, keep=None):
+        evicted = []
+        with self._transaction(immediate=True) as db:
+            if self.ttl:
+                evicted += [session_id for session_id, in db.execute(
+                    'SELECT sessionId FROM sessions WHERE accessed < ? AND sessionId IS NOT ?',
+                    (time.time() - self.ttl, keep))]
+            if self.maxBytes:
+                total = 0
+                # From the most recently used, so the sessions past the quota are the least recently used ones
+                for session_id, num_bytes in db.execute('SELECT sessionId, numBytes FROM sessions '
+                                                        'ORDER BY sessionId IS ? DESC, accessed DESC',
+                                                        (keep,)).fetchall():
+                    if session_id in evicted:
+                        continue
+                    total += num_bytes
+                    if total > self.maxBytes and session_id != keep:
+                        evicted.append(session_id)
+            db.executemany('DELETE FROM sessions WHERE sessionId = ?', ((session_id,) for session_id in evicted))
+        for session_id in evicted:
+            logging.info(f'Evicted session {session_id} from {self}')
+            shutil.rmtree(self.tmpDir(session_id), ignore_errors=True)
+        return evicted
+
+    def close(self):
+        db = getattr(self._local, 'db', None)
+        if db is not None:
+            db.close()
+            self._local.db = None
+
+
+class _Transaction:
+    """BEGIN ... COMMIT (or ROLLBACK, on an exception) on a connection in autocommit mode
+        With immediate, the write lock is taken at the start, so two saves can not both read and then both write
+    """
+    def __init__(self, db, immediate=False):
+        self.db = db
+        self.immediate = immediate
+
+    def __enter__(self):
+        self.db.execute('BEGIN IMMEDIATE' if self.immediate else 'BEGIN')
+        return self.db
+
+    def __exit__(self, excType, excValue, traceback):
+        self.db.execute('ROLLBACK' if excType else 'COMMIT')
+        return False
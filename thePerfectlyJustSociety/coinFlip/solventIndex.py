@@ -0,0 +1,74 @@
+
+# Built-In Python
+import random
+
+# Third-Party
+import numpy as np
+
+
+class SolventIndex:
+    """The positions of the People in a Population who have more than $0
+
+        Members are kept packed at the front of an array, with each position's place in that array alongside it, so a
+        Person can be added or removed in O(1) (by swapping with the last member) and a uniform random sample of
+        members costs O(1) per Person, no matter how big the Population is.
+    """
+    def __init__(self, money):
+        money = np.asarray(money)
+        solvent = np.flatnonzero(money > 0)
+        self._members = np.empty(len(money), dtype=np.int64)
+        self._members[:len(solvent)] = solvent
+        # Where each position is in self._members (-1 if it is not a member)
+        self._places = np.full(len(money), -1, dtype=np.int64)
+        self._places[solvent] = np.arange(len(solvent))
+        self._size = len(solvent)
+        # The Population version this index matches (kept up to date by whoever changes the money)
+        self.version = None
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__} | Solvent: {len(self):,} / {self.populationSize:,}>"
+
+    def __len__(self):
+        return self._size
+
+    def __contains__(self, position):
+        return self._places[position] >= 0
+
+    @property
+    def populationSize(self):
+        return len(self._places)
+
+    @property
+    def members(self):
+        """The positions of the solvent People (a view, in no particular order)"""
+        return self._members[:self._size]
+
+    def add(self, position):
+        if position not in self:
+            self._members[self._size] = position
+            self._places[position] = self._size
+            self._size += 1
+
+    def remove(self, position):
+        place = self._places[position]
+        if place >= 0:
+            last = self._members[self._size - 1]
+            self._members[place] = last
+            self._places[last] = place
+            self._places[position] = -1
+            self._size -= 1
+
+    def update(self, position, money):
+        """Add or remove a position, after its money has changed"""
+        if money > 0:
+            self.add(position)
+        else:
+            self.remove(position)
+
+    def sample(self, n, rng=None):
+        """n different solvent positions, picked uniformly at random
+            Args:
+                rng: A np.random.Generator to pick them with (the built-in random module if None)
+        """
+        picks = random.sample(range(self._size), n) if rng is None else rng.choice(self._size, n, replace=False)
+        return [int(self._members[i]) for i in picks]
@@ -0,0 +1,352 @@
+
+# Built-In Python
+from pathlib import Path
+import json
+import os
+import pickle
+import shutil
+import uuid
+
+# Third-Party
+import numpy as np
+import pandas as pd
+
+# Custom
+from .population import Population, COLUMNS
+from .flips import Flips
+from .history import History, StreamingHistory, MemmapHistory, DeltaHistory
+
+# Bumped whenever the layout changes. Saves from newer versions can not be loaded
+FORMAT_VERSION = 2
+MANIFEST_FILE = 'manifest.json'
+# The parts of a saved flipper, each in its own subdirectory
+PARTS = ('population', 'flips', 'history')
+
+# A saved flipper is a directory with a manifest.json (the format version, the flipper's parameters, counters and
+# which columns each part has) and a data directory with a subdirectory of .npy files (one per column) for each of
+# PARTS. Arrays are loaded with np.memmap (copy-on-write), so loading costs next to nothing however big the population
+# is, and only the pages that are used are ever read. Each part can also be loaded on its own.
+# Every save writes a new data directory and then renames a new manifest over the old one, so a save is atomic: the
+# manifest always describes a complete save. The data directory of the save before is kept until the next save, so a
+# reader (in another process) that read the old manifest just before it was replaced can still load it. loadFlipper
+# starts again from the new manifest if it is any slower than that. Saving over a flipper that was loaded (and is still
+# memory-mapped) from the same directory is safe.
+# Version 1 kept the parts directly in the directory (with no data directory).
+
+
+def isSaved(directory):
+    """True if directory holds a saved flipper"""
+    return Path(directory).joinpath(MANIFEST_FILE).exists()
+
+
+def _writeFile(path: Path, write):
+    """Write a file through write(file object), replacing path only once it is complete"""
+    tmp_path = path.with_name(f'.{path.name}.tmp')
+    with open(tmp_path, 'wb') as f:
+        write(f)
+    os.replace(tmp_path, path)
+
+
+def _saveArrays(directory: Path, arrays):
+    directory.mkdir(parents=True, exist_ok=True)
+    for name, values in arrays.items():
+        _writeFile(directory.joinpath(f'{name}.npy'), lambda f, v=values: np.save(f, np.ascontiguousarray(v)))
+
+
+def _loadArray(path: Path, mmap=True):
+    if mmap:
+        try:
+            # A plain ndarray view of a copy-on-write map. Changes stay in memory and never reach the file
+            return np.asarray(np.load(path, mmap_mode='c'))
+        except ValueError:
+            # Empty arrays can not be memory-mapped
+            pass
+    return np.load(path)
+
+
+def _loadArrays(directory: Path, names, mmap=True):
+    return {name: _loadArray(directory.joinpath(f'{name}.npy'), mmap=mmap) for name in names}
+
+
+def _saveArrayList(directory: Path, name, arrays):
+    """Save a list of 1D arrays as one array and the offsets where each one starts"""
+    arrays = [np.asarray(a) for a in arrays]
+    offsets = np.cumsum([0] + [len(a) for a in arrays])
+    values = np.concatenate(arrays) if arrays else np.empty(0, dtype=np.int64)
+    _saveArrays(directory, {name: values, f'{name}_offsets': offsets})
+
+
+def _loadArrayList(directory: Path, name, mmap=True):
+    arrays = _loadArrays(directory, [name, f'{name}_offsets'], mmap=mmap)
+    offsets = arrays[f'{name}_offsets'].tolist()
+    return [arrays[name][start:end] for start, end in zip(offsets[:-1], offsets[1:])]
+
+
+def _saveFrame(directory: Path, df: pd.DataFrame):
+    """Save a DataFrame's numeric columns. Returns the manifest entry _loadFrame needs"""
+    # Columns that started out empty (as object columns) may hold numbers
+    df = df.infer_objects()
+    columns = [name for name in df.columns if df[name].dtype.kind in 'iufb']
+    _saveArrays(directory, {f'column_{i}': df[name].to_numpy() for i, name in enumerate(columns)})
+    return {'columns': columns}
+
+
+def _loadFrame(directory: Path, meta, mmap=True):
+    arrays = _loadArrays(directory, [f'column_{i}' for i in range(len(meta['columns']))], mmap=mmap)
+    return pd.DataFrame({name: arrays[f'column_{i}'] for i, name in enumerate(meta['columns'])}, copy=False)
+
+
+def readManifest(directory):
+    """The manifest of a saved flipper (its parameters, counters and which columns each part has)"""
+    manifest_path = Path(directory).joinpath(MANIFEST_FILE)
+    if not manifest_path.exists():
+        raise Exception(f"{directory} is not a saved flipper (it has no {MANIFEST_FILE})")
+    manifest = json.loads(manifest_path.read_text())
+    if manifest['formatVersion'] > FORMAT_VERSION:
+        raise Exception(f"{directory} was saved with format version {manifest['formatVersion']}, but only versions up "
+                        f"to {FORMAT_VERSION} can be loaded. Update thePerfectlyJustSociety to load it.")
+    return manifest
+
+
+def _dataDir(directory, manifest):
+    """The directory the parts of a saved flipper are in"""
+    return Path(directory).joinpath(manifest.get('dataDir', '.'))
+
+
+def _savePopulation(population: Population, directory: Path):
+    _saveArrays(directory, {name: population.getColumn(name, copy=False) for name in COLUMNS})
+    return {'size': len(population)}
+
+
+def loadPopulation(directory, mmap=True, manifest=None):
+    """Only load the Population of a saved flipper
+        Args:
+            manifest: The manifest, if it has already been read (so every part comes from the same save)
+    """
+    data_dir = _dataDir(directory, manifest or readManifest(directory))
+    return Population._wrapColumns(_loadArrays(data_dir.joinpath('population'), COLUMNS, mmap=mmap))
+
+
+def _saveFlips(flips: Flips, directory: Path):
+    _saveArrays(directory, {name: flips.getColumn(name) for name in Flips.COLUMNS})
+    return flipsMeta(flips)
+
+
+def flipsMeta(flips: Flips):
+    """Everything about a flip log apart from its columns (what restoreFlips needs along with them)"""
+    return {
+        'retention': flips.retention,
+        'keepLast': flips.keepLast,
+        'count': flips._count,
+        'numSettled': flips._numSettled,
+        'numRecorded': flips._numRecorded,
+        'numDropped': flips._numDropped,
+        'runFlips': flips._runFlips,
+        'runRecords': flips._runRecords
+    }
+
+
+def loadFlips(directory, population=None, mmap=True, manifest=None):
+    """Only load the flip log of a saved flipper
+        Args:
+            population: The Population the flips' winner and loser rows refer to (needed to index single flips)
+            manifest: See loadPopulation
+    """
+    manifest = manifest or readManifest(directory)
+    columns = _loadArrays(_dataDir(directory, manifest).joinpath('flips'), Flips.COLUMNS, mmap=mmap)
+    return restoreFlips(manifest['flips'], columns, population=population)
+
+
+def restoreFlips(meta, columns, population=None):
+    """A flip log from its flipsMeta and columns"""
+    flips = Flips(retention=meta['retention'], keepLast=meta['keepLast'], population=population)
+    flips._columns = {name: columns[name] for name in Flips.COLUMNS}
+    flips._size = len(flips._columns['settled'])
+    flips._count, flips._numSettled = meta['count'], meta['numSettled']
+    flips._numRecorded, flips._numDropped = meta['numRecorded'], meta['numDropped']
+    flips._runFlips, flips._runRecords = meta['runFlips'], meta['runRecords']
+    return flips
+
+
+def _saveHistory(history: History, directory: Path):
+    kind = type(history)
+    if kind is History:
+        _saveArrays(directory, {'numFlips': np.asarray(history.numFlips, dtype=np.int64)})
+        for name in COLUMNS:
+            _saveArrayList(directory, name, [df[name].to_numpy() for df in history.populationDfs])
+        return {'type': 'History', 'stats': _saveFrame(directory.joinpath('stats'), history.stats)}
+    if kind is StreamingHistory:
+        columns = {name: col[:history._size] for name, col in history._columns.items()}
+        _saveArrays(directory, {f'column_{i}': col for i, col in enumerate(columns.values())})
+        return {'type': 'StreamingHistory', 'columns': list(columns), 'includeTopX': history.includeTopX,
+                'orderStats': history.orderStats, 'inequality': history.inequality}
+    if kind is MemmapHistory:
+        # The snapshots are already on disk, so only remember where
+        history._flush()
+        return {'type': 'MemmapHistory', 'directory': str(history.directory.resolve()), 'length': len(history),
+                'includeTopX': history.includeTopX, 'stats': _saveFrame(directory.joinpath('stats'), history.stats)}
+    if kind is DeltaHistory:
+        _saveArrays(directory, {
+            'numFlips': np.asarray(history.numFlips, dtype=np.int64),
+            'keyframeFlips': np.asarray(history._keyframeFlips, dtype=np.int64),
+            **{f'delta_{name}': col[:history._numDeltas] for name, col in history._deltas.items()},
+            **{f'fixed_{name}': values for name, values in (history._fixedColumns or {}).items()}
+        })
+        for name in DeltaHistory.KEYFRAME_COLUMNS:
+            _saveArrayList(directory, f'keyframe_{name}', [keyframe[name] for keyframe in history._keyframes])
+        return {'type': 'DeltaHistory', 'keyframeEvery': history.keyframeEvery, 'includeTopX': history.includeTopX,
+                'hasFixedColumns': history._fixedColumns is not None,
+                'stats': _saveFrame(directory.joinpath('stats'), history.stats)}
+    # Any other kind of History is pickled
+    directory.mkdir(parents=True, exist_ok=True)
+    _writeFile(directory.joinpath('history.pickle'), lambda f: pickle.dump(history, f))
+    return {'type': 'pickle'}
+
+
+def loadHistory(directory, mmap=True, manifest=None):
+    """Only load the History of a saved flipper (see loadPopulation for manifest)"""
+    manifest = manifest or readManifest(directory)
+    meta = manifest['history']
+    history_dir = _dataDir(directory, manifest).joinpath('history')
+    kind = meta['type']
+    if kind == 'History':
+        history = History()
+        history.numFlips = _loadArray(history_dir.joinpath('numFlips.npy'), mmap=False).tolist()
+        columns = {name: _loadArrayList(history_dir, name, mmap=mmap) for name in COLUMNS}
+        history.populationDfs = [pd.DataFrame({name: columns[name][i] for name in COLUMNS}, copy=False)
+                                 for i in range(len(history.numFlips))]
+        history.moneyStamps = [df['money'].to_numpy() for df in history.populationDfs]
+        stats = _loadFrame(history_dir.joinpath('stats'), meta['stats'], mmap=mmap)
+        if len(stats):
+            stats.insert(1, 'money', history.moneyStamps[:len(stats)])
+            history.stats = stats
+    elif kind == 'StreamingHistory':
+        history = StreamingHistory(includeTopX=meta['includeTopX'], orderStats=meta['orderStats'],
+                                   inequality=meta['inequality'])
+        arrays = _loadArrays(history_dir, [f'column_{i}' for i in range(len(meta['columns']))], mmap=mmap)
+        columns = {name: arrays[f'column_{i}'] for i, name in enumerate(meta['columns'])}
+        if len(columns['numFlips']):
+            history._columns, history._size = columns, len(columns['numFlips'])
+    elif kind == 'MemmapHistory':
+        history = MemmapHistory(meta['directory'], includeTopX=meta['includeTopX'])
+        # Ignore any snapshots added after this was saved (they are left alone, see MemmapHistory._open)
+        history._len = min(history._len, meta['length'])
+        stats = _loadFrame(history_dir.joinpath('stats'), meta['stats'], mmap=mmap)
+        if len(stats):
+            history.stats = stats
+    elif kind == 'DeltaHistory':
+        history = DeltaHistory(keyframeEvery=meta['keyframeEvery'], includeTopX=meta['includeTopX'])
+        names = ['numFlips', 'keyframeFlips', *[f'delta_{name}' for name in DeltaHistory.DELTA_COLUMNS]]
+        if meta['hasFixedColumns']:
+            names += ['fixed_idNum', 'fixed_startMoney']
+        arrays = _loadArrays(history_dir, names, mmap=mmap)
+        history.numFlips = arrays['numFlips'].tolist()
+        history._keyframeFlips = arrays['keyframeFlips'].tolist()
+        history._deltas = {name: arrays[f'delta_{name}'] for name in DeltaHistory.DELTA_COLUMNS}
+        history._numDeltas = len(history._deltas['flip'])
+        keyframes = {name: _loadArrayList(history_dir, f'keyframe_{name}', mmap=mmap)
+                     for name in DeltaHistory.KEYFRAME_COLUMNS}
+        history._keyframes = [{name: keyframes[name][i] for name in DeltaHistory.KEYFRAME_COLUMNS}
+                              for i in range(len(history._keyframeFlips))]
+        if meta['hasFixedColumns']:
+            history._fixedColumns = {'idNum': arrays['fixed_idNum'], 'startMoney': arrays['fixed_startMoney']}
+        stats = _loadFrame(history_dir.joinpath('stats'), meta['stats'], mmap=mmap)
+        if len(stats):
+            history.stats = stats
+    elif kind == 'pickle':
+        with open(history_dir.joinpath('history.pickle'), 'rb') as f:
+            history = pickle.load(f)
+    else:
+        raise Exception(f"Unknown History type in {directory}: {kind}")
+    return history
+
+
+def loadHistoryStats(directory, includeTopX=True):
+    """Only load the History's stats of a saved flipper (see History.getStatsOverTime)"""
+    return loadHistory(directory).getStatsOverTime(includeTopX=includeTopX)
+
+
+def saveFlipper(flipper, directory, computeStats=True, includeTopX=True, extra=None):
+    """Save a CoinFlipper to directory (replacing anything saved there)
+        Args:
+            computeStats: If True, compute the History's stats first, so they are saved with it
+            extra: A dict (of anything json can write) to keep in the manifest, for whatever is saving the flipper
+    """
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    if computeStats:
+        flipper.history.getStatsOverTime(includeTopX=includeTopX)
+    data_dir = directory.joinpath(f'data_{uuid.uuid4().hex[:12]}')
+    # Readers may still be loading the save this replaces, so its data is only deleted by the next save
+    previous = readManifest(directory).get('dataDir', '.') if isSaved(directory) else None
+    manifest = {
+        'formatVersion': FORMAT_VERSION,
+        'dataDir': data_dir.name,
+        'flipper': flipperParams(flipper),
+        'population': _savePopulation(flipper.population, data_dir.joinpath('population')),
+        'flips': _saveFlips(flipper.flips, data_dir.joinpath('flips')),
+        'history': _saveHistory(flipper.history, data_dir.joinpath('history')),
+        'extra': extra or {}
+    }
+    # The manifest goes last, so it only ever describes a save that is completely written
+    _writeFile(directory.joinpath(MANIFEST_FILE), lambda f: f.write(json.dumps(manifest, indent=2).encode()))
+    # Clean up older saves (including ones in the version 1 layout, which kept the parts in directory itself)
+    for path in directory.iterdir():
+        if not path.is_dir() or not (path.name.startswith('data_') or path.name in PARTS):
+            continue
+        if (path.name if path.name.startswith('data_') else '.') not in (data_dir.name, previous):
+            shutil.rmtree(path, ignore_errors=True)
+
+
+def loadFlipper(directory, flipperClass, mmap=True, retries=3):
+    """Load a CoinFlipper (of type flipperClass) saved by saveFlipper
+        Args:
+            mmap: If True, memory-map the arrays instead of reading them (see the module's docstring)
+            retries: How many times to start again from the new manifest if the save being loaded is deleted by
+                     later saves (from another process) before it is loaded
+    """
+    directory = Path(directory)
+    manifest = readManifest(directory)
+    while True:
+        try:
+            population = loadPopulation(directory, mmap=mmap, manifest=manifest)
+            return restoreFlipper(flipperClass, manifest['flipper'], population,
+                                  loadFlips(directory, population=population, mmap=mmap, manifest=manifest),
+                                  loadHistory(directory, mmap=mmap, manifest=manifest))
+        except FileNotFoundError:
+            latest = readManifest(directory)
+            if not retries or latest.get('dataDir') == manifest.get('dataDir'):
+                raise
+            manifest, retries = latest, retries - 1
+
+
+def flipperParams(flipper):
+    """A flipper's parameters and counters (what restoreFlipper needs along with its parts)"""
+    return {
+        'dollarsPerFlip': flipper.dollarsPerFlip,
+        'allowDebt': flipper.allowDebt,
+        'brokeIsOut': flipper.brokeIsOut,
+        'selectionStyle': flipper.selectionStyle,
+        'cacheDir': str(flipper.cacheDir),
+        'numRounds': flipper.numRounds,
+        'rngState': flipper.rng.bit_generator.state
+    }
+
+
+def restoreFlipper(flipperClass, params, population, flips, history):
+    """A flipper (of type flipperClass) from its flipperParams and parts"""
+    flipper = flipperClass.__new__(flipperClass)
+    flipper.population = population
+    flipper.dollarsPerFlip = params['dollarsPerFlip']
+    flipper.allowDebt = params['allowDebt']
+    flipper.brokeIsOut = params['brokeIsOut']
+    flipper.selectionStyle = params['selectionStyle']
+    bit_generator = getattr(np.random, params['rngState']['bit_generator'])()
+    bit_generator.state = params['rngState']
+    flipper.rng = np.random.Generator(bit_generator)
+    flipper.cacheDir = Path(params['cacheDir'])
+    flipper._solventIndex = None
+    flipper.numRounds = params['numRounds']
+    flipper.flips = flips
+    flipper.history = history
+    return flipper
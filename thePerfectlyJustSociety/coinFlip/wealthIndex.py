@@ -0,0 +1,215 @@
+
+# Third-Party
+import numpy as np
+
+
+class WealthIndex:
+    """Order statistics (min, max, median, the k-th poorest, the wealth of the richest m) over People's money
+
+        Two Fenwick trees are kept over the range of money values: one counts the People with each value and one sums
+        their money. Changing one Person's money and every query cost O(log R), where R is the size of the range (which
+        is doubled whenever a value falls outside it), so the stats can be kept after every flip without sorting.
+        The trees start out covering just the range of money the People have. They take 24 bytes for every value in
+        the range, so the range may not be wider than maxRange (a few values per Person). An OverflowError is raised if
+        the money would need a wider one (e.g. one very rich Person), and the caller should fall back to sorting.
+    """
+    # The widest range allowed is MAX_RANGE_PER_PERSON values per Person, or MIN_RANGE (about 100 KB of trees) if
+    # that is wider. Small Populations that spread out further than that are cheap to sort anyway
+    MIN_RANGE = 1 << 12
+    MAX_RANGE_PER_PERSON = 4
+
+    def __init__(self, money):
+        money = np.asarray(money, dtype=np.int64)
+        self._size = len(money)
+        self._total = int(money.sum())
+        low = int(money.min()) if len(money) else 0
+        high = int(money.max()) if len(money) else 0
+        self._checkRange(low, high)
+        self._build(np.bincount(money - low, minlength=high - low + 1), low)
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__} | People: {len(self):,} | Range: ${self._low:,} to ${self._high:,}>"
+
+    def __len__(self):
+        return self._size
+
+    def _build(self, counts, low):
+        """Build the trees from the number of People with each value from low up"""
+        self._low = low
+        self._counts = np.asarray(counts, dtype=np.int64)
+        values = low + np.arange(len(self._counts), dtype=np.int64)
+        self._countTree = self._toTree(self._counts)
+        self._sumTree = self._toTree(self._counts * values)
+        # The largest power of two that is not past the end of the trees (where every descent starts)
+        self._topStep = 1 << (len(self._counts).bit_length() - 1)
+
+    @staticmethod
+    def _toTree(values):
+        """A (1-indexed) Fenwick tree over values, built in O(R)"""
+        prefix = np.concatenate([[0], np.cumsum(values)])
+        idx = np.arange(1, len(values) + 1)
+        return np.concatenate([[0], prefix[idx] - prefix[idx - (idx & -idx)]])
+
+    @property
+    def _high(self):
+        return self._low + len(self._counts) - 1
+
+    def maxRange(self, size=None):
+        """The widest range of money values allowed for size People (len(self) by default)"""
+        return max(self.MIN_RANGE, self.MAX_RANGE_PER_PERSON * (self._size if size is None else size))
+
+    def _checkRange(self, low, high):
+        if high - low + 1 > self.maxRange():
+            raise OverflowError(f"Money from ${low:,} to ${high:,} is too wide a range for a "
+                                f"{self.__class__.__name__} of {self._size:,} People (the most is {self.maxRange():,})")
+
+    def _grow(self, low, high):
+        """Make the range cover low to high (at least doubling it, so growing is rare, but no wider than maxRange)"""
+        new_low, new_high = min(low, self._low), max(high, self._high)
+        self._checkRange(new_low, new_high)
+        wanted = min(2 * len(self._counts), self.maxRange())
+        spare = max(wanted, new_high - new_low + 1) - (new_high - new_low + 1)
+        new_low -= spare // 2
+        new_high += spare - spare // 2
+        counts = np.zeros(new_high - new_low + 1, dtype=np.int64)
+        counts[self._low - new_low:self._high - new_low + 1] = self._counts
+        self._build(counts, new_low)
+
+    def _addCounts(self, values, counts):
+        """Add counts[i] People with money values[i] (counts may be negative)"""
+        values = np.asarray(values, dtype=np.int64)
+        counts = np.asarray(counts, dtype=np.int64)
+        if not values.size:
+            return
+        low, high = int(values.min()), int(values.max())
+        if low < self._low or high > self._high:
+            self._grow(low, high)
+        np.add.at(self._counts, values - self._low, counts)
+        self._size += int(counts.sum())
+        self._total += int((values * counts).sum())
+        # Walk every index up its tree at once, dropping the ones that have reached the end
+        idx, amounts = values - self._low + 1, values * counts
+        while len(idx):
+            np.add.at(self._countTree, idx, counts)
+            np.add.at(self._sumTree, idx, amounts)
+            idx = idx + (idx & -idx)
+            keep = idx < len(self._countTree)
+            idx, counts, amounts = idx[keep], counts[keep], amounts[keep]
+
+    def _addOne(self, value, count):
+        """_addCounts for a single value, without the overhead of arrays"""
+        if not self._low <= value <= self._high:
+            self._grow(value, value)
+        self._counts[value - self._low] += count
+        self._size += count
+        self._total += value * count
+        idx, end, amount = value - self._low + 1, len(self._countTree), value * count
+        count_tree, sum_tree = self._countTree, self._sumTree
+        while idx < end:
+            count_tree[idx] += count
+            sum_tree[idx] += amount
+            idx += idx & -idx
+
+    def add(self, money):
+        """Add People with the given money (a single value or an array)"""
+        if np.ndim(money):
+            self._addCounts(money, np.ones(np.size(money), dtype=np.int64))
+        else:
+            self._addOne(int(money), 1)
+
+    def update(self, old, new):
+        """Move People from their old money to their new money (single values, or arrays of the same length)"""
+        if np.ndim(old) or np.ndim(new):
+            old, new = np.atleast_1d(old), np.atleast_1d(new)
+            self._addCounts(np.concatenate([old, new]),
+                            np.concatenate([np.full(len(old), -1), np.ones(len(new), dtype=np.int64)]))
+        elif old != new:
+            self._addOne(int(old), -1)
+            self._addOne(int(new), 1)
+
+    def _descend(self, k):
+        """The money of the k-th poorest Person (from 0), with how many People have less and how much they have"""
+        if not 0 <= k < self._size:
+            raise IndexError(f"{self} has no Person at rank {k}")
+        pos, below, below_sum, remaining = 0, 0, 0, k + 1
+        step, end = self._topStep, len(self._countTree)
+        count_tree, sum_tree = self._countTree, self._sumTree
+        while step:
+            nxt = pos + step
+            if nxt < end and count_tree[nxt] < remaining:
+                pos = nxt
+                remaining -= int(count_tree[nxt])
+                below += int(count_tree[nxt])
+                below_sum += int(sum_tree[nxt])
+            step >>= 1
+        return self._low + pos, below, below_sum
+
+    def kth(self, k):
+        """The money of the k-th poorest Person (from 0)"""
+        return self._descend(k)[0]
+
+    def sumSmallest(self, k):
+        """The total money of the k poorest People"""
+        if k <= 0:
+            return 0
+        value, below, below_sum = self._descend(k - 1)
+        return below_sum + (k - below) * value
+
+    def sumLargest(self, m):
+        """The total money of the m wealthiest People"""
+        return self._total - self.sumSmallest(self._size - m)
+
+    def histogram(self):
+        """(values, counts): every money value someone has, from the smallest, and how many People have it"""
+        values = np.flatnonzero(self._counts)
+        return self._low + values, self._counts[values]
+
+    @property
+    def total(self):
+        return self._total
+
+    @property
+    def mean(self):
+        return self._total / self._size
+
+    @property
+    def min(self):
+        return self.kth(0)
+
+    @property
+    def max(self):
+        return self.kth(self._size - 1)
+
+    @property
+    def median(self):
+        return (self.kth((self._size - 1) // 2) + self.kth(self._size // 2)) / 2
+
+    def topXPercentShare(self, topX):
+        """The percent of the total wealth held by the wealthiest topX percent (as Population.getWealthiestXPercent)"""
+        return self.sumLargest(round(self._size * topX / 100)) / self._total * 100
+
+    def statsRow(self, includeTopX=True):
+        """The same stats as history.getStatsRow, without sorting anything
+            The 'top X' columns take two descents per bin (about 200 for 100 bins), which costs more than a sort
+            for most Populations, so StreamingHistory only uses this without them.
+        """
+        row_data = {
+            'total': self.total,
+            'max': self.max,
+            'min': self.min,
+            'mean': self.mean,
+            'median': self.median
+        }
+        if includeTopX:
+            # The bins np.array_split would make of the People, sorted from the wealthiest
+            num_bins = round(self._size * 0.1)
+            if num_bins:
+                bin_size, num_bigger = divmod(self._size, num_bins)
+                use_indices = includeTopX if isinstance(includeTopX, list) else list(range(0, 100))
+                for idx in use_indices:
+                    if idx < num_bins:
+                        start = idx * bin_size + min(idx, num_bigger)
+                        end = start + bin_size + (idx < num_bigger)
+                        bin_total = self.sumLargest(end) - self.sumLargest(start)
+                        row_data[f"top_{idx}_to_{idx+1}_percent_wealth"] = bin_total / self.total * 100
+        return row_data
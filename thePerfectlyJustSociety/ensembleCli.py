@@ -0,0 +1,5 @@
+from fire import Fire
+from coinFlip.ensemble import runEnsemble, showResult
+
+if __name__ == '__main__':
+    Fire(runEnsemble, serialize=showResult)
@@ -0,0 +1,68 @@
+
+# Built-In Python
+import time
+
+# Third-Party
+import numpy as np
+import pandas as pd
+from fire import Fire
+
+# Custom
+from thePerfectlyJustSociety import Population
+
+
+def rangeByPercent(population, lowPercent, highPercent):
+    """getWealthRangeByPercent the way it used to be done, sorting every time it is called"""
+    money = population.getColumn('money', copy=False).astype(np.int64)
+    order = np.argsort(-money, kind='stable')
+    this_range = order[round(len(population) * highPercent / 100): round(len(population) * lowPercent / 100)]
+    return population._subPopulation(this_range, parent=population)
+
+
+def perRangeStatsByTopXRanges(population, percentages=None):
+    """getStatsByTopXRanges the way it used to be done: one sort (and one SubPopulation) per range"""
+    top_x_percentages = percentages or range(101)
+    stats = [rangeByPercent(population, lowPercent=top_x_percentages[i + 1], highPercent=p)
+             .statsDict(top_x_percent_low=int(top_x_percentages[i + 1]), top_x_percent_high=int(p))
+             for i, p in enumerate(top_x_percentages[:-1])]
+    return pd.DataFrame(stats)
+
+
+def timeIt(func, repeats, setup=None):
+    """The best time (in seconds) of a number of calls to func
+        Args:
+            setup: Called (untimed) before each call to func
+    """
+    times = []
+    for _ in range(repeats):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def benchmark(sizes=(1_000, 100_000, 1_000_000), startMoney=100, repeats=3, seed=0):
+    """Compare getStatsByTopXRanges (a single sort) to one sort per range, for populations of different sizes"""
+    rng = np.random.default_rng(seed)
+    results = []
+    for size in sizes:
+        population = Population().add(size, startMoney)
+        # Spread the wealth out a bit, so the sorts have some work to do
+        money = rng.integers(0, 2 * startMoney, size=size)
+        population.setColumn('money', money)
+
+        # Setting the money again bumps the Population's version before every call, so the single sort is never
+        # served from the sort cache
+        per_range = timeIt(lambda: perRangeStatsByTopXRanges(population), repeats)
+        single_sort = timeIt(lambda: population.getStatsByTopXRanges(), repeats,
+                             setup=lambda: population.setColumn('money', money))
+        results.append({'people': size, 'per_range_seconds': per_range, 'single_sort_seconds': single_sort,
+                        'speedup': per_range / single_sort})
+
+    print(pd.DataFrame(results).to_string(index=False))
+
+
+if __name__ == '__main__':
+    Fire(benchmark)
@@ -1,11 +1,18 @@
 
 import logging
 from fire import Fire
-from webapp.main import app
+from webapp.main import app, job_queue
 
 
-def runServer(verbosity='INFO', debug=True, port='8050'):
+def runServer(verbosity='INFO', debug=True, port='8050', workers=True):
+    """
+        Args:
+            workers: If True, start the pool of job workers that flips the coins (unless one is already running, e.g.
+                     in the debug reloader's other process), otherwise run it separately (see coinFlip/jobs.py)
+    """
     logging.getLogger().setLevel(verbosity)
+    if workers:
+        job_queue.start()
     app.run(port=port, debug=debug)
 
 
@@ -6,7 +6,7 @@ import uuid
 from main import FlipperManager, getUpdatedGraph, INCLUDE_TOP_X
 from thePerfectlyJustSociety.coinFlip.pollableThread import PollableCoinFlipper
 
-FLIPPER_PATH = Path('flipperCache/session_xyz/THE_BEST_FLIPPER.pickle')
+FLIPPER_PATH = Path('flipperCache/session_xyz/THE_BEST_FLIPPER.flipper')
 
 
 def update(set_progress, wealth_distribution_dropdown_value, history_dropdown_value, numCoinFlipClicks,
@@ -20,7 +20,9 @@ def update(set_progress, wealth_distribution_dropdown_value, history_dropdown_va
     progress_callback(0.0)
     # The most recent flipper
     flipper_path = FLIPPER_PATH
-    flipper = FlipperManager.get(flipper_path)
+    flip_manager = FlipperManager(popSize=1000, startMoney=100, dollarsPerFlip=1, allowDebt=False,
+                                  includeTopX=INCLUDE_TOP_X, sessionId='session_xyz')
+    flipper = flip_manager.get(flipper_path)
     # In-Progress flips will be saved to this path, so if the process is cancelled,
     # the previous flipper is not corrupted
     in_progress_dir = FLIPPER_PATH.parent.joinpath('tmp')
@@ -34,9 +36,9 @@ def update(set_progress, wealth_distribution_dropdown_value, history_dropdown_va
     # Regularly poll the thread and update the progress bar
     thread.pollEvery(0.5, progress_callback, pollAtStart=True)
     # The newly updated flipper
-    flipper = FlipperManager.get(in_progress_path)
+    flipper = flip_manager.get(in_progress_path)
     # Overwrite the old flipper
-    FlipperManager.save(flipper, FLIPPER_PATH)
+    flip_manager.save(flipper, FLIPPER_PATH)
     # Delete the in-progress file.
     # This method is cancellable with no cleanup method (Dash limitation)
     # So we delete the whole directory, which will also clean old, missed files
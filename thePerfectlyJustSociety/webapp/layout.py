@@ -1,3 +1,6 @@
+# Built-In Python
+import uuid
+
 # Third-Party
 from dash import html, dcc
 
@@ -14,12 +17,17 @@ class Layout:
         self.explanations = Explanation()
 
     def getLayout(self):
+        """The page's layout. This is called for every page load (see app.layout in main.py), so each new browser
+        session gets its own session id"""
         # Layout
         layout = html.Div(
             id='parent',
             style={'display': 'flex', 'flex-direction': 'column', 'align-items': 'center',
                    'justify-content': 'center', 'width': '100%'},
             children=[
+                # Which session's flipper to use. Kept by the browser tab, so reloading the page keeps the session
+                dcc.Store(id='session_id', storage_type='session', data=uuid.uuid4().hex),
+
                 # Main Title
                 html.H1(id='H1', children=self.title,
                         style={'textAlign': 'center', 'marginTop': 40, 'marginBottom': 10}),
@@ -1,21 +1,22 @@
 
 # Built-In Python
-import shutil
+import base64
 import time
-import uuid
 from datetime import datetime
 import logging
 
 # Third-Party
-from dash import Dash, ctx
+from dash import Dash, ctx, no_update
 from dash.dependencies import Input, Output, State
 from dash.long_callback import DiskcacheLongCallbackManager
+import numpy as np
 import plotly.graph_objects as go
 import diskcache
 
 # Custom
-from thePerfectlyJustSociety.coinFlip.pollableThread import PollableCoinFlipper
 from thePerfectlyJustSociety.coinFlip.flipManager import FlipperManager
+from thePerfectlyJustSociety.coinFlip.sessionStore import SqliteSessionStore
+from thePerfectlyJustSociety.coinFlip.jobs import JobQueue, TooManyJobs, flipJob, FINISHED
 from .screen import Screen
 from .layout import Layout
 from .style import Style
@@ -26,6 +27,12 @@ from .explanation import Explanation
 # Constants
 INCLUDE_TOP_X = [0, 99]
 
+# Every session's flipper, shared by all of the app's workers
+session_store = SqliteSessionStore('flipperCache/sessions.sqlite')
+# Coin flipping jobs, run by a pool of worker processes shared by every session. The server starts the pool (see
+# server.py), or it can be run on its own (see jobs.runWorkers)
+job_queue = JobQueue('flipperCache/jobs.sqlite', maxJobsPerSession=1)
+
 # Disk Cache
 cache = diskcache.Cache("./cache")
 long_callback_manager = DiskcacheLongCallbackManager(cache)
@@ -36,16 +43,16 @@ external_stylesheets = ['https://codepen.io/chriddyp/pen/bWLwgP.css',
 app = Dash(__name__, external_stylesheets=external_stylesheets, long_callback_manager=long_callback_manager)
 app.title = "The Perfectly Just Society."
 
-# Get the layout
+# Get the layout (for every page load, so each browser session gets its own session id)
 layout = Layout(app.title)
-app.layout = layout.getLayout()
+app.layout = layout.getLayout
 
 
 @app.long_callback(
     inputs=Screen.stateMap('input'),
     output=Screen.stateMap('output'),
-    progress=Output("progress_bar", "figure"),
-    progress_default=make_progress_graph(0, 100),
+    progress=[Output("progress_bar", "figure"), Output("flip_history_plot", "extendData")],
+    progress_default=[make_progress_graph(0, 100), None],
     interval=250,
     running=[
         (Output("num_flips_text_input", "disabled"), True, False),
@@ -70,7 +77,8 @@ def update(set_progress, explanationSectionStyle, explanationStyle, explanationT
            paramSectionStyle, coinFlipBottomSectionStyle, coinFlipEditButtonStyle,
            popSize, startMoney, numConfirmPopClicks, editPopClicks, wealth_distribution_dropdown_value,
            history_dropdown_value,
-           numCoinFlipClicks, coinFlipEditButtonClicks, numFlips, numResetClicks, dollarsPerFlip, nextButtonClicks):
+           numCoinFlipClicks, coinFlipEditButtonClicks, numFlips, numResetClicks, dollarsPerFlip, nextButtonClicks,
+           sessionId):
     """Update the screen"""
 
     logging.info(f'Update: {datetime.now().strftime("%H:%M:%S")}: {ctx.triggered_id}')
@@ -90,7 +98,8 @@ def update(set_progress, explanationSectionStyle, explanationStyle, explanationT
 
     # Get the flipper
     flip_manager = FlipperManager(popSize=int(popSize), startMoney=int(startMoney), dollarsPerFlip=int(dollarsPerFlip),
-                                  allowDebt=False, includeTopX=INCLUDE_TOP_X)
+                                  allowDebt=False, includeTopX=INCLUDE_TOP_X, sessionId=sessionId,
+                                  store=session_store)
 
     if nextButtonClicks == 0:
         flip_manager.reset()
@@ -120,7 +129,7 @@ def update(set_progress, explanationSectionStyle, explanationStyle, explanationT
                     logging.warning(
                         'WARNING: The old flipper does not seem to match the requested population properties. '
                         'Starting a new population.')
-                    FlipperManager.save(flipper)
+                    flip_manager.save(flipper)
 
             # Update the text
             screen.updatePopulationText(flipper)
@@ -131,43 +140,20 @@ def update(set_progress, explanationSectionStyle, explanationStyle, explanationT
 
         elif ctx.triggered_id == 'coin_flip_button':  # Flip a coin some number of times
             # Show the Wealth Distribution Graph
-            # TODO: It would be good if this could update dynamically as the coins are flipped
             screen.showWealthGraph()
 
-            # This is updated at an interval specified in PollableCoinFlipper(progressEvery=numFlips)
-            # When Pollable CoinFlipper is not being used, the process will be fast so just do some dummy progress
-            def progress_callback(progressRatio):
-                set_progress(make_progress_graph(int(progressRatio * 100), 100))
+            def progress_callback(progressRatio, historyExtension=no_update):
+                set_progress((make_progress_graph(int(progressRatio * 100), 100), historyExtension))
 
             # Update the progress to 0
             progress_callback(0.0)
-            # The most recent flipper
-            flipper_path = FlipperManager.getFilepath()
-            flipper = flip_manager.get(flipper_path)
-            # In-Progress flips will be saved to this path, so if the process is cancelled,
-            # the previous flipper is not corrupted
-            in_progress_dir = flipper_path.parent.joinpath('tmp')
-            in_progress_path = in_progress_dir.joinpath(f'{flipper_path.stem}_tmp_{uuid.uuid4()}{flipper_path.suffix}')
-            # A Pollable / Stoppable Thread
-            save_every = (int(numFlips) // 10) or 1
-            thread = PollableCoinFlipper(flipper=flipper, flipperPath=in_progress_path,
-                                         numFlips=numFlips, progressEvery=1, saveEvery=save_every,
-                                         saveTopX=flip_manager.includeTopX)
-            thread.start()
-            # Regularly poll the thread and update the progress bar
-            # (The code blocks here, but the @long_callback decorator means the update function will still be called
-            #  once per second)
-            thread.pollEvery(0.5, progress_callback, pollAtStart=True)
-            # The newly updated flipper
-            flipper = flip_manager.get(in_progress_path)
-            # Overwrite the old flipper
-            FlipperManager.save(flipper, flipper_path)
-            # Delete the in-progress file.
-            # This method is cancellable with no cleanup method (Dash limitation)
-            # So we delete the whole directory, which will also clean old, missed files
-            shutil.rmtree(str(in_progress_dir), ignore_errors=True)
+            error = flipInJob(flip_manager, int(numFlips), progress_callback, history_dropdown_value, historyFig)
+            # The newly updated flipper (its save is newer than any cached flipper, so it is loaded)
+            flipper = flip_manager.get()
             # Message beneath the buttons
             screen.updateCoinFlipText(flipper)
+            if error:
+                screen.coinFlipText = error
             # Set progress bar to 100%
             progress_callback(1.0)
             # Sleep so Progress Bar still goes to 100% if the flips happen very quickly
@@ -206,6 +192,86 @@ def update(set_progress, explanationSectionStyle, explanationStyle, explanationT
     return screen.args()
 
 
+def flipInJob(flip_manager, numFlips, progress_callback, history_dropdown_value, history_fig):
+    """Flip coins for the session in one of the job workers, updating the progress bar and history graph as it goes
+        The job saves the session's flipper when done, so if this callback is cancelled the previous flipper is not
+        corrupted. Cancelling the callback does not reach the job, though, so it is cancelled here by the session's next
+        flip (or once it has not been polled for a few seconds). A cancelled job checkpoints its flips, and the next
+        one for the same number of flips carries on from there (see flipJob).
+        Args:
+            history_fig: The history graph's figure as the browser has it (so points it already has are not resent)
+        Returns:
+            A message for the user if the coins could not be flipped, otherwise None
+    """
+    session_id = flip_manager.sessionId
+    if not job_queue.cancelSession(session_id, wait=5):
+        logging.warning(f'Session {session_id} still has a job running after cancelling it')
+    try:
+        job_id = job_queue.submit(session_id, flipJob, session_store, session_id, numFlips,
+                                  includeTopX=flip_manager.includeTopX, abandonAfter=5)
+    except TooManyJobs:
+        return 'Your last coin flips are still stopping. Please try again in a moment.'
+
+    # Regularly poll the job and update the progress bar. The History rows the job has added since the last poll
+    # are appended to the history graph, so it updates as the coins are flipped
+    # (The code blocks here, but the @long_callback decorator means the update function will still be called
+    #  once per second)
+    num_updates = 0
+    last_x = lastHistoryX(history_fig)
+    while True:
+        status = job_queue.status(job_id)
+        updates, num_updates = job_queue.updates(job_id, since=num_updates)
+        progress_callback(status['progress'], getHistoryExtension(history_dropdown_value, updates, after=last_x))
+        if status['state'] in FINISHED:
+            break
+        if not job_queue.workersAlive():
+            job_queue.cancel(job_id)
+            logging.error(f'There are no job workers for {job_queue.path}. Start them with server.py or jobs.py')
+            return 'The coins can not be flipped right now (there is nothing to flip them). Please try again later.'
+        time.sleep(0.25)
+    try:
+        job_queue.result(job_id)
+    except Exception:
+        logging.exception(f'Job {job_id} did not finish')
+        return 'Something went wrong flipping the coins. Please try again.'
+    return None
+
+
+def lastHistoryX(fig):
+    """The last x of a history graph's figure (as the browser sent it), or None if it has no points"""
+    try:
+        x = fig['data'][0]['x']
+    except (KeyError, IndexError, TypeError):
+        return None
+    if isinstance(x, dict):
+        # Plotly sends numeric arrays base64 encoded
+        x = np.frombuffer(base64.b64decode(x['bdata']), dtype=x['dtype'])
+    return x[-1] if x is not None and len(x) else None
+
+
+def getHistoryExtension(dropdown_value, updates, after=None):
+    """The flip history graph's extendData for the History rows in a flipJob's updates (see JobQueue.updates), so
+    only the new points are sent. no_update if there are none, or the graph does not show the History's rows
+        Args:
+            dropdown_value: The value from the history dropdown menu (the id of a DropdownOption object)
+            updates: The updates a flipJob has published since the last poll
+            after: If given, only the points with a greater x (the graph already has the others, e.g. from a job that
+                   was cancelled and has been carried on)
+    """
+    selected_option = DropdownOption.getById(dropdown_value)
+    rows = [update['historyRows'] for update in updates if 'historyRows' in update]
+    keys = [selected_option.xKey, selected_option.yKey]
+    if selected_option.graphFrom != 'flip_history' or not rows or any(key not in r for r in rows for key in keys):
+        return no_update
+    x, y = (np.concatenate([r[key] for r in rows]) for key in keys)
+    if after is not None:
+        new = x > after
+        x, y = x[new], y[new]
+        if not len(x):
+            return no_update
+    return dict(x=[x.tolist()], y=[y.tolist()]), [0]
+
+
 def getUpdatedGraph(dropdown_value, flipper):
     """Get a Plotly figure for a graph
         Args:
@@ -249,4 +315,5 @@ def getUpdatedGraph(dropdown_value, flipper):
 
 if __name__ == '__main__':
     logging.getLogger().setLevel('INFO')
+    job_queue.start()
     app.run_server(debug=True)
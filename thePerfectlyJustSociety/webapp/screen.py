@@ -88,6 +88,7 @@ class Screen:
                 Input('reset_coin_flips_button', 'n_clicks'),
                 State('dollars_per_flip_text_input', 'value'),
                 Input('next_button', 'n_clicks'),
+                State('session_id', 'data'),
             ]
             return input_states + hard_coded_inputs
         elif get == 'output':